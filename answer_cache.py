@@ -0,0 +1,119 @@
+"""Per-project cache of generated answers, looked up by query similarity.
+
+A question whose embedding is within ``threshold`` cosine similarity of a cached
+question gets the cached answer back without retrieval or generation. Entries expire
+after ``ttl`` seconds and the least recently used ones are evicted beyond ``max_size``.
+The cache is stored as ``answer_cache.json`` in the project folder together with a
+fingerprint of the project's index; when the index changes the old answers are dropped.
+"""
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from time import time
+from typing import Iterator, Optional
+
+import numpy as np
+
+from similarity import normalize
+
+
+class AnswerCache:
+    """Similarity-keyed LRU/TTL cache of one project's answers."""
+
+    FILE_NAME = "answer_cache.json"
+
+    def __init__(self, folder: str, fingerprint: str, threshold: float = 0.95, max_size: int = 256,
+                 ttl: float = 7 * 24 * 3600):
+        self.path = os.path.join(folder, self.FILE_NAME)
+        self.fingerprint = fingerprint
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # question -> {"vector", "answer", "created"}, least recently used first
+        self._entries = OrderedDict()
+        # Stacked vectors of the entries and their questions, rebuilt after changes
+        self._matrix = None
+        self._questions = []
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable answer cache {self.path}: {e}")
+            return
+        if data.get("fingerprint") != self.fingerprint:
+            print("Project index changed; discarding cached answers")
+            return
+        for entry in data.get("entries", []):
+            self._entries[entry["question"]] = {
+                "vector": np.asarray(entry["vector"], dtype=np.float32),
+                "answer": entry["answer"],
+                "created": entry["created"],
+            }
+        self._expire()
+
+    def _save(self):
+        entries = [{"question": question, "vector": entry["vector"].tolist(), "answer": entry["answer"],
+                    "created": entry["created"]} for question, entry in self._entries.items()]
+        with open(self.path + ".tmp", 'w', encoding='utf-8') as file:
+            json.dump({"fingerprint": self.fingerprint, "entries": entries}, file)
+        os.replace(self.path + ".tmp", self.path)
+
+    def _expire(self):
+        cutoff = time() - self.ttl
+        for question in [q for q, entry in self._entries.items() if entry["created"] < cutoff]:
+            del self._entries[question]
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def lookup(self, embedding) -> Optional[str]:
+        """The cached answer of the most similar cached question, if it is similar enough."""
+        query = normalize(embedding)
+        with self._lock:
+            if self._entries and any(entry["created"] < time() - self.ttl for entry in self._entries.values()):
+                self._expire()
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._questions = list(self._entries)
+                self._matrix = np.stack([self._entries[question]["vector"] for question in self._questions])
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            question = self._questions[best]
+            self._entries.move_to_end(question)
+            self.hits += 1
+            return self._entries[question]["answer"]
+
+    def put(self, question: str, embedding, answer: str):
+        if not answer.strip():
+            return
+        with self._lock:
+            self._entries[question] = {"vector": normalize(embedding), "answer": answer, "created": time()}
+            self._entries.move_to_end(question)
+            self._expire()
+            self._save()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "threshold": self.threshold, "max_size": self.max_size, "ttl": self.ttl}
+
+
+def replay(answer: str) -> Iterator[str]:
+    """Yield a cached answer word by word, like a model streaming it."""
+    yield from re.findall(r"\s*\S+|\s+", answer)
@@ -37,6 +37,7 @@ const chatProjectSubtitle = document.getElementById('chat-project-subtitle');
 const chatMessages = document.getElementById('chat-messages');
 const chatInput = document.getElementById('chat-input');
 const sendBtn = document.getElementById('send-btn');
+const stopBtn = document.getElementById('stop-btn');
 const clearChatBtn = document.getElementById('clear-chat-btn');
 const typingIndicator = document.getElementById('typing-indicator');
 
@@ -288,6 +289,7 @@ function showHomePage() {
     if (homePage) homePage.classList.remove('hidden');
     if (header) header.classList.remove('header--collapsed');
     
+    stopGeneration();
     currentProjectId = null;
 }
 
@@ -367,21 +369,54 @@ function sendMessage() {
     sendStreamingMessage(message);
 }
 
+// The streaming request in progress: { requestId, controller }
+let activeRequest = null;
+
+function setGenerating(generating) {
+    if (stopBtn) stopBtn.classList.toggle('hidden', !generating);
+    if (sendBtn) sendBtn.classList.toggle('hidden', generating);
+}
+
+function stopGeneration() {
+    if (!activeRequest) return;
+    const { requestId, controller } = activeRequest;
+    // Cancel on the server, then drop the connection; either one stops generation
+    if (requestId) {
+        fetch(`http://localhost:5001/api/cancel/${requestId}`, { method: 'POST' })
+            .catch(error => console.log('Error cancelling request:', error))
+            .finally(() => controller.abort());
+    } else {
+        controller.abort();
+    }
+}
+
 async function sendStreamingMessage(message) {
+    const controller = new AbortController();
+    activeRequest = { requestId: null, controller };
+    setGenerating(true);
+    let assistantMessageId = null;
+    let stopped = false;
     try {
         const response = await fetch(`http://localhost:5001/api/chat-stream/${currentProjectId}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ query: message })
+            body: JSON.stringify({ query: message }),
+            signal: controller.signal
         });
         
+        if (response.status === 429) {
+            const data = await response.json().catch(() => ({}));
+            const retryAfter = data.retry_after || response.headers.get('Retry-After');
+            throw new Error(`The assistant is busy, please try again${retryAfter ? ` in ${retryAfter}s` : ''}`);
+        }
         if (!response.ok) {
             throw new Error(`HTTP ${response.status}: ${response.statusText}`);
         }
         
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
-        let assistantMessageId = addMessage('', 'assistant');
+        assistantMessageId = addMessage('', 'assistant');
+        let queued = false;
         
         while (true) {
             const { value, done } = await reader.read();
@@ -394,8 +429,23 @@ async function sendStreamingMessage(message) {
                 if (line.startsWith('data: ')) {
                     try {
                         const data = JSON.parse(line.slice(6));
-                        if (data.type === 'chunk') {
+                        if (data.type === 'start') {
+                            activeRequest.requestId = data.request_id;
+                        } else if (data.type === 'queued') {
+                            queued = true;
+                            setMessageText(assistantMessageId, `⏳ Waiting in queue (position ${data.position}, about ${Math.ceil(data.eta)}s)`);
+                        } else if (data.type === 'chunk') {
+                            if (queued) {
+                                queued = false;
+                                setMessageText(assistantMessageId, '');
+                            }
                             appendToMessage(assistantMessageId, data.content);
+                        } else if (data.type === 'end') {
+                            if (queued) setMessageText(assistantMessageId, '');
+                            if (data.cancelled && !stopped) {
+                                stopped = true;
+                                appendToMessage(assistantMessageId, '\n\n⏹ Stopped');
+                            }
                         } else if (data.type === 'error') {
                             appendToMessage(assistantMessageId, `\n\n❌ Error: ${data.message}`);
                         }
@@ -406,7 +456,16 @@ async function sendStreamingMessage(message) {
             }
         }
     } catch (error) {
-        addMessage(`❌ Error: ${error.message}`, 'assistant');
+        if (error.name === 'AbortError') {
+            if (assistantMessageId && !stopped) appendToMessage(assistantMessageId, '\n\n⏹ Stopped');
+        } else {
+            addMessage(`❌ Error: ${error.message}`, 'assistant');
+        }
+    } finally {
+        if (activeRequest?.controller === controller) {
+            activeRequest = null;
+            setGenerating(false);
+        }
     }
 }
 
@@ -429,6 +488,12 @@ function addMessage(content, sender) {
     return messageId;
 }
 
+function setMessageText(messageId, content) {
+    const messageEl = document.getElementById(messageId);
+    const p = messageEl?.querySelector('p');
+    if (p) p.textContent = content;
+}
+
 function appendToMessage(messageId, content) {
     const messageEl = document.getElementById(messageId);
     if (messageEl) {
@@ -582,6 +647,7 @@ function attachEventListeners() {
 
     // Chat functionality
     if (sendBtn) sendBtn.addEventListener('click', sendMessage);
+    if (stopBtn) stopBtn.addEventListener('click', stopGeneration);
     if (clearChatBtn) clearChatBtn.addEventListener('click', clearChat);
     if (backButton) backButton.addEventListener('click', showHomePage);
 
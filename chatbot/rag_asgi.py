@@ -0,0 +1,321 @@
+"""Async serving mode for the RAG backend.
+
+Serves the routes of rag_backend.py with the same JSON bodies and the same SSE and
+NDJSON streams, on Starlette under uvicorn (pip install starlette uvicorn):
+
+    python rag_asgi.py
+    uvicorn rag_asgi:app --host 0.0.0.0 --port 5001
+
+Streams wait for the model on the event loop (Ticket.astream) instead of holding a
+thread each, so one process keeps many slow or idle connections open cheaply. Blocking
+work (embedding, FAISS search, loading projects) runs in the thread pool and tokens are
+generated on the model's scheduler thread, so health and list requests are answered
+while answers stream. Projects, models and the queue are rag_backend's own.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import sys
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import rag_backend as backend
+from answer_cache import replay
+from generation_scheduler import QueueFull, QueueStatus
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that closes its iterator and calls on_close however the response
+    ends, like Flask's call_on_close, so an abandoned request stops generating at once."""
+
+    def __init__(self, content, on_close=None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            if self.on_close is not None:
+                self.on_close()
+
+
+def respond(result):
+    """A rag_backend handler's result, a body or (body, status[, headers]), as a Starlette response"""
+    if isinstance(result, tuple):
+        body, status, *headers = result
+        return JSONResponse(body, status, headers=headers[0] if headers else None)
+    return JSONResponse(result)
+
+
+async def handle(handler, *args):
+    """Run a blocking rag_backend handler in the thread pool"""
+    return respond(await run_in_threadpool(handler, *args))
+
+
+async def wait_for(*components, preload=None):
+    """rag_backend.wait_for without blocking the event loop; None when ready"""
+    error = backend.readiness_error(*components, preload=preload, timeout=0)
+    if error is not None and error[1] == 503:
+        # Still loading: wait for it in the thread pool
+        error = await run_in_threadpool(backend.readiness_error, *components, preload=preload)
+    return respond(error) if error else None
+
+
+async def json_body(request):
+    """The request's JSON body, or None like Flask's get_json() when there is none"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def submit_query(project_id, rag_system, query):
+    """rag_backend.submit_query answering with a Starlette response"""
+    try:
+        # The caller has already looked the query up in the answer cache
+        return backend.enqueue(project_id, rag_system, lambda: rag_system.query(query, check_cache=False)), None
+    except QueueFull as e:
+        return None, respond(backend.queue_full_error(e))
+
+
+async def cached_answer(rag_system, query):
+    """rag_system.cached_answer, embedding the query in the thread pool only when the project caches answers"""
+    if rag_system.answer_cache is None:
+        return None
+    return await run_in_threadpool(rag_system.cached_answer, query)
+
+
+async def collect(ticket):
+    """The whole answer of a ticket, waited for on the event loop"""
+    return ''.join([item async for item in ticket.astream() if not isinstance(item, QueueStatus)])
+
+
+async def api_health(request):
+    return respond(backend.health())
+
+
+async def api_create_project(request):
+    return await handle(backend.create_project, await json_body(request))
+
+
+async def api_initialize_project(request):
+    return await handle(backend.initialize_project, request.path_params['project_id'], await json_body(request))
+
+
+async def api_chat(request):
+    """Handle chat query for a specific project"""
+    project_id = request.path_params['project_id']
+    not_ready = await wait_for('modules', preload=project_id)
+    if not_ready:
+        return not_ready
+    try:
+        data = await json_body(request)
+        query = data.get('query', '').strip()
+
+        if not query:
+            return JSONResponse({'error': 'Query is required'}, 400)
+
+        # Check if RAG system is initialized
+        if project_id not in backend.active_rag_systems:
+            return JSONResponse({'error': 'RAG system not initialized for this project'}, 400)
+
+        rag_info = backend.active_rag_systems[project_id]
+        rag_system = rag_info['rag_system']
+
+        # Answer from the cache, or wait for the model in the project's queue and collect the whole answer
+        response = await cached_answer(rag_system, query)
+        if response is None:
+            ticket, rejected = submit_query(project_id, rag_system, query)
+            if rejected:
+                return rejected
+            try:
+                response = await collect(ticket)
+            finally:
+                backend.finish_query(ticket)
+
+        return JSONResponse({
+            'success': True,
+            'response': response,
+            'project_name': rag_info['project_name']
+        })
+
+    except Exception as e:
+        return JSONResponse({'error': f'Error processing query: {str(e)}'}, 500)
+
+
+async def api_chat_stream(request):
+    """Handle streaming chat query for a specific project"""
+    project_id = request.path_params['project_id']
+    not_ready = await wait_for(preload=project_id)
+    if not_ready:
+        return not_ready
+    try:
+        data = await json_body(request)
+        query = data.get('query', '').strip()
+
+        if not query:
+            return JSONResponse({'error': 'Query is required'}, 400)
+
+        # Check if RAG system is initialized
+        if project_id not in backend.active_rag_systems:
+            return JSONResponse({'error': 'RAG system not initialized for this project'}, 400)
+
+        rag_info = backend.active_rag_systems[project_id]
+        rag_system = rag_info['rag_system']
+
+        # A cached answer is replayed without touching the model
+        cached = await cached_answer(rag_system, query)
+        ticket = None
+        if cached is None:
+            # Reserve a place in the model's queue before the stream starts so a full queue is a plain 429
+            ticket, rejected = submit_query(project_id, rag_system, query)
+            if rejected:
+                return rejected
+
+        async def chunks():
+            if cached is not None:
+                for chunk in replay(cached):
+                    yield chunk
+            else:
+                async for chunk in ticket.astream():
+                    yield chunk
+
+        async def generate():
+            try:
+                # Send initial metadata
+                yield f"data: {json.dumps({'type': 'start', 'project': rag_info['project_name'], 'request_id': ticket.id if ticket else None, 'cached': cached is not None})}\n\n"
+
+                # Report the queue position while waiting for the model, then stream the response
+                async for chunk in chunks():
+                    if isinstance(chunk, QueueStatus):
+                        yield f"data: {json.dumps({'type': 'queued', **chunk.to_dict()})}\n\n"
+                    elif chunk is not None and chunk.strip():
+                        yield f"data: {json.dumps({'type': 'chunk', 'content': str(chunk)})}\n\n"
+
+                # Send end signal
+                yield f"data: {json.dumps({'type': 'end', 'cancelled': ticket.cancelled if ticket else False})}\n\n"
+
+            except Exception as e:
+                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+
+        return ClosingStreamingResponse(
+            generate(),
+            on_close=(lambda: backend.finish_query(ticket)) if ticket is not None else None,
+            media_type='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'Connection': 'keep-alive',
+                'Access-Control-Allow-Origin': '*'
+            }
+        )
+
+    except Exception as e:
+        return JSONResponse({'error': f'Error processing streaming query: {str(e)}'}, 500)
+
+
+async def batch_answer(project_id, rag_system, question, query_context, retrieved):
+    """rag_backend.batch_answer on the event loop; cancelling it cancels the answer in progress"""
+    while True:
+        try:
+            ticket = backend.enqueue(project_id, rag_system, lambda: rag_system.answer(question, query_context, retrieved))
+        except QueueFull as e:
+            await asyncio.sleep(max(0.1, e.retry_after))
+            continue
+        try:
+            answer = await collect(ticket)
+            return None if ticket.cancelled else answer
+        finally:
+            backend.finish_query(ticket)
+
+
+async def api_chat_batch(request):
+    """Answer many questions for a project, streamed back as one JSON object per line"""
+    project_id = request.path_params['project_id']
+    not_ready = await wait_for('modules', preload=project_id)
+    if not_ready:
+        return not_ready
+    try:
+        data = await json_body(request) or {}
+        questions, invalid = backend.batch_questions(data)
+        generate = bool(data.get('generate', True))
+
+        if invalid:
+            return respond(invalid)
+
+        # Check if RAG system is initialized
+        if project_id not in backend.active_rag_systems:
+            return JSONResponse({'error': 'RAG system not initialized for this project'}, 400)
+
+        rag_system = backend.active_rag_systems[project_id]['rag_system']
+
+        async def results():
+            try:
+                batch = await run_in_threadpool(rag_system.retrieve_batch, questions)
+                for index, (question, (query_context, retrieved)) in enumerate(zip(questions, batch)):
+                    result = {'index': index, 'question': question, 'sources': rag_system.sources(retrieved)}
+                    if generate:
+                        result['answer'] = await batch_answer(project_id, rag_system, question, query_context, retrieved)
+                        if result['answer'] is None:
+                            return
+                    yield json.dumps(result) + '\n'
+            except Exception as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+
+        return ClosingStreamingResponse(results(), media_type='application/x-ndjson', headers={'Cache-Control': 'no-cache'})
+
+    except Exception as e:
+        return JSONResponse({'error': f'Error processing batch query: {str(e)}'}, 500)
+
+
+async def api_cancel(request):
+    return respond(backend.cancel_request(request.path_params['request_id']))
+
+
+async def api_project_status(request):
+    return respond(backend.project_status(request.path_params['project_id']))
+
+
+async def api_list_projects(request):
+    return await handle(backend.list_projects)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Load modules, models and preloaded projects in the background as rag_backend does
+    backend.start_warmup()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/api/health', api_health),
+        Route('/api/create-project', api_create_project, methods=['POST']),
+        Route('/api/initialize-project/{project_id}', api_initialize_project, methods=['POST']),
+        Route('/api/chat/{project_id}', api_chat, methods=['POST']),
+        Route('/api/chat-stream/{project_id}', api_chat_stream, methods=['POST']),
+        Route('/api/chat-batch/{project_id}', api_chat_batch, methods=['POST']),
+        Route('/api/cancel/{request_id}', api_cancel, methods=['POST']),
+        Route('/api/project-status/{project_id}', api_project_status),
+        Route('/api/list-projects', api_list_projects),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("Starting RAG Backend Server (async)...")
+    print("\nServer running on http://localhost:5001")
+    uvicorn.run(app, host='0.0.0.0', port=5001)
@@ -9,13 +9,11 @@ import threading
 # Add parent directory to path to find functions.py and rag.py
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-try:
-    from functions import create_rag_system, create_rag_project, query_rag_system, list_project_files
-    print("✅ Successfully imported functions module")
-except ImportError as e:
-    print(f"❌ Failed to import functions module: {e}")
-    print("Make sure functions.py is in the parent directory")
-    sys.exit(1)
+from config import PROJECTS_DIR
+from answer_cache import replay
+from generation_scheduler import QueueFull, QueueStatus, scheduler_for
+from model_registry import acquire_embeddings, acquire_llm, registry
+from readiness import ComponentFailed, Readiness
 
 app = Flask(__name__)
 CORS(app)
@@ -23,69 +21,205 @@ CORS(app)
 # Global storage for active RAG systems
 active_rag_systems = {}
 
-@app.route('/api/health')
-def api_health():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
+# Components loaded in background threads at startup; see start_warmup()
+warmup = Readiness()
+# Seconds a request waits for a component that is still loading before it gets a 503
+WARMUP_WAIT = float(os.getenv("RAG_WARMUP_WAIT", "20"))
+RETRY_AFTER = 5
+# Comma-separated ids of projects to open at startup
+PRELOAD_PROJECTS = [p.strip() for p in os.getenv("RAG_PRELOAD_PROJECTS", "").split(",") if p.strip()]
+# References held for the server's lifetime so the models stay loaded between projects
+pinned_models = []
+# Chat requests allowed to wait for the LLM at once; further ones get a 429
+MAX_QUEUE = int(os.getenv("RAG_MAX_QUEUE", "8"))
+# Queued or running chat requests by request id, for /api/cancel
+active_requests = {}
+# Whether projects cache answers unless initialize-project says otherwise
+ANSWER_CACHE = os.getenv("RAG_ANSWER_CACHE", "").lower() in ("1", "true", "yes")
+# Most questions one /api/chat-batch request may carry
+MAX_BATCH = int(os.getenv("RAG_MAX_BATCH", "512"))
+
+def load_modules():
+    """Import the RAG modules, which pull in langchain, faiss and friends."""
+    global create_rag_system, create_rag_project, list_project_files, IndexSpec, ProjectManifest
+    from functions import create_rag_system, create_rag_project, list_project_files
+    from index_spec import IndexSpec
+    from project_manifest import ProjectManifest
+
+def preload_project(project_id):
+    """Open a project from the files recorded in its manifest"""
+    manifest = ProjectManifest.load(os.path.join(PROJECTS_DIR, project_id))
+    files = [path for path, entry in manifest.files.items() if 'error' not in entry]
+    if not files:
+        raise RuntimeError(f'Project {project_id} has no indexed files')
+    rag_system = create_rag_system(files=files, topic=project_id, add_metadata=False, answer_cache=ANSWER_CACHE)
+    active_rag_systems[project_id] = {
+        'rag_system': rag_system,
+        'project_name': project_id.replace('-', ' ').title(),
+        'files': files,
+        'initialized_at': time.time()
+    }
+
+def start_warmup():
+    """Start loading modules, models and preloaded projects; calling it again is a no-op."""
+    warmup.start('modules', load_modules)
+    warmup.start('embeddings', lambda: pinned_models.append(acquire_embeddings()))
+    warmup.start('llm', lambda: pinned_models.append(acquire_llm()))
+    for project_id in PRELOAD_PROJECTS:
+        warmup.start(f'project:{project_id}', lambda p=project_id: preload_project(p), after=('modules', 'embeddings', 'llm'))
+
+def readiness_error(*components, preload=None, timeout=None):
+    """Wait for components to load; returns None when ready, else the (body, status, headers) to send.
+
+    preload names a project being opened at startup: requests wait for it, but if it
+    failed they carry on and the project can still be initialized by hand. timeout
+    defaults to WARMUP_WAIT.
+    """
+    start_warmup()
+    timeout = WARMUP_WAIT if timeout is None else timeout
+    waiting = list(components)
+    try:
+        ready = warmup.wait(components, timeout=timeout)
+        if ready and preload:
+            waiting.append(f'project:{preload}')
+            try:
+                ready = warmup.wait([f'project:{preload}'], timeout=timeout)
+            except ComponentFailed:
+                pass
+        if ready:
+            return None
+    except ComponentFailed as e:
+        return {'error': str(e)}, 500, {}
+    return {
+        'error': 'The server is still loading; retry shortly',
+        'retry_after': RETRY_AFTER,
+        'components': {name: warmup.components[name].status() for name in waiting if name in warmup.components}
+    }, 503, {'Retry-After': str(RETRY_AFTER)}
+
+def respond(result):
+    """A handler's result, a body or (body, status[, headers]), as a Flask response"""
+    if isinstance(result, tuple):
+        return (jsonify(result[0]),) + result[1:]
+    return jsonify(result)
+
+def wait_for(*components, preload=None):
+    """readiness_error() as a Flask response, or None when ready"""
+    error = readiness_error(*components, preload=preload)
+    return respond(error) if error else None
+
+def queue_full_error(e):
+    """The 429 (body, status, headers) for a request turned away by a full model queue"""
+    retry_after = max(1, int(e.retry_after))
+    return {'error': str(e), 'retry_after': retry_after}, 429, {'Retry-After': str(retry_after)}
+
+def enqueue(project_id, rag_system, job):
+    """Queue a generation job on the project's LLM and register it for /api/cancel; raises QueueFull"""
+    ticket = scheduler_for(rag_system.llm_model, MAX_QUEUE).submit(project_id, job)
+    active_requests[ticket.id] = ticket
+    return ticket
+
+def submit_query(project_id, rag_system, query):
+    """Queue a query on the project's LLM; returns (ticket, None), or (None, 429 response) when the queue is full"""
+    try:
+        # The caller has already looked the query up in the answer cache
+        return enqueue(project_id, rag_system, lambda: rag_system.query(query, check_cache=False)), None
+    except QueueFull as e:
+        return None, respond(queue_full_error(e))
+
+def finish_query(ticket):
+    """Cancel the ticket if it is still queued or generating and forget it"""
+    ticket.cancel()
+    active_requests.pop(ticket.id, None)
+
+def health():
+    """Health check with the readiness of every background-loaded component"""
+    start_warmup()
+    return {
+        'status': warmup.overall(),
         'message': 'RAG Backend Server is running',
         'active_projects': len(active_rag_systems),
+        'components': warmup.status(),
+        'models': registry.stats(),
+        'generation': [scheduler_for(shared, MAX_QUEUE).stats() for shared in pinned_models if shared.kind == 'llm'],
         'endpoints': [
             'GET /api/health',
             'POST /api/initialize-project/<id>',
             'POST /api/chat-stream/<id>',
+            'POST /api/chat-batch/<id>',
+            'POST /api/cancel/<request_id>',
             'GET /api/project-status/<id>'
         ]
-    })
+    }
 
-@app.route('/api/create-project', methods=['POST'])
-def api_create_project():
+@app.route('/api/health')
+def api_health():
+    return respond(health())
+
+def create_project(data):
     """Create a new RAG project with uploaded files"""
+    not_ready = readiness_error('modules', 'embeddings', 'llm')
+    if not_ready:
+        return not_ready
     try:
-        data = request.get_json()
-        
         project_name = data.get('name')
         description = data.get('description', '')
         category = data.get('category', 'General')
         file_paths = data.get('filePaths', [])
+        index_spec = data.get('indexSpec')  # e.g. "hnsw" or {"type": "ivf", "nlist": 4096, "nprobe": 32}
         
         if not project_name:
-            return jsonify({'error': 'Project name is required'}), 400
+            return {'error': 'Project name is required'}, 400
         
         if not file_paths:
-            return jsonify({'error': 'At least one PDF file is required'}), 400
+            return {'error': 'At least one PDF file is required'}, 400
         
         # Create the RAG project
-        result = create_rag_project(project_name, file_paths, description, category)
+        try:
+            index_spec = IndexSpec.parse(index_spec)
+        except (TypeError, ValueError) as e:
+            return {'error': f'Invalid index spec: {e}'}, 400
+        result = create_rag_project(project_name, file_paths, description, category, index_spec)
         
         if 'error' in result:
-            return jsonify(result), 400
+            return result, 400
+        # The project is indexed; it is opened again by /api/initialize-project
+        result['rag_system'].close()
         
-        return jsonify({
+        return {
             'success': True,
             'message': f'Project "{project_name}" created successfully',
             'project_info': result['project_info']
-        })
+        }
         
     except Exception as e:
-        return jsonify({'error': f'Server error: {str(e)}'}), 500
+        return {'error': f'Server error: {str(e)}'}, 500
 
-@app.route('/api/initialize-project/<project_id>', methods=['POST'])
-def api_initialize_project(project_id):
+@app.route('/api/create-project', methods=['POST'])
+def api_create_project():
+    return respond(create_project(request.get_json()))
+
+def initialize_project(project_id, data):
     """Initialize a RAG system for a specific project"""
+    # A project being preloaded is returned from the cache below once it is ready
+    not_ready = readiness_error('modules', 'embeddings', 'llm', preload=project_id)
+    if not_ready:
+        return not_ready
     try:
-        data = request.get_json()
         project_name = data.get('name', f'Project_{project_id}')
         file_paths = data.get('filePaths', [])
+        index_spec = data.get('indexSpec')  # nprobe / ef_search override the project's search parameters
+        answer_cache = data.get('answerCache', ANSWER_CACHE)  # true, or {"threshold": 0.95, "max_size": 256, "ttl": 604800}
+        hybrid = data.get('hybrid')  # false for vector search only, or {"lexical_weight": 2.0, "lexical_k": 50}
+        rerank = data.get('rerank')  # false to keep retrieval order, or {"query_weight": 0.4, "top_k": 3}
         
         # Check if RAG system is already initialized
         if project_id in active_rag_systems:
-            return jsonify({
+            return {
                 'success': True,
                 'message': 'RAG system already initialized',
                 'cached': True,
                 'file_count': len(active_rag_systems[project_id]['files'])
-            })
+            }
         
         # Use default files if no file paths provided
         default_files = [
@@ -108,10 +242,10 @@ def api_initialize_project(project_id):
                     files_to_use.append(default_file)
         
         if not files_to_use:
-            return jsonify({
+            return {
                 'error': 'No PDF files found. Please make sure PDF files exist in the project directory.',
                 'checked_paths': default_files + [os.path.join('..', fp) for fp in file_paths] if file_paths else default_files
-            }), 400
+            }, 400
         
         print(f"🚀 Initializing RAG system for project: {project_name}")
         print(f"📁 Using files: {files_to_use}")
@@ -120,7 +254,11 @@ def api_initialize_project(project_id):
         rag_system = create_rag_system(
             files=files_to_use,
             topic=project_id,  # Use project_id instead of project_name for folder consistency
-            add_metadata=False
+            add_metadata=False,
+            index_spec=index_spec,
+            answer_cache=answer_cache,
+            hybrid=hybrid,
+            rerank=rerank
         )
         
         # Store the RAG system
@@ -133,20 +271,27 @@ def api_initialize_project(project_id):
         
         print(f"✅ RAG system initialized successfully for: {project_name}")
         
-        return jsonify({
+        return {
             'success': True,
             'message': f'RAG system initialized for project "{project_name}"',
             'file_count': len(files_to_use),
             'files_used': [os.path.basename(f) for f in files_to_use]
-        })
+        }
         
     except Exception as e:
         print(f"❌ Error initializing RAG system: {e}")
-        return jsonify({'error': f'Failed to initialize RAG system: {str(e)}'}), 500
+        return {'error': f'Failed to initialize RAG system: {str(e)}'}, 500
+
+@app.route('/api/initialize-project/<project_id>', methods=['POST'])
+def api_initialize_project(project_id):
+    return respond(initialize_project(project_id, request.get_json()))
 
 @app.route('/api/chat/<project_id>', methods=['POST'])
 def api_chat(project_id):
     """Handle chat query for a specific project"""
+    not_ready = wait_for('modules', preload=project_id)
+    if not_ready:
+        return not_ready
     try:
         data = request.get_json()
         query = data.get('query', '').strip()
@@ -161,8 +306,16 @@ def api_chat(project_id):
         rag_info = active_rag_systems[project_id]
         rag_system = rag_info['rag_system']
         
-        # Query the RAG system (non-streaming for now)
-        response = query_rag_system(rag_system, query)
+        # Answer from the cache, or wait for the model in the project's queue and collect the whole answer
+        response = rag_system.cached_answer(query)
+        if response is None:
+            ticket, rejected = submit_query(project_id, rag_system, query)
+            if rejected:
+                return rejected
+            try:
+                response = ''.join(item for item in ticket.stream() if not isinstance(item, QueueStatus))
+            finally:
+                finish_query(ticket)
         
         return jsonify({
             'success': True,
@@ -176,6 +329,9 @@ def api_chat(project_id):
 @app.route('/api/chat-stream/<project_id>', methods=['POST'])
 def api_chat_stream(project_id):
     """Handle streaming chat query for a specific project"""
+    not_ready = wait_for(preload=project_id)
+    if not_ready:
+        return not_ready
     try:
         data = request.get_json()
         query = data.get('query', '').strip()
@@ -190,23 +346,34 @@ def api_chat_stream(project_id):
         rag_info = active_rag_systems[project_id]
         rag_system = rag_info['rag_system']
         
+        # A cached answer is replayed without touching the model
+        cached = rag_system.cached_answer(query)
+        ticket = None
+        if cached is None:
+            # Reserve a place in the model's queue before the stream starts so a full queue is a plain 429
+            ticket, rejected = submit_query(project_id, rag_system, query)
+            if rejected:
+                return rejected
+        
         def generate():
             try:
                 # Send initial metadata
-                yield f"data: {json.dumps({'type': 'start', 'project': rag_info['project_name']})}\n\n"
+                yield f"data: {json.dumps({'type': 'start', 'project': rag_info['project_name'], 'request_id': ticket.id if ticket else None, 'cached': cached is not None})}\n\n"
                 
-                # Query the RAG system and stream the response
-                for chunk in rag_system.query(query):
-                    if chunk is not None and chunk.strip():
+                # Report the queue position while waiting for the model, then stream the response
+                for chunk in (replay(cached) if cached is not None else ticket.stream()):
+                    if isinstance(chunk, QueueStatus):
+                        yield f"data: {json.dumps({'type': 'queued', **chunk.to_dict()})}\n\n"
+                    elif chunk is not None and chunk.strip():
                         yield f"data: {json.dumps({'type': 'chunk', 'content': str(chunk)})}\n\n"
                 
                 # Send end signal
-                yield f"data: {json.dumps({'type': 'end'})}\n\n"
+                yield f"data: {json.dumps({'type': 'end', 'cancelled': ticket.cancelled if ticket else False})}\n\n"
                 
             except Exception as e:
                 yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
         
-        return app.response_class(
+        response = app.response_class(
             generate(),
             mimetype='text/event-stream',
             headers={
@@ -215,30 +382,141 @@ def api_chat_stream(project_id):
                 'Access-Control-Allow-Origin': '*'
             }
         )
+        if ticket is not None:
+            # Runs when the stream ends or the client disconnects (the next write fails), even
+            # before the stream started, so an abandoned request stops generating at once
+            response.call_on_close(lambda: finish_query(ticket))
+        return response
         
     except Exception as e:
         return jsonify({'error': f'Error processing streaming query: {str(e)}'}), 500
 
-@app.route('/api/project-status/<project_id>')
-def api_project_status(project_id):
+def batch_questions(data):
+    """The stripped questions of a /api/chat-batch body: (questions, None), or (None, 400 error)"""
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        return None, ({'error': 'questions must be a non-empty list of strings'}, 400)
+    if len(questions) > MAX_BATCH:
+        return None, ({'error': f'At most {MAX_BATCH} questions per batch'}, 400)
+    return [question.strip() for question in questions], None
+
+def batch_answer(project_id, rag_system, question, query_context, retrieved, batch):
+    """Generate one answer of a batch through the model queue, waiting while the queue is full.
+
+    Returns None when the batch was closed first.
+    """
+    while not batch['closed']:
+        try:
+            ticket = enqueue(project_id, rag_system, lambda: rag_system.answer(question, query_context, retrieved))
+        except QueueFull as e:
+            time.sleep(max(0.1, e.retry_after))
+            continue
+        batch['ticket'] = ticket
+        try:
+            answer = ''.join(item for item in ticket.stream() if not isinstance(item, QueueStatus))
+            return None if ticket.cancelled else answer
+        finally:
+            finish_query(ticket)
+            batch['ticket'] = None
+    return None
+
+@app.route('/api/chat-batch/<project_id>', methods=['POST'])
+def api_chat_batch(project_id):
+    """Answer many questions for a project, streamed back as one JSON object per line.
+
+    Body: {"questions": [...], "generate": true}. All questions are embedded in one call
+    and searched as one matrix; with generate off only the sources are returned, else each
+    answer is generated in turn through the model queue.
+    """
+    not_ready = wait_for('modules', preload=project_id)
+    if not_ready:
+        return not_ready
+    try:
+        data = request.get_json() or {}
+        questions, invalid = batch_questions(data)
+        generate = bool(data.get('generate', True))
+        
+        if invalid:
+            return respond(invalid)
+        
+        # Check if RAG system is initialized
+        if project_id not in active_rag_systems:
+            return jsonify({'error': 'RAG system not initialized for this project'}), 400
+        
+        rag_system = active_rag_systems[project_id]['rag_system']
+        batch = {'ticket': None, 'closed': False}
+        
+        def results():
+            try:
+                for index, (question, (query_context, retrieved)) in enumerate(zip(questions, rag_system.retrieve_batch(questions))):
+                    result = {'index': index, 'question': question, 'sources': rag_system.sources(retrieved)}
+                    if generate:
+                        result['answer'] = batch_answer(project_id, rag_system, question, query_context, retrieved, batch)
+                        if result['answer'] is None:
+                            return
+                    yield json.dumps(result) + '\n'
+            except Exception as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+        
+        def close():
+            # The client went away: stop generating the answer in progress and skip the rest
+            batch['closed'] = True
+            if batch['ticket'] is not None:
+                batch['ticket'].cancel()
+        
+        response = app.response_class(results(), mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache'})
+        response.call_on_close(close)
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': f'Error processing batch query: {str(e)}'}), 500
+
+def cancel_request(request_id):
+    """Stop a queued or running chat request; its stream ends with a cancelled end event"""
+    ticket = active_requests.get(request_id)
+    if ticket is None:
+        return {'error': 'No such request, or it already finished'}, 404
+    ticket.cancel()
+    return {'success': True, 'request_id': request_id}
+
+@app.route('/api/cancel/<request_id>', methods=['POST'])
+def api_cancel(request_id):
+    return respond(cancel_request(request_id))
+
+def project_status(project_id):
     """Get status of a RAG project"""
+    component = warmup.components.get(f'project:{project_id}')
+    if component is not None and component.state != 'ready' and project_id not in active_rag_systems:
+        return {
+            'initialized': False,
+            'preload': component.status(),
+            'message': 'RAG system is being preloaded' if component.state != 'failed' else 'Preloading failed'
+        }
     if project_id in active_rag_systems:
         rag_info = active_rag_systems[project_id]
-        return jsonify({
+        answer_cache = rag_info['rag_system'].answer_cache
+        return {
             'initialized': True,
             'project_name': rag_info['project_name'],
             'file_count': len(rag_info['files']),
-            'initialized_at': rag_info['initialized_at']
-        })
+            'initialized_at': rag_info['initialized_at'],
+            'answer_cache': answer_cache.stats() if answer_cache is not None else None
+        }
     else:
-        return jsonify({
+        return {
             'initialized': False,
             'message': 'RAG system not initialized for this project'
-        })
+        }
 
-@app.route('/api/list-projects')
-def api_list_projects():
+@app.route('/api/project-status/<project_id>')
+def api_project_status(project_id):
+    return respond(project_status(project_id))
+
+def list_projects():
     """List all available projects from the projects folder"""
+    not_ready = readiness_error('modules')
+    if not_ready:
+        return not_ready
     try:
         projects = []
         projects_folder = 'projects'
@@ -256,10 +534,14 @@ def api_list_projects():
                         'file_count': len(files)
                     })
         
-        return jsonify({'projects': projects})
+        return {'projects': projects}
         
     except Exception as e:
-        return jsonify({'error': f'Error listing projects: {str(e)}'}), 500
+        return {'error': f'Error listing projects: {str(e)}'}, 500
+
+@app.route('/api/list-projects')
+def api_list_projects():
+    return respond(list_projects())
 
 if __name__ == '__main__':
     print("Starting RAG Backend Server...")
@@ -268,8 +550,14 @@ if __name__ == '__main__':
     print("  POST /api/initialize-project/<id> - Initialize RAG system")
     print("  POST /api/chat/<id> - Chat with project (non-streaming)")
     print("  POST /api/chat-stream/<id> - Chat with project (streaming)")
+    print("  POST /api/chat-batch/<id> - Answer many questions (NDJSON)")
+    print("  POST /api/cancel/<request_id> - Stop a streaming chat request")
     print("  GET /api/project-status/<id> - Get project status")
     print("  GET /api/list-projects - List all projects")
     print("\nServer running on http://localhost:5001")
     
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    debug = True
+    # With the debug reloader, only the serving child process loads models
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup()
+    app.run(debug=debug, host='0.0.0.0', port=5001)
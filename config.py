@@ -0,0 +1,14 @@
+import os
+
+# Model paths (override with the environment variables listed in .env.example)
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "C:\\models\\static-mrl")
+LLM_MODEL_PATH = os.getenv("LLM_MODEL_PATH", "C:\\Users\\User\\Desktop\\LLM\\Rag\\models\\gemma3n-e2b.gguf")
+
+# Where project indexes are stored
+PROJECTS_DIR = "./projects"
+
+# Where evaluated prompt-prefix states are kept, one folder per LLM
+PROMPT_CACHE_DIR = os.getenv("PROMPT_CACHE_DIR", "./prompt_cache")
+
+# Trained query router (see train_router.py); questions it deems general skip retrieval
+ROUTER_PATH = os.getenv("ROUTER_PATH", "./router.npz")
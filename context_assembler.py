@@ -0,0 +1,119 @@
+"""Fits retrieved text into the model's context window.
+
+Chunks are split with overlap, so neighbouring chunks of a page repeat each other's
+edges. Retrieved chunks of the same page with consecutive chunk ids are stitched into
+one passage on their longest suffix/prefix match (at most the chunk overlap), so the
+overlapping text appears once and sentences cut at a chunk edge are whole again. The
+passage is then split into sentences and summarized as one span; sentences already in
+the context are dropped, and passages are added in relevance order until the token
+budget is used up.
+"""
+import re
+from typing import Callable, List, Tuple
+
+
+def _boundary(text: str, index: int) -> bool:
+    """True when index falls between words of text, or at either end."""
+    return index <= 0 or index >= len(text) or not (text[index - 1].isalnum() and text[index].isalnum())
+
+
+def overlap_length(left: str, right: str, max_overlap: int) -> int:
+    """Length of the longest suffix of left, at most max_overlap characters, that starts right.
+
+    Matches must begin and end between words, so a chance match of a few letters does not
+    splice two unrelated chunks mid-word.
+    """
+    for k in range(min(max_overlap, len(left), len(right)), 0, -1):
+        if left.endswith(right[:k]) and _boundary(left, len(left) - k) and _boundary(right, k):
+            return k
+    return 0
+
+
+def stitch(texts: List[str], max_overlap: int) -> str:
+    """Join consecutive chunk texts, keeping the text they share once."""
+    stitched = texts[0] if texts else ""
+    for text in texts[1:]:
+        k = overlap_length(stitched, text, max_overlap)
+        stitched = stitched + text[k:] if k else stitched + " " + text
+    return stitched
+
+
+class Passage:
+    """One or more adjacent chunks of a page, scored by their best chunk."""
+
+    def __init__(self, docs: list, score: float, max_overlap: int = 0):
+        self.docs = docs
+        self.score = score
+        self.max_overlap = max_overlap
+        self.sentences: List[str] = []
+
+    @property
+    def chunk_ids(self) -> List[int]:
+        return [doc.metadata.get("chunk_id") for doc in self.docs]
+
+    @property
+    def text(self) -> str:
+        """The passage's chunks stitched into one span of page text."""
+        return stitch([doc.page_content for doc in self.docs], self.max_overlap)
+
+
+def merge_passages(retrieved: List[Tuple[object, object, float]], max_overlap: int = 0) -> List[Passage]:
+    """Merge (document, vector, score) results into passages, most relevant first.
+
+    Chunks are adjacent when they come from the same source and page and their chunk ids
+    are consecutive; ids are assigned in reading order at ingest. max_overlap is the
+    chunk overlap the project was split with.
+    """
+    by_page = {}
+    for doc, _, score in retrieved:
+        by_page.setdefault((doc.metadata.get("source"), doc.metadata.get("page")), []).append((doc, score))
+    passages = []
+    for hits in by_page.values():
+        hits.sort(key=lambda hit: hit[0].metadata.get("chunk_id", -1))
+        passage = None
+        for doc, score in hits:
+            chunk_id = doc.metadata.get("chunk_id")
+            if passage is not None and chunk_id is not None and passage.chunk_ids[-1] is not None and chunk_id - passage.chunk_ids[-1] == 1:
+                passage.docs.append(doc)
+                passage.score = max(passage.score, score)
+            else:
+                passage = Passage([doc], score, max_overlap)
+                passages.append(passage)
+    passages.sort(key=lambda passage: passage.score, reverse=True)
+    return passages
+
+
+def _normalized(sentence: str) -> str:
+    return re.sub(r"\W+", " ", sentence).strip().lower()
+
+
+class ContextAssembler:
+    """Builds a context of at most budget tokens from passages' sentences."""
+
+    def __init__(self, count_tokens: Callable[[str], int], budget: int):
+        self.count_tokens = count_tokens
+        self.budget = budget
+
+    def assemble(self, passages: List[Passage]) -> str:
+        """Join the passages' unseen sentences in relevance order while they fit the budget.
+
+        A passage that does not fit whole contributes the sentences that still fit, in order.
+        """
+        seen = set()
+        used = 0
+        parts = []
+        for passage in passages:
+            kept = []
+            for sentence in passage.sentences:
+                key = _normalized(sentence)
+                if not key or key in seen:
+                    continue
+                cost = self.count_tokens(sentence + " ")
+                if used + cost > self.budget:
+                    continue
+                seen.add(key)
+                used += cost
+                kept.append(sentence)
+            if kept:
+                parts.append(" ".join(kept))
+        return "\n\n".join(parts)
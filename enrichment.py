@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional
+
+# Checkpoint file name inside projects/<topic>
+ENRICHMENT_CHECKPOINT = "enrichment.jsonl"
+
+ENRICHMENT_PROMPT = """For the following Document, return a JSON object with exactly two fields:
+"topic": a suitably descriptive topic label, used for categorization and retrieval purposes,
+"relevant_query": the most relevant query that could be used to retrieve the document.
+Reply with the JSON object only.
+Document content:
+"""
+
+
+class GeminiBackend:
+    """Enrichment backend calling the Gemini API; errors are raised so the enricher can retry."""
+
+    def __init__(self, api_key: str, model: str = "gemma-3n-e4b-it"):
+        from misc.gemma3 import GoogleGeminiClient
+        self.client = GoogleGeminiClient(api_key, model)
+
+    def generate(self, prompt: str) -> str:
+        return self.client.model.generate_content(prompt).text
+
+
+class LocalEnrichmentBackend:
+    """Offline stand-in backend for tests and dry runs.
+
+    Derives the topic and query from the document text itself and can simulate
+    network latency with a fixed delay per request.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def generate(self, prompt: str) -> str:
+        if self.delay:
+            time.sleep(self.delay)
+        text = prompt.split("Document content:", 1)[-1]
+        words = re.findall(r"\w+", text)
+        topic = " ".join(words[:5]).title() or "Untitled"
+        return json.dumps({"topic": topic, "relevant_query": f"What does the document say about {topic.lower()}?"})
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing requests_per_second on average with a small burst."""
+
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        self.rate = requests_per_second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def chunk_key(text: str) -> str:
+    """Checkpoint key of a chunk: chunk ids are regenerated on every parse, content is not."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def parse_enrichment(response: str) -> Dict[str, str]:
+    """Extract the topic and relevant_query fields from a model reply."""
+    match = re.search(r"\{.*\}", response, re.DOTALL)
+    if match is None:
+        raise ValueError(f"No JSON object in response: {response[:200]!r}")
+    data = json.loads(match.group(0))
+    return {"topic": str(data["topic"]).strip(), "relevant_query": str(data["relevant_query"]).strip()}
+
+
+class MetadataEnricher:
+    """Adds topic and relevant_query metadata to chunks with concurrent, rate-limited requests.
+
+    Both fields come from one structured request per chunk. Finished chunks are appended
+    to a JSON-lines checkpoint so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, backend, max_concurrency: int = 8, requests_per_second: Optional[float] = None,
+                 checkpoint_path: Optional[str] = None, max_retries: int = 3):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_second, burst=max_concurrency) if requests_per_second else None
+        self.checkpoint_path = checkpoint_path
+        self.max_retries = max_retries
+        self._checkpoint_lock = threading.Lock()
+        # Checkpointed metadata by chunk key, read from disk on first use and kept up to date
+        self._done: Optional[Dict[str, Dict[str, str]]] = None
+
+    def _load_checkpoint(self) -> Dict[str, Dict[str, str]]:
+        if self._done is not None:
+            return self._done
+        done = {}
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # partially written line from an interrupted run
+                    done[record.pop("key")] = record
+        self._done = done
+        return done
+
+    def _save_checkpoint(self, key: str, metadata: Dict[str, str]):
+        self._load_checkpoint()[key] = metadata
+        if not self.checkpoint_path:
+            return
+        with self._checkpoint_lock:
+            with open(self.checkpoint_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps({"key": key, **metadata}) + "\n")
+
+    def _request(self, text: str) -> Dict[str, str]:
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                return parse_enrichment(self.backend.generate(ENRICHMENT_PROMPT + text))
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Enrichment request failed ({e}); retrying")
+                time.sleep(min(2 ** attempt, 30))
+
+    def enrich(self, chunks):
+        """Set metadata['topic'] and metadata['relevant_query'] on every chunk."""
+        if self.checkpoint_path:
+            os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        done = self._load_checkpoint()
+        pending = {}
+        for chunk in chunks:
+            key = chunk_key(chunk.page_content)
+            if key in done:
+                chunk.metadata.update(done[key])
+            else:
+                pending.setdefault(key, []).append(chunk)
+        print(f"Enriching {len(pending)} chunks ({len(chunks) - sum(len(c) for c in pending.values())} restored from checkpoint)")
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {executor.submit(self._request, group[0].page_content): key for key, group in pending.items()}
+            for finished, future in enumerate(as_completed(futures), start=1):
+                key = futures[future]
+                try:
+                    metadata = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Giving up on chunk {key[:8]}: {e}")
+                    continue
+                for chunk in pending[key]:
+                    chunk.metadata.update(metadata)
+                self._save_checkpoint(key, metadata)
+                if finished % 50 == 0 or finished == len(futures):
+                    print(f"Enriched {finished}/{len(futures)} chunks")
+        if failed:
+            raise RuntimeError(f"{failed} chunks could not be enriched; re-run to resume from the checkpoint")
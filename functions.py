@@ -1,16 +1,22 @@
 import sys
 import os
 from rag import LangChainRAG
+from index_spec import IndexSpec
 
-def create_rag_system(files, topic, add_metadata=False, gemini_api_key=None):
+def create_rag_system(files, topic, add_metadata=False, gemini_api_key=None, index_spec=None, answer_cache=False, hybrid=None, rerank=None):
     """Create a new RAG system with the specified files and topic."""
-    rag = LangChainRAG(files, chunk_size=800, chunk_overlap=100, topic=topic, add_metadata=add_metadata, gemini_api_key=gemini_api_key)
+    rag = LangChainRAG(files, chunk_size=800, chunk_overlap=100, topic=topic, add_metadata=add_metadata, gemini_api_key=gemini_api_key, index_spec=index_spec, answer_cache=answer_cache, hybrid=hybrid, rerank=rerank)
     print("RAG system initialized.")
     return rag
 
-def create_rag_project(project_name, file_paths, description="", category="General"):
-    """Create a new RAG project with the given parameters."""
+def create_rag_project(project_name, file_paths, description="", category="General", index_spec=None):
+    """Create a new RAG project with the given parameters.
+
+    index_spec selects the vector index: "flat" (default), "hnsw", "ivf" or "ivfpq",
+    as a string like "ivf:nlist=4096,nprobe=32" or a dict of IndexSpec fields.
+    """
     try:
+        index_spec = IndexSpec.parse(index_spec)
         # Validate file paths
         valid_files = []
         for file_path in file_paths:
@@ -30,7 +36,8 @@ def create_rag_project(project_name, file_paths, description="", category="Gener
             files=valid_files,
             topic=normalized_name,
             add_metadata=False,  # Set to True if you want to use metadata enhancement
-            gemini_api_key=None   # Add your Gemini API key here if needed
+            gemini_api_key=None,   # Add your Gemini API key here if needed
+            index_spec=index_spec
         )
         
         # Create project folder structure
@@ -44,7 +51,8 @@ def create_rag_project(project_name, file_paths, description="", category="Gener
             "category": category,
             "files": valid_files,
             "created_date": str(os.path.getctime(project_folder) if os.path.exists(project_folder) else "unknown"),
-            "document_count": len(valid_files)
+            "document_count": len(valid_files),
+            "index_spec": IndexSpec.load(project_folder).to_dict()
         }
         
         print(f"Project '{project_name}' created successfully with {len(valid_files)} documents.")
@@ -0,0 +1,276 @@
+"""Queued, fair access to a shared llama.cpp model.
+
+A Llama instance generates for one request at a time. Each shared LLM gets a
+GenerationScheduler: requests are queued per project and served round-robin across
+projects by a single worker thread, so one busy project cannot starve the others and
+the number of waiting requests is bounded. Callers learn their place in the queue and
+an estimated wait while they wait, and are rejected with QueueFull once it is full.
+A cancelled request leaves the queue, or stops generating after its next token.
+Tokens are read with Ticket.stream() from a thread, or Ticket.astream() from an event loop.
+"""
+import asyncio
+import queue
+import threading
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from time import perf_counter as timer
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional
+
+
+class QueueFull(RuntimeError):
+    """The scheduler already holds max_queue waiting requests."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Too many requests are waiting for the model; retry shortly")
+        self.retry_after = retry_after
+
+
+class QueueStatus:
+    """Where a waiting request stands: position 1 is next in line."""
+
+    def __init__(self, position: int, eta: float):
+        self.position = position
+        self.eta = eta
+
+    def to_dict(self) -> dict:
+        return {"position": self.position, "eta": round(self.eta, 1)}
+
+
+_DONE = object()
+
+
+class Ticket:
+    """A queued generation. Iterate stream() to wait for it and read its tokens."""
+
+    def __init__(self, scheduler: "GenerationScheduler", project: str, job: Callable[[], Iterable[str]]):
+        self.id = uuid.uuid4().hex
+        self.scheduler = scheduler
+        self.project = project
+        self.job = job
+        self.started = threading.Event()
+        self.cancelled = False
+        self.tokens = queue.Queue()
+        # Set by astream(): wakes its event loop when the ticket starts or a token arrives
+        self._notify: Optional[Callable[[], None]] = None
+
+    def status(self) -> QueueStatus:
+        return self.scheduler.status(self)
+
+    def cancel(self):
+        """Give up the request: a waiting ticket leaves the queue, a running one stops at its next token."""
+        self.cancelled = True
+        self.scheduler.discard(self)
+
+    def _start(self):
+        self.started.set()
+        self._wake()
+
+    def _put(self, item):
+        self.tokens.put(item)
+        self._wake()
+
+    def _wake(self):
+        notify = self._notify
+        if notify is not None:
+            try:
+                notify()
+            except RuntimeError:
+                # The reader's event loop has closed; nobody is left to wake
+                pass
+
+    def stream(self, poll: float = 1.0) -> Iterator:
+        """Yield a QueueStatus every poll seconds until generation starts, then the generated
+        tokens. Closing the iterator early cancels the ticket.
+        """
+        finished = False
+        try:
+            waited = False
+            while not self.started.wait(poll if waited else 0):
+                if self.cancelled:
+                    finished = True
+                    return
+                waited = True
+                yield self.status()
+            while True:
+                item = self.tokens.get()
+                if item is _DONE:
+                    finished = True
+                    return
+                if isinstance(item, BaseException):
+                    finished = True
+                    raise item
+                yield item
+        finally:
+            if not finished:
+                self.cancel()
+
+    async def astream(self, poll: float = 1.0) -> AsyncIterator:
+        """stream() for asyncio: yields the same items, but waits on the event loop instead of
+        blocking a thread. Closing or cancelling the iterator early cancels the ticket.
+        """
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        self._notify = lambda: loop.call_soon_threadsafe(wake.set)
+        finished = False
+        try:
+            waited = False
+            while True:
+                if waited and not self.started.is_set():
+                    try:
+                        await asyncio.wait_for(wake.wait(), poll)
+                    except asyncio.TimeoutError:
+                        pass
+                wake.clear()
+                if self.started.is_set():
+                    break
+                if self.cancelled:
+                    finished = True
+                    return
+                waited = True
+                yield self.status()
+            while True:
+                try:
+                    item = self.tokens.get_nowait()
+                except queue.Empty:
+                    # Cleared before the next check, so a token put after it sets the event again
+                    await wake.wait()
+                    wake.clear()
+                    continue
+                if item is _DONE:
+                    finished = True
+                    return
+                if isinstance(item, BaseException):
+                    finished = True
+                    raise item
+                yield item
+        finally:
+            self._notify = None
+            if not finished:
+                self.cancel()
+
+
+class GenerationScheduler:
+    """Runs the generations of one model one at a time, round-robin across projects."""
+
+    def __init__(self, max_queue: int = 8, expected_duration: float = 30.0):
+        self.max_queue = max_queue
+        # Moving average of how long one generation holds the model
+        self.average_duration = expected_duration
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._active: Optional[Ticket] = None
+        self._active_since = 0.0
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, project: str, job: Callable[[], Iterable[str]]) -> Ticket:
+        """Queue job, a function returning the token iterator to run on the model.
+
+        Raises QueueFull when max_queue requests are already waiting.
+        """
+        with self._lock:
+            waiting = self._waiting()
+            if waiting >= self.max_queue:
+                raise QueueFull(self._eta(waiting))
+            ticket = Ticket(self, project, job)
+            self._queues.setdefault(project, deque()).append(ticket)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="llm-scheduler", daemon=True)
+                self._worker.start()
+        return ticket
+
+    def discard(self, ticket: Ticket):
+        with self._lock:
+            tickets = self._queues.get(ticket.project)
+            if tickets and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del self._queues[ticket.project]
+
+    def _waiting(self) -> int:
+        return sum(len(tickets) for tickets in self._queues.values())
+
+    def _order(self) -> List[Ticket]:
+        """Waiting tickets in the order they will run: one per project in turn."""
+        order = []
+        queues = list(self._queues.values())
+        for depth in range(max((len(tickets) for tickets in queues), default=0)):
+            order.extend(tickets[depth] for tickets in queues if depth < len(tickets))
+        return order
+
+    def _eta(self, ahead: int) -> float:
+        remaining = 0.0
+        if self._active is not None:
+            remaining = max(0.0, self.average_duration - (timer() - self._active_since))
+        return remaining + ahead * self.average_duration
+
+    def status(self, ticket: Ticket) -> QueueStatus:
+        with self._lock:
+            order = self._order()
+            ahead = order.index(ticket) if ticket in order else 0
+            return QueueStatus(ahead + 1, self._eta(ahead))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self._active.project if self._active is not None else None,
+                "waiting": {project: len(tickets) for project, tickets in self._queues.items()},
+                "max_queue": self.max_queue,
+                "average_duration": round(self.average_duration, 2),
+            }
+
+    def _next(self) -> Optional[Ticket]:
+        with self._lock:
+            if not self._queues:
+                self._active = None
+                self._worker = None
+                return None
+            project, tickets = next(iter(self._queues.items()))
+            ticket = tickets.popleft()
+            # The project goes to the back of the line behind every other waiting project
+            del self._queues[project]
+            if tickets:
+                self._queues[project] = tickets
+            self._active = ticket
+            self._active_since = timer()
+            return ticket
+
+    def _run(self):
+        while True:
+            ticket = self._next()
+            if ticket is None:
+                return
+            if ticket.cancelled:
+                continue
+            ticket._start()
+            start_time = timer()
+            tokens = None
+            try:
+                tokens = iter(ticket.job())
+                for token in tokens:
+                    if ticket.cancelled:
+                        break
+                    ticket._put(token)
+            except Exception as e:
+                ticket._put(e)
+            finally:
+                # Closing the generator stops llama.cpp before it evaluates another token
+                close = getattr(tokens, "close", None)
+                if close is not None:
+                    close()
+                ticket._put(_DONE)
+                if not ticket.cancelled:
+                    self.average_duration = 0.7 * self.average_duration + 0.3 * (timer() - start_time)
+
+
+_schedulers = weakref.WeakKeyDictionary()
+_schedulers_lock = threading.Lock()
+
+
+def scheduler_for(shared_model, max_queue: int = 8) -> GenerationScheduler:
+    """The scheduler owning a shared LLM (see model_registry.SharedModel), created on first use."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(shared_model)
+        if scheduler is None:
+            scheduler = _schedulers[shared_model] = GenerationScheduler(max_queue=max_queue)
+        return scheduler
@@ -0,0 +1,172 @@
+"""Vector index types a project can be built with.
+
+    flat                        exact search (default)
+    hnsw:m=32,ef_search=64      graph index, no training; removed chunks are tombstoned
+                                and the graph is rebuilt once enough have accumulated
+    ivf:nlist=4096,nprobe=32    inverted lists, trained on a sample of the first chunks
+    ivfpq:nlist=4096,pq_m=48    IVF with product-quantized vectors, the smallest footprint
+
+Any type can add ``dim=128`` to index only a Matryoshka prefix of the embeddings, and
+``rescore=4`` to fetch 4x the candidates from that prefix and re-score them at full
+dimension (see mrl.py).
+
+Build parameters (nlist, m, pq_m, dim, ...) are fixed once a project exists; search
+parameters (nprobe, ef_search, rescore) can be changed whenever a project is opened to
+trade recall against latency.
+"""
+import json
+import math
+import os
+from typing import Optional, Union
+
+import faiss
+import numpy as np
+
+from mrl import TruncatedEmbeddings
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+SEARCH_PARAMS = ("nprobe", "ef_search", "rescore")
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+
+class IndexSpec:
+    """Index type plus its build and search parameters, stored as ``index.json`` in the project."""
+
+    FILE_NAME = "index.json"
+
+    def __init__(self, type: str = "flat", nlist: int = 1024, nprobe: Optional[int] = None, m: int = 32,
+                 ef_construction: int = 200, ef_search: Optional[int] = None, pq_m: int = 16, pq_bits: int = 8,
+                 train_size: Optional[int] = None, dim: Optional[int] = None, rescore: Optional[int] = None):
+        if type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {type!r}; expected one of {', '.join(INDEX_TYPES)}")
+        self.type = type
+        self.nlist = int(nlist)
+        self.nprobe = int(nprobe) if nprobe else None
+        self.m = int(m)
+        self.ef_construction = int(ef_construction)
+        self.ef_search = int(ef_search) if ef_search else None
+        self.pq_m = int(pq_m)
+        self.pq_bits = int(pq_bits)
+        self.train_size = int(train_size) if train_size else None
+        self.dim = int(dim) if dim else None
+        self.rescore = int(rescore) if rescore else None
+
+    @classmethod
+    def parse(cls, spec: Union[None, str, dict, "IndexSpec"]) -> "IndexSpec":
+        """Accept an IndexSpec, a dict of its fields, or a string such as ``"ivf:nlist=4096,nprobe=32"``."""
+        if spec is None:
+            return cls()
+        if isinstance(spec, IndexSpec):
+            return spec
+        if isinstance(spec, dict):
+            return cls(**spec)
+        kind, _, params = spec.partition(":")
+        options = dict(param.split("=", 1) for param in params.split(",") if param)
+        return cls(kind.strip().lower(), **{key.strip(): int(value) for key, value in options.items()})
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    def __repr__(self) -> str:
+        return f"IndexSpec({', '.join(f'{k}={v!r}' for k, v in self.to_dict().items())})"
+
+    @property
+    def needs_training(self) -> bool:
+        return self.type in ("ivf", "ivfpq")
+
+    @property
+    def sample_size(self) -> int:
+        """Vectors to collect before training; faiss wants about 40 per inverted list."""
+        return self.train_size or 40 * self.nlist
+
+    def wrap(self, embeddings):
+        """The embeddings this project indexes: truncated to dim when set."""
+        return TruncatedEmbeddings(embeddings, self.dim) if self.dim else embeddings
+
+    def with_search_params(self, other: "IndexSpec") -> "IndexSpec":
+        """This spec with the search parameters another one sets explicitly."""
+        spec = IndexSpec(**self.to_dict())
+        for name in SEARCH_PARAMS:
+            if getattr(other, name) is not None:
+                setattr(spec, name, getattr(other, name))
+        return spec
+
+    def fitted(self, n: int) -> "IndexSpec":
+        """Shrink nlist and pq_bits so that n training vectors are enough (small projects)."""
+        spec = IndexSpec(**self.to_dict())
+        if self.needs_training:
+            spec.nlist = max(1, min(self.nlist, n // 39))
+        if self.type == "ivfpq":
+            spec.pq_bits = max(1, min(self.pq_bits, int(math.log2(max(n, 2)))))
+        return spec
+
+    def build(self, dim: int, sample: Optional[np.ndarray] = None) -> faiss.Index:
+        """Create an index for dim-dimensional vectors, trained on sample when the type needs it.
+
+        Every index accepts add_with_ids, so FAISS labels are the project's chunk ids.
+        """
+        if self.type == "flat":
+            index = faiss.index_factory(dim, "IDMap2,Flat")
+        elif self.type == "hnsw":
+            index = faiss.index_factory(dim, f"IDMap2,HNSW{self.m},Flat")
+            faiss.downcast_index(faiss.downcast_index(index).index).hnsw.efConstruction = self.ef_construction
+        else:
+            if self.type == "ivfpq" and dim % self.pq_m:
+                raise ValueError(f"pq_m={self.pq_m} must divide the embedding dimension {dim}")
+            codes = "Flat" if self.type == "ivf" else f"PQ{self.pq_m}x{self.pq_bits}"
+            index = faiss.index_factory(dim, f"IVF{self.nlist},{codes}")
+            # Lets the IVF index reconstruct and remove vectors by chunk id
+            faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.Hashtable)
+            if sample is None:
+                raise ValueError(f"A {self.type} index needs training vectors")
+            print(f"Training {self.type} index (nlist={self.nlist}) on {len(sample)} vectors")
+            index.train(np.ascontiguousarray(sample, dtype=np.float32))
+        self.apply(index)
+        return index
+
+    def apply(self, index: faiss.Index):
+        """Set the search parameters on an index built from this spec."""
+        if self.type == "hnsw":
+            faiss.ParameterSpace().set_index_parameter(index, "efSearch", self.ef_search or DEFAULT_EF_SEARCH)
+        elif self.needs_training:
+            faiss.ParameterSpace().set_index_parameter(index, "nprobe", self.nprobe or DEFAULT_NPROBE)
+
+    def search_parameters(self, selector: faiss.IDSelector) -> faiss.SearchParameters:
+        """Per-search parameters restricting a search to selector's ids.
+
+        They replace the index's own settings for that search, so nprobe and efSearch are set again.
+        """
+        if self.type == "hnsw":
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = self.ef_search or DEFAULT_EF_SEARCH
+        elif self.needs_training:
+            params = faiss.SearchParametersIVF()
+            params.nprobe = self.nprobe or DEFAULT_NPROBE
+        else:
+            params = faiss.SearchParameters()
+        params.sel = selector
+        return params
+
+    @classmethod
+    def load(cls, folder: str) -> "IndexSpec":
+        """Load a project's spec; projects saved before specs existed are flat."""
+        path = os.path.join(folder, cls.FILE_NAME)
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r') as file:
+            return cls(**json.load(file))
+
+    def save(self, folder: str):
+        path = os.path.join(folder, self.FILE_NAME)
+        with open(path + ".tmp", 'w') as file:
+            json.dump(self.to_dict(), file)
+        os.replace(path + ".tmp", path)
+
+
+def supports_removal(index: faiss.Index) -> bool:
+    """HNSW graphs cannot drop vectors; their removed chunks are tombstoned instead."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return not isinstance(index, faiss.IndexHNSW)
@@ -0,0 +1,59 @@
+from typing import Iterable, List
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from index_spec import IndexSpec, supports_removal
+
+
+def add_chunks(vector_store: FAISS, chunks, vectors: np.ndarray) -> List[int]:
+    """Append pre-embedded chunks under fresh chunk ids and return those ids.
+
+    A chunk's id is its FAISS label and is also stored in metadata['chunk_id'].
+    """
+    if not chunks:
+        return []
+    first = vector_store.docstore.next_id
+    labels = np.arange(first, first + len(chunks), dtype=np.int64)
+    for label, chunk in zip(labels.tolist(), chunks):
+        chunk.metadata['chunk_id'] = label
+    vector_store.index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), labels)
+    vector_store.docstore.add({
+        str(chunk.metadata['chunk_id']): Document(page_content=chunk.page_content, metadata=chunk.metadata)
+        for chunk in chunks
+    })
+    return labels.tolist()
+
+
+def remove_chunks(vector_store: FAISS, chunk_ids: Iterable[int]) -> int:
+    """Remove chunks by chunk id in one batched pass over the index.
+
+    Indexes that cannot remove vectors (HNSW) keep them as tombstones: the chunks are
+    gone from the docstore, so searches skip them until rebuild_index() runs.
+    """
+    labels = np.array(sorted(set(chunk_ids)), dtype=np.int64)
+    if not len(labels):
+        return 0
+    removed = len(labels)
+    if supports_removal(vector_store.index):
+        removed = int(vector_store.index.remove_ids(labels))
+    vector_store.docstore.delete(labels.tolist())
+    return removed
+
+
+def rebuild_index(vector_store: FAISS, spec: IndexSpec, max_dead_fraction: float = 0.25,
+                  batch_size: int = 65536) -> bool:
+    """Rebuild an index without its tombstoned vectors once enough have accumulated."""
+    index = vector_store.index
+    dead = index.ntotal - len(vector_store.docstore)
+    if not index.ntotal or dead <= max_dead_fraction * index.ntotal:
+        return False
+    print(f"Rebuilding {spec.type} index without {dead} removed chunks")
+    live = vector_store.docstore.live_ids()
+    rebuilt = spec.build(index.d)
+    for start in range(0, len(live), batch_size):
+        labels = live[start:start + batch_size]
+        rebuilt.add_with_ids(index.reconstruct_batch(labels), labels)
+    vector_store.index = rebuilt
+    return True
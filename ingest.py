@@ -0,0 +1,506 @@
+"""Bulk PDF ingestion for a RAG project.
+
+PDFs are parsed and chunked in parallel across a process pool and streamed through
+bounded stages (parse -> batch -> embed -> index) into a single index saved to
+projects/<topic>, which is flushed to disk at regular intervals.
+Re-running against an existing project only embeds new or changed files and
+deletes the chunks of files that are no longer part of the sources.
+
+    python ingest.py <topic> <directory-or-glob> [more sources...] [--workers N]
+"""
+import argparse
+import glob
+import os
+import queue
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from time import perf_counter as timer
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+from config import EMBEDDING_MODEL_PATH, PROJECTS_DIR
+from enrichment import ENRICHMENT_CHECKPOINT, GeminiBackend, LocalEnrichmentBackend, MetadataEnricher
+from index_spec import IndexSpec
+from indexing import add_chunks, rebuild_index, remove_chunks
+from lexical_index import LexicalIndex
+from mrl import FullVectors, TruncatedEmbeddings
+from project_manifest import ProjectManifest
+from project_store import create_vector_store, is_project, open_vector_store, save_vector_store
+from reranker import QueryVectors, embed_relevant_queries
+from sentence_store import SentenceStore
+from topic_index import TopicIndex
+
+
+def make_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+
+def find_pdfs(sources: List[str]) -> List[str]:
+    """Expand directories (recursively) and glob patterns into a sorted list of PDF paths."""
+    paths = set()
+    for source in sources:
+        if os.path.isdir(source):
+            matches = glob.glob(os.path.join(source, "**", "*"), recursive=True)
+        else:
+            matches = glob.glob(source, recursive=True)
+        paths.update(p for p in matches if os.path.isfile(p) and p.lower().endswith('.pdf'))
+    return sorted(paths)
+
+
+def count_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+
+def load_and_split_pages(path: str, start: int, end: int, chunk_size: int, chunk_overlap: int) -> Tuple[list, Optional[str]]:
+    """Parse and chunk pages [start, end) of one PDF.
+
+    Runs in a worker process, so errors are returned rather than raised.
+    """
+    try:
+        reader = PdfReader(path)
+        pages = [
+            Document(page_content=reader.pages[i].extract_text() or "", metadata={"source": path, "page": i})
+            for i in range(start, end)
+        ]
+        return make_text_splitter(chunk_size, chunk_overlap).split_documents(pages), None
+    except Exception as e:
+        return [], str(e)
+
+
+def parse_pdfs(paths: List[str], chunk_size: int = 800, chunk_overlap: int = 100, workers: Optional[int] = None,
+               pages_per_task: int = 32) -> Iterator[Tuple[str, list, bool, Optional[str]]]:
+    """Yield (path, chunks, file_finished, error) as PDFs are parsed across a process pool.
+
+    Files are split into tasks of at most pages_per_task pages and only a bounded number
+    of tasks is in flight, so memory does not grow with file or corpus size. Results come
+    back in file order; the last result of each file has file_finished set, and error set
+    if any part of the file could not be read. Throughput is printed as files complete.
+    """
+    workers = min(workers or os.cpu_count() or 1, max(len(paths), 1))
+    total_pages = 0
+    total_chunks = 0
+    failed = 0
+    start_time = timer()
+
+    def tasks():
+        for path in paths:
+            try:
+                page_count = count_pages(path)
+            except Exception as e:
+                yield path, 0, 0, str(e)
+                continue
+            for start in range(0, page_count, pages_per_task):
+                yield path, start, min(start + pages_per_task, page_count), None
+            if page_count == 0:
+                yield path, 0, 0, None
+
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as executor:
+        in_flight = deque()
+        task_iter = tasks()
+        current_error = {}
+        while True:
+            while len(in_flight) < workers * 2:
+                task = next(task_iter, None)
+                if task is None:
+                    break
+                path, start, end, error = task
+                if error is not None or start == end:
+                    in_flight.append((path, start, end, error, None))
+                elif executor is None:
+                    in_flight.append((path, start, end, None, load_and_split_pages(path, start, end, chunk_size, chunk_overlap)))
+                else:
+                    in_flight.append((path, start, end, None, executor.submit(load_and_split_pages, path, start, end, chunk_size, chunk_overlap)))
+            if not in_flight:
+                break
+
+            path, start, end, error, result = in_flight.popleft()
+            chunks = []
+            if result is not None:
+                chunks, error = result.result() if executor is not None else result
+            if error is not None:
+                current_error.setdefault(path, error)
+            total_pages += end - start
+            total_chunks += len(chunks)
+            finished = not in_flight or in_flight[0][0] != path
+            if finished:
+                error = current_error.pop(path, None)
+                elapsed = timer() - start_time
+                if error is not None:
+                    failed += 1
+                    print(f"Skipping {path}: {error}")
+                else:
+                    print(f"{path}: parsed up to page {end} "
+                          f"({total_pages / elapsed if elapsed > 0 else 0:.1f} pages/s, "
+                          f"{total_chunks / elapsed if elapsed > 0 else 0:.1f} chunks/s)")
+            yield path, chunks, finished, error if finished else None
+    elapsed = timer() - start_time
+    print(f"Parsed {total_pages} pages into {total_chunks} chunks in {elapsed:.1f}s "
+          f"({total_pages / elapsed if elapsed > 0 else 0:.1f} pages/s, "
+          f"{total_chunks / elapsed if elapsed > 0 else 0:.1f} chunks/s); {failed} file(s) skipped")
+
+
+class _StageFailure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_STAGE_DONE = object()
+
+
+def run_in_thread(iterable, maxsize: int = 4):
+    """Run an iterator in a background thread, handing its items over through a bounded queue.
+
+    The producer blocks when the queue is full, which bounds the memory held between stages.
+    Exceptions raised by the producer are re-raised in the consumer.
+    """
+    handoff = queue.Queue(maxsize=maxsize)
+
+    def produce():
+        try:
+            for item in iterable:
+                handoff.put(item)
+        except BaseException as e:
+            handoff.put(_StageFailure(e))
+        finally:
+            handoff.put(_STAGE_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = handoff.get()
+        if item is _STAGE_DONE:
+            return
+        if isinstance(item, _StageFailure):
+            raise item.error
+        yield item
+
+
+def batch_chunks(parsed, batch_size: int):
+    """Group parsed chunks into batches of batch_size.
+
+    Each batch carries the (path, error) of files whose last chunk is in that batch or an
+    earlier one, so the indexing stage knows when a file is completely indexed.
+    """
+    pending_chunks = []
+    # (chunks produced up to the end of the file, (path, error)) of finished files not handed on yet
+    pending_files = deque()
+    batched = 0
+    for path, chunks, finished, error in parsed:
+        pending_chunks.extend(chunks)
+        if finished:
+            pending_files.append((batched + len(pending_chunks), (path, error)))
+        while len(pending_chunks) >= batch_size:
+            batch, pending_chunks = pending_chunks[:batch_size], pending_chunks[batch_size:]
+            batched += len(batch)
+            finished_files = []
+            while pending_files and pending_files[0][0] <= batched:
+                finished_files.append(pending_files.popleft()[1])
+            yield batch, finished_files
+    if pending_chunks or pending_files:
+        yield pending_chunks, [file for _, file in pending_files]
+
+
+def embed_batches(batches, embeddings, enrich: Optional[Callable[[list], None]] = None):
+    """Embedding stage: enrich, embed chunks and their sentences, one batch at a time.
+
+    Yields (chunks, vectors, full_vectors, query_vectors, sentences, finished_files); with
+    truncating (MRL) embeddings full_vectors holds the untruncated chunk vectors, otherwise
+    None. query_vectors embeds the chunks' relevant_query metadata, if they have any.
+    """
+    for chunks, finished_files in batches:
+        if chunks and enrich is not None:
+            enrich(chunks)
+        vectors = full_vectors = query_vectors = None
+        if chunks:
+            texts = [chunk.page_content for chunk in chunks]
+            if isinstance(embeddings, TruncatedEmbeddings):
+                full_vectors = np.asarray(embeddings.base.embed_documents(texts), dtype=np.float32)
+                vectors = embeddings.truncate(full_vectors)
+            else:
+                vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+            query_vectors = embed_relevant_queries(chunks, embeddings)
+        sentences = SentenceStore.prepare(chunks, embeddings)
+        yield chunks, vectors, full_vectors, query_vectors, sentences, finished_files
+
+
+# Files of the pickle-based project format, replaced on the next ingest
+LEGACY_FILES = ("index.faiss", "index.pkl", "sentences.json")
+
+
+def load_project(folder: str, embeddings, writable: bool = False, index_spec: Optional[IndexSpec] = None):
+    """Open a saved project's vector store and sentence store.
+
+    Read-only projects are memory-mapped, so opening one does not depend on its size.
+    The search parameters of index_spec, if given, override the stored ones.
+    """
+    spec = IndexSpec.load(folder)
+    embeddings = spec.wrap(embeddings)
+    vector_store = open_vector_store(folder, embeddings, writable=writable)
+    (spec.with_search_params(index_spec) if index_spec else spec).apply(vector_store.index)
+    sentence_store = SentenceStore.load(folder, mmap=not writable) or SentenceStore.build([], embeddings)
+    return vector_store, sentence_store
+
+
+def save_project(folder: str, vector_store, sentence_store: SentenceStore, manifest: ProjectManifest, spec: IndexSpec,
+                 lexical_index: LexicalIndex, topic_index: TopicIndex, row_stores=()):
+    """Save a project; the manifest goes last so it never refers to chunks that were not saved.
+
+    row_stores are the project's FullVectors and QueryVectors, or None for those it lacks.
+    """
+    spec.save(folder)
+    save_vector_store(folder, vector_store)
+    for store in row_stores:
+        if store is not None:
+            store.save()
+    sentence_store.save(folder)
+    lexical_index.save(folder)
+    topic_index.save(folder)
+    manifest.save()
+
+
+def remove_orphans(vector_store, sentence_store: SentenceStore, lexical_index: LexicalIndex, topic_index: TopicIndex,
+                   manifest: ProjectManifest):
+    """Remove chunks no manifest entry refers to, left over from an interrupted ingest."""
+    known = np.zeros(vector_store.docstore.next_id, dtype=bool)
+    for entry in manifest.files.values():
+        for start, stop in entry["chunks"]:
+            known[start:stop] = True
+    live = vector_store.docstore.live_ids()
+    orphans = live[~known[live]].tolist()
+    if orphans:
+        remove_chunks(vector_store, orphans)
+        sentence_store.remove(orphans)
+        lexical_index.remove(orphans)
+        topic_index.remove(orphans)
+        print(f"Removed {len(orphans)} chunks left over from an interrupted ingest")
+
+
+def update_project(paths: List[str], topic: str, embeddings, chunk_size: int = 800, chunk_overlap: int = 100,
+                   workers: Optional[int] = None, batch_size: int = 256, enrich: Optional[Callable[[list], None]] = None,
+                   flush_every: int = 10000, queue_size: int = 4, index_spec=None):
+    """Bring projects/<topic> in line with paths, embedding only new or changed files.
+
+    Chunks of changed or removed files are deleted from the index. New files stream through
+    bounded stages (parse -> batch -> embed -> index) so memory stays flat however many pages
+    are ingested, and the project is flushed to disk every flush_every chunks. enrich, if
+    given, is called on every batch of new chunks before it is embedded (e.g. to add metadata).
+    index_spec (an IndexSpec, dict or string, see index_spec.py) selects the index type of a
+    new project; indexes that need training are trained on the first chunks streamed in.
+    For an existing project only its search parameters (nprobe, ef_search, rescore) are used.
+    Returns the (vector_store, sentence_store) pair, or (None, None) if nothing could be indexed.
+    An up-to-date project is opened read-only and memory-mapped. The project's keyword index
+    (see lexical_index.py) and topic labels (see topic_index.py) are kept in step with the
+    vector index and built for projects that lack them.
+    """
+    folder = os.path.join(PROJECTS_DIR, topic)
+    manifest = ProjectManifest.load(folder)
+    requested = IndexSpec.parse(index_spec) if index_spec is not None else None
+    existing = is_project(folder) and ProjectManifest.exists(folder)
+    to_add, to_remove = manifest.diff(paths)
+    up_to_date = existing and manifest.complete and not to_add and not to_remove
+    if up_to_date and LexicalIndex.exists(folder) and TopicIndex.exists(folder):
+        if manifest.changed:
+            manifest.save()
+        print(f"Project {topic} is up to date")
+        return load_project(folder, embeddings, index_spec=requested)
+
+    if existing:
+        spec = IndexSpec.load(folder)
+        if requested is not None:
+            if (requested.type, requested.dim) != (spec.type, spec.dim):
+                print(f"Project {topic} already has a {spec.type} index (dim={spec.dim}); keeping it")
+            spec = spec.with_search_params(requested)
+        vector_store, sentence_store = load_project(folder, embeddings, writable=True, index_spec=spec)
+        lexical_index = LexicalIndex.load(folder) or LexicalIndex.build(vector_store.docstore)
+        topic_index = TopicIndex.load(folder) or TopicIndex.build(vector_store.docstore)
+        if not manifest.complete:
+            remove_orphans(vector_store, sentence_store, lexical_index, topic_index, manifest)
+        full_vectors = FullVectors(folder) if FullVectors.exists(folder) else None
+        query_vectors = QueryVectors(folder) if QueryVectors.exists(folder) else None
+    else:
+        if any(os.path.exists(os.path.join(folder, name)) for name in LEGACY_FILES):
+            print(f"{folder} uses the old project format; rebuilding the project index from scratch")
+            for name in LEGACY_FILES:
+                if os.path.exists(os.path.join(folder, name)):
+                    os.remove(os.path.join(folder, name))
+        manifest = ProjectManifest(folder)
+        to_add, to_remove = manifest.diff(paths)
+        spec = requested or IndexSpec()
+        vector_store, sentence_store = None, SentenceStore.build([], embeddings)
+        lexical_index = LexicalIndex.empty()
+        topic_index = TopicIndex.empty()
+        full_vectors = FullVectors.create(folder) if spec.dim and spec.rescore else None
+        # Created with the first relevant_query; one left by an earlier project must not be read
+        query_vectors = None
+        if QueryVectors.exists(folder):
+            stale = QueryVectors(folder)
+            for path in (stale.path, stale.rows_path):
+                if os.path.exists(path):
+                    os.remove(path)
+    embeddings = spec.wrap(embeddings)
+    print(f"{len(to_add)} new or changed file(s), {len(to_remove)} changed or removed file(s)")
+
+    stale_ids = manifest.chunk_ids(to_remove)
+    if stale_ids and vector_store is not None:
+        removed = remove_chunks(vector_store, stale_ids)
+        sentence_store.remove(stale_ids)
+        lexical_index.remove(stale_ids)
+        topic_index.remove(stale_ids)
+        print(f"Removed {removed} stale chunks")
+    manifest.remove(to_remove)
+    # Until the final save, a reopened project must look for chunks of unfinished files
+    manifest.complete = False
+    manifest.save()
+
+    parsed = run_in_thread(parse_pdfs(list(to_add), chunk_size, chunk_overlap, workers), maxsize=queue_size)
+    embedded = run_in_thread(embed_batches(batch_chunks(parsed, batch_size), embeddings, enrich), maxsize=queue_size)
+
+    file_chunk_ids = {}
+    indexed = 0
+    unflushed = 0
+    start_time = timer()
+
+    def index_batch(chunks, vectors, batch_full_vectors, batch_query_vectors, spans_per_chunk, sentence_vectors,
+                    finished_files):
+        nonlocal indexed, unflushed, query_vectors
+        if chunks:
+            chunk_ids = add_chunks(vector_store, chunks, vectors)
+            if full_vectors is not None:
+                full_vectors.append(chunk_ids[0], batch_full_vectors)
+            if batch_query_vectors is not None:
+                if query_vectors is None:
+                    query_vectors = QueryVectors.create(folder)
+                query_vectors.append(chunk_ids[0], batch_query_vectors)
+            sentence_store.append(chunks, spans_per_chunk, sentence_vectors)
+            lexical_index.add(chunk_ids, [chunk.page_content for chunk in chunks])
+            topic_index.add(chunk_ids, [chunk.metadata.get('topic') for chunk in chunks])
+            topic_index.embed_names(embeddings)
+            for chunk in chunks:
+                file_chunk_ids.setdefault(chunk.metadata['source'], []).append(chunk.metadata['chunk_id'])
+            indexed += len(chunks)
+            unflushed += len(chunks)
+            elapsed = timer() - start_time
+            print(f"Indexed {indexed} chunks ({indexed / elapsed if elapsed > 0 else 0:.1f} chunks/s)")
+        for path, error in finished_files:
+            chunk_ids = file_chunk_ids.pop(path, [])
+            if error is not None:
+                # Drop whatever part of an unreadable file was already indexed
+                if chunk_ids:
+                    remove_chunks(vector_store, chunk_ids)
+                    sentence_store.remove(chunk_ids)
+                    lexical_index.remove(chunk_ids)
+                    topic_index.remove(chunk_ids)
+                chunk_ids = []
+            manifest.record(path, to_add[path], chunk_ids, error)
+
+    def train_index():
+        """Move a new project's staged vectors into an index of its spec, trained on them."""
+        nonlocal spec
+        flat = vector_store.index
+        live = vector_store.docstore.live_ids()
+        if not len(live):
+            # Every staged chunk was removed again; keep the empty flat index
+            spec = IndexSpec(**{**spec.to_dict(), "type": "flat"})
+            return
+        sample = np.sort(np.random.default_rng(0).permutation(live)[:spec.sample_size])
+        spec = spec.fitted(len(sample))
+        index = spec.build(flat.d, flat.reconstruct_batch(sample))
+        for start in range(0, len(live), 65536):
+            labels = live[start:start + 65536]
+            index.add_with_ids(flat.reconstruct_batch(labels), labels)
+        vector_store.index = index
+
+    # A new project whose index needs training stages the vectors of its first chunks in a
+    # flat index until there are enough to train on; the chunks themselves are stored as usual
+    staging = False
+    for chunks, vectors, batch_full_vectors, batch_query_vectors, (spans_per_chunk, sentence_vectors), finished_files in embedded:
+        if vector_store is None and chunks:
+            staging = spec.needs_training
+            first_spec = IndexSpec(**{**spec.to_dict(), "type": "flat"}) if staging else spec
+            vector_store = create_vector_store(folder, embeddings, first_spec.build(vectors.shape[1]))
+        index_batch(chunks, vectors, batch_full_vectors, batch_query_vectors, spans_per_chunk, sentence_vectors,
+                    finished_files)
+        if staging and vector_store.index.ntotal >= spec.sample_size:
+            train_index()
+            staging = False
+        # A staging index must not be saved as the project's index
+        if vector_store is not None and not staging and unflushed >= flush_every:
+            save_project(folder, vector_store, sentence_store, manifest, spec, lexical_index, topic_index,
+                 (full_vectors, query_vectors))
+            unflushed = 0
+            print(f"Flushed {len(vector_store.index_to_docstore_id)} chunks to {folder}")
+
+    if staging:
+        train_index()
+    if vector_store is None:
+        print("No chunks were produced; nothing to index.")
+        return None, None
+
+    rebuild_index(vector_store, spec)
+    sentence_store.compact()
+    vector_store.docstore.compact()
+    live_ids = vector_store.docstore.live_ids()
+    for store in (full_vectors, query_vectors):
+        if store is not None:
+            store.compact(live_ids)
+    manifest.complete = True
+    save_project(folder, vector_store, sentence_store, manifest, spec, lexical_index, topic_index,
+                 (full_vectors, query_vectors))
+    print(f"Project saved to {folder} ({len(vector_store.index_to_docstore_id)} chunks)")
+    return vector_store, sentence_store
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk-ingest PDFs into a RAG project index.")
+    parser.add_argument("topic", help="Project name; the index is written to projects/<topic>")
+    parser.add_argument("sources", nargs="+", help="Directories or glob patterns of PDF files")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding call")
+    parser.add_argument("--flush-every", type=int, default=10000, help="Save the index after this many new chunks")
+    parser.add_argument("--index", default=None,
+                        help='Index type of a new project, e.g. "hnsw", "ivf:nlist=4096,nprobe=32" or "ivfpq:nlist=4096,pq_m=48"')
+    parser.add_argument("--metadata", choices=["none", "gemini", "local"], default="none",
+                        help="Add topic/relevant_query metadata with Gemini or the offline stand-in backend")
+    parser.add_argument("--gemini-api-key", default=os.getenv("GEMINI_API_KEY"))
+    parser.add_argument("--enrich-concurrency", type=int, default=8, help="Concurrent metadata requests")
+    parser.add_argument("--enrich-rps", type=float, default=None, help="Metadata requests per second limit")
+    args = parser.parse_args(argv)
+
+    paths = find_pdfs(args.sources)
+    if not paths:
+        print("No PDF files matched the given sources.")
+        return 1
+    print(f"Found {len(paths)} PDF files")
+
+    from model_registry import acquire_embeddings
+    embeddings = acquire_embeddings(EMBEDDING_MODEL_PATH).model
+    enrich = None
+    if args.metadata != "none":
+        backend = GeminiBackend(args.gemini_api_key) if args.metadata == "gemini" else LocalEnrichmentBackend()
+        enricher = MetadataEnricher(
+            backend,
+            max_concurrency=args.enrich_concurrency,
+            requests_per_second=args.enrich_rps,
+            checkpoint_path=os.path.join(PROJECTS_DIR, args.topic, ENRICHMENT_CHECKPOINT)
+        )
+        enrich = enricher.enrich
+    update_project(paths, args.topic, embeddings, args.chunk_size, args.chunk_overlap, args.workers, args.batch_size, enrich,
+                   flush_every=args.flush_every, index_spec=args.index)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
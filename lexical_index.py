@@ -0,0 +1,287 @@
+"""BM25 keyword index of a project's chunks, and its fusion with vector search.
+
+Dense retrieval misses exact part numbers, error codes and acronyms. Every project also
+keeps an inverted index, stored next to the FAISS files as plain arrays that are
+memory-mapped when the project is opened read-only:
+
+    bm25.terms.npy      sorted vocabulary (utf-8 bytes); a term's id is its position
+    bm25.offsets.npy    start of every term's postings, plus the end
+    bm25.postings.npy   chunk ids, grouped by term
+    bm25.freqs.npy      term frequency of every posting
+    bm25.lengths.npy    token count of every chunk id, 0 for removed chunks
+
+New chunks are buffered and merged into the sorted arrays when the index is saved;
+removed chunks get length 0 and their postings are dropped at the same time.
+"""
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from project_store import save_array
+from sentence_store import split_sentences
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+SEPARATORS = re.compile(r"[-./:_]")
+MAX_TERM_BYTES = 32
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i in is it its of on or that the this to was "
+    "what when where which who why will with you your".split()
+)
+
+
+def whole_terms(text: str) -> List[str]:
+    """Lowercased word tokens, compound identifiers such as ``E-42`` or ``v2.1`` kept whole
+    and also with the separators removed (``e42``).
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if SEPARATORS.search(token):
+            tokens.append(SEPARATORS.sub("", token))
+    return [token for token in tokens if len(token.encode("utf-8")) <= MAX_TERM_BYTES]
+
+
+def tokenize(text: str) -> List[str]:
+    """whole_terms() plus the parts of compound identifiers, so ``E-42`` also matches ``42``.
+    Single-character parts are left out: they match nearly every chunk.
+    """
+    tokens = []
+    for token in whole_terms(text):
+        tokens.append(token)
+        if SEPARATORS.search(token):
+            tokens.extend(part for part in SEPARATORS.split(token) if len(part) > 1 and part not in STOPWORDS)
+    return tokens
+
+
+CODE_PARTS = re.compile(r"(?:\d+|[A-Z]{2,})(?:[-/](?:\d+|[A-Z]{2,}))+")
+
+
+def looks_like_code(word: str) -> bool:
+    """True for a code such as ``E-42``, ``XJ9000``, ``v2.1``, ``12-345`` or ``TCP/IP``:
+    letters mixed with digits, or digit groups and capitals joined by ``-`` or ``/``.
+    """
+    word = word.strip("?!.,;:'\"()")
+    if not re.fullmatch(r"[\w\-./:#]+", word):
+        return False
+    if any(char.isdigit() for char in word) and any(char.isalpha() for char in word):
+        return True
+    return CODE_PARTS.fullmatch(word) is not None
+
+
+def looks_like_identifier(query: str) -> bool:
+    """True for queries made only of one to three codes, e.g. ``E-42`` or ``XJ9000 B2``.
+
+    Ordinary words such as ``what``, ``page`` or ``ISO`` never count, nor do plain numbers.
+    """
+    words = query.split()
+    return 1 <= len(words) <= 3 and all(looks_like_code(word) for word in words)
+
+
+def matching_sentences(query: str, text: str, limit: int = 3) -> List[str]:
+    """The first sentences of text that contain a query term, or its first sentences if none do."""
+    terms = set(tokenize(query))
+    sentences = [text[start:end] for start, end in split_sentences(text)]
+    matching = [sentence for sentence in sentences if terms.intersection(tokenize(sentence))]
+    return (matching or sentences)[:limit]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], weights: Sequence[float], k: int = 60) -> List[int]:
+    """Merge ranked id lists: every list adds weight / (k + rank) to the ids it contains."""
+    scores: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridConfig:
+    """How vector and keyword results are fused; set per project when it is opened."""
+
+    def __init__(self, enabled: bool = True, dense_weight: float = 1.0, lexical_weight: float = 1.0,
+                 dense_k: int = 20, lexical_k: int = 20, rrf_k: int = 60, identifier_shortcut: bool = True,
+                 identifier_min_score: float = 2.0, identifier_score_ratio: float = 0.5):
+        self.enabled = enabled
+        self.dense_weight = float(dense_weight)
+        self.lexical_weight = float(lexical_weight)
+        self.dense_k = int(dense_k)
+        self.lexical_k = int(lexical_k)
+        self.rrf_k = int(rrf_k)
+        self.identifier_shortcut = identifier_shortcut
+        # BM25 score the best keyword hit of a code needs to skip vector search; rarer codes score higher
+        self.identifier_min_score = float(identifier_min_score)
+        # Other hits without the whole code must score this fraction of the best to be used
+        self.identifier_score_ratio = float(identifier_score_ratio)
+
+    @classmethod
+    def parse(cls, config: Union[None, bool, dict, "HybridConfig"]) -> "HybridConfig":
+        if isinstance(config, HybridConfig):
+            return config
+        if isinstance(config, dict):
+            return cls(**config)
+        return cls(enabled=config is not False)
+
+
+class LexicalIndex:
+    """BM25 inverted index over a project's chunk ids."""
+
+    TERMS_FILE = "bm25.terms.npy"
+    OFFSETS_FILE = "bm25.offsets.npy"
+    POSTINGS_FILE = "bm25.postings.npy"
+    FREQS_FILE = "bm25.freqs.npy"
+    LENGTHS_FILE = "bm25.lengths.npy"
+    FILES = (TERMS_FILE, OFFSETS_FILE, POSTINGS_FILE, FREQS_FILE, LENGTHS_FILE)
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, postings: np.ndarray, freqs: np.ndarray,
+                 lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        self.freqs = freqs
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        # Postings of chunks added since the last merge: (terms, chunk ids, frequencies)
+        self._pending: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._update_stats()
+
+    @classmethod
+    def empty(cls) -> "LexicalIndex":
+        return cls(np.zeros(0, dtype=f"S{MAX_TERM_BYTES}"), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                   np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+
+    @classmethod
+    def exists(cls, folder: str) -> bool:
+        return all(os.path.exists(os.path.join(folder, name)) for name in cls.FILES)
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = False) -> Optional["LexicalIndex"]:
+        """Load a persisted index, memory-mapped if requested, or return None if there is none."""
+        if not cls.exists(folder):
+            return None
+        return cls(*(np.load(os.path.join(folder, name), mmap_mode='r' if mmap else None) for name in cls.FILES))
+
+    @classmethod
+    def build(cls, docstore, batch_size: int = 4096) -> "LexicalIndex":
+        """Index every live chunk of a project's docstore (projects created before keyword search)."""
+        index = cls.empty()
+        live = docstore.live_ids()
+        for start in range(0, len(live), batch_size):
+            ids = live[start:start + batch_size].tolist()
+            index.add(ids, [docstore.search(str(i)).page_content for i in ids])
+        print(f"Built keyword index over {len(live)} chunks")
+        return index
+
+    def _update_stats(self):
+        live = self.lengths[self.lengths > 0]
+        self._live_count = len(live)
+        self._average_length = float(live.mean()) if len(live) else 0.0
+
+    def add(self, chunk_ids: Sequence[int], texts: Sequence[str]):
+        """Index new chunks; their ids must be past every id indexed so far."""
+        if not len(chunk_ids):
+            return
+        terms, docs, freqs = [], [], []
+        if min(chunk_ids) < len(self.lengths):
+            raise ValueError(f"Chunk ids must be added in order; got {min(chunk_ids)} after {len(self.lengths) - 1}")
+        lengths = np.zeros(max(chunk_ids) + 1 - len(self.lengths), dtype=np.int32)
+        for chunk_id, text in zip(chunk_ids, texts):
+            counts = Counter(tokenize(text))
+            lengths[chunk_id - len(self.lengths)] = sum(counts.values())
+            terms.extend(term.encode("utf-8") for term in counts)
+            docs.extend([chunk_id] * len(counts))
+            freqs.extend(counts.values())
+        self.lengths = np.concatenate([self.lengths, lengths])
+        self._pending.append((np.array(terms, dtype=f"S{MAX_TERM_BYTES}"), np.array(docs, dtype=np.int64),
+                              np.array(freqs, dtype=np.int32)))
+        self._update_stats()
+
+    def remove(self, chunk_ids: Sequence[int]):
+        ids = np.array(list(chunk_ids), dtype=np.int64)
+        ids = ids[(ids >= 0) & (ids < len(self.lengths))]
+        if len(ids):
+            self.lengths = np.array(self.lengths)
+            self.lengths[ids] = 0
+            self._update_stats()
+
+    def _merge(self):
+        """Fold pending postings into the sorted arrays and drop postings of removed chunks."""
+        new_terms = np.concatenate([terms for terms, _, _ in self._pending] or [self.terms[:0]])
+        vocab = np.unique(np.concatenate([np.asarray(self.terms), new_terms]))
+        old_ids = np.searchsorted(vocab, self.terms)
+        term_ids = np.concatenate([np.repeat(old_ids, np.diff(self.offsets)), np.searchsorted(vocab, new_terms)])
+        docs = np.concatenate([np.asarray(self.postings)] + [docs for _, docs, _ in self._pending])
+        freqs = np.concatenate([np.asarray(self.freqs)] + [freqs for _, _, freqs in self._pending])
+        live = self.lengths[docs] > 0
+        term_ids, docs, freqs = term_ids[live], docs[live], freqs[live]
+        # Terms whose chunks were all removed leave the vocabulary
+        counts = np.bincount(term_ids, minlength=len(vocab))
+        used = counts > 0
+        term_ids = (np.cumsum(used) - 1)[term_ids]
+        order = np.lexsort((docs, term_ids))
+        self.terms = vocab[used]
+        self.offsets = np.concatenate([[0], np.cumsum(counts[used])]).astype(np.int64)
+        self.postings, self.freqs = docs[order], freqs[order]
+        self._pending = []
+
+    def save(self, folder: str):
+        if self._pending or len(self.postings) != int(self.offsets[-1]) or (self.lengths[self.postings] == 0).any():
+            self._merge()
+        os.makedirs(folder, exist_ok=True)
+        for name, array in zip(self.FILES, (self.terms, self.offsets, self.postings, self.freqs, self.lengths)):
+            save_array(os.path.join(folder, name), array)
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(chunk ids, term frequencies, chunk lengths) of the live chunks containing term."""
+        key = term.encode("utf-8")
+        position = int(np.searchsorted(self.terms, key))
+        if position >= len(self.terms) or self.terms[position] != key:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32)
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        docs = np.asarray(self.postings[start:end])
+        tf = np.asarray(self.freqs[start:end], dtype=np.float32)
+        lengths = self.lengths[docs]
+        alive = lengths > 0
+        return docs[alive], tf[alive], lengths[alive]
+
+    def code_hits(self, query: str, hits: Sequence[Tuple[int, float]], min_score: float,
+                  score_ratio: float) -> List[Tuple[int, float]]:
+        """The hits of an identifier query (see looks_like_identifier) worth answering from.
+
+        None unless the best hit scores at least min_score; then the hits whose chunk contains
+        a whole code of the query, or that score at least score_ratio of the best hit.
+        """
+        if not hits or hits[0][1] < min_score:
+            return []
+        if self._pending:
+            self._merge()
+        whole = set()
+        for term in set(whole_terms(query)):
+            whole.update(self._postings(term)[0].tolist())
+        return [(chunk_id, score) for chunk_id, score in hits
+                if chunk_id in whole or score >= score_ratio * hits[0][1]]
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[int, float]]:
+        """The k best (chunk id, BM25 score) pairs for the query terms."""
+        if self._pending:
+            self._merge()
+        if not self._live_count:
+            return []
+        scores = np.zeros(len(self.lengths), dtype=np.float32)
+        for term in set(tokenize(query)):
+            docs, tf, lengths = self._postings(term)
+            if not len(docs):
+                continue
+            idf = math.log(1 + (self._live_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths / self._average_length)
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+        top = np.flatnonzero(scores)
+        if len(top) > k:
+            top = top[np.argpartition(-scores[top], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top]
@@ -1,4 +1,6 @@
 import json
+import os
+import sys
 from classify import classify_query_by_similarity
 import numpy as np
 from langchain.embeddings import HuggingFaceEmbeddings
@@ -6,6 +8,10 @@ from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import accuracy_score, classification_report
 import matplotlib.pyplot as plt
+
+# Add parent directory to path to find similarity.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from similarity import normalize_rows, reference_centroid, mean_cosine
 # Read JSON file and convert to Python list
 def json_file_to_list(file_path):
     with open(file_path, 'r') as file:
@@ -17,66 +23,31 @@ def json_file_to_list(file_path):
 
 def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
     """Calculate cosine similarity between two vectors"""
-    dot_product = np.dot(vec1, vec2)
-    norm_vec1 = np.linalg.norm(vec1)
-    norm_vec2 = np.linalg.norm(vec2)
-    
-    if norm_vec1 == 0 or norm_vec2 == 0:
-        return 0.0
-    
-    return dot_product / (norm_vec1 * norm_vec2)
+    return float(normalize_rows(vec1)[0] @ normalize_rows(vec2)[0])
+
+
+def average_positive_similarity(samples, embeddings: HuggingFaceEmbeddings, positive_embeddings: np.ndarray) -> np.ndarray:
+    """Average cosine similarity of every sample to the positive set, embedding all samples in one call"""
+    sample_embeddings = np.array(embeddings.embed_documents(list(samples)))
+    return mean_cosine(sample_embeddings, centroid=reference_centroid(positive_embeddings))
 
 
 def predict(query: str, embeddings: HuggingFaceEmbeddings, positive_embeddings: np.ndarray, threshold: float=0.026198) -> bool:
     query_embedding = embeddings.embed_query(query)
     
-    positive_similarities = []
-    for pos_emb in positive_embeddings:
-        sim = cosine_similarity(query_embedding, pos_emb)
-        positive_similarities.append(sim)
-    
-    avg_positive_similarity = np.mean(positive_similarities)
-    
-    similarity = avg_positive_similarity
+    similarity = mean_cosine(query_embedding, positive_embeddings)
     print(similarity)
     return similarity < threshold
 
 def prepare_training_data(positive_samples, negative_samples, embeddings, positive_embeddings, negative_embeddings):
     """Prepare training data with similarity scores and labels"""
-    X = []  # Similarity scores
-    y = []  # Labels (1 for positive class, 0 for negative class)
+    # Feature: average similarity to positive class, computed for all samples at once
+    similarities = average_positive_similarity(positive_samples + negative_samples, embeddings, positive_embeddings)
     
-    # Calculate similarities for positive samples
-    for i, sample in enumerate(positive_samples):
-        query_embedding = embeddings.embed_query(sample)
-        
-        # Calculate average similarity to positive embeddings
-        pos_similarities = []
-        for pos_emb in positive_embeddings:
-            sim = cosine_similarity(query_embedding, pos_emb)
-            pos_similarities.append(sim)
-        
-        avg_pos_similarity = np.mean(pos_similarities)
-        
-        X.append([avg_pos_similarity])  # Feature: average similarity to positive class
-        y.append(1)  # Label: positive class
-    
-    # Calculate similarities for negative samples
-    for i, sample in enumerate(negative_samples):
-        query_embedding = embeddings.embed_query(sample)
-        
-        # Calculate average similarity to positive embeddings
-        pos_similarities = []
-        for pos_emb in positive_embeddings:
-            sim = cosine_similarity(query_embedding, pos_emb)
-            pos_similarities.append(sim)
-        
-        avg_pos_similarity = np.mean(pos_similarities)
-        
-        X.append([avg_pos_similarity])  # Feature: average similarity to positive class
-        y.append(0)  # Label: negative class
+    X = similarities.reshape(-1, 1)  # Similarity scores
+    y = np.array([1] * len(positive_samples) + [0] * len(negative_samples))  # Labels (1 for positive class, 0 for negative class)
     
-    return np.array(X), np.array(y)
+    return X, y
 
 def find_optimal_threshold_linear_regression(positive_samples, negative_samples, embeddings, positive_embeddings, negative_embeddings):
     """Find optimal threshold using linear regression approach"""
@@ -101,10 +72,8 @@ def find_optimal_threshold_linear_regression(positive_samples, negative_samples,
     print(f"Intercept: {lr_model.intercept_:.6f}")
     print(f"Optimal threshold (decision boundary): {optimal_threshold:.6f}")
     
-    # Validate the threshold
-    val_predictions = [predict(positive_samples[i] if i < len(positive_samples) else negative_samples[i - len(positive_samples)], 
-                              embeddings, positive_embeddings, negative_embeddings, optimal_threshold) 
-                      for i in range(len(X_val))]
+    # Validate the threshold on the held-out similarity scores
+    val_predictions = (X_val[:, 0] > optimal_threshold).astype(int)
     
     val_accuracy = accuracy_score(y_val, val_predictions)
     print(f"Validation accuracy with optimal threshold: {val_accuracy:.4f}")
@@ -115,56 +84,30 @@ def grid_search_threshold(positive_samples, negative_samples, embeddings, positi
                          threshold_range=None, cv_folds=5):
     """Alternative: Grid search approach to find optimal threshold"""
     
-    if threshold_range is None:
-        # Create threshold range based on similarity distribution
-        all_similarities = []
-        
-        # Calculate similarities for all samples
-        for sample in positive_samples + negative_samples:
-            query_embedding = embeddings.embed_query(sample)
-            pos_similarities = []
-            for pos_emb in positive_embeddings:
-                sim = cosine_similarity(query_embedding, pos_emb)
-                pos_similarities.append(sim)
-            avg_sim = np.mean(pos_similarities)
-            all_similarities.append(avg_sim)
-        
-        min_sim = min(all_similarities)
-        max_sim = max(all_similarities)
-        threshold_range = np.linspace(min_sim, max_sim, 100)
-    
     # Prepare full dataset
     X, y = prepare_training_data(positive_samples, negative_samples, embeddings, positive_embeddings, negative_embeddings)
     
-    best_threshold = 0.5
-    best_accuracy = 0.0
-    threshold_accuracies = []
+    if threshold_range is None:
+        # Create threshold range based on similarity distribution
+        threshold_range = np.linspace(X[:, 0].min(), X[:, 0].max(), 100)
+    threshold_range = np.asarray(threshold_range)
     
     print("Grid search for optimal threshold...")
     
-    for threshold in threshold_range:
-        # Cross-validation
-        fold_accuracies = []
-        
-        for fold in range(cv_folds):
-            # Split data for this fold
-            X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=fold, stratify=y)
-            
-            # Make predictions with current threshold
-            val_predictions = []
-            for i, similarity_score in enumerate(X_val):
-                prediction = 1 if similarity_score[0] > threshold else 0
-                val_predictions.append(prediction)
-            
-            fold_accuracy = accuracy_score(y_val, val_predictions)
-            fold_accuracies.append(fold_accuracy)
-        
-        avg_accuracy = np.mean(fold_accuracies)
-        threshold_accuracies.append((threshold, avg_accuracy))
-        
-        if avg_accuracy > best_accuracy:
-            best_accuracy = avg_accuracy
-            best_threshold = threshold
+    # Cross-validation: score every threshold on a fold with one broadcast comparison
+    fold_accuracies = []
+    for fold in range(cv_folds):
+        # Split data for this fold
+        X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=fold, stratify=y)
+        val_predictions = X_val[:, 0][None, :] > threshold_range[:, None]
+        fold_accuracies.append((val_predictions == y_val[None, :]).mean(axis=1))
+    
+    avg_accuracies = np.mean(fold_accuracies, axis=0)
+    threshold_accuracies = list(zip(threshold_range.tolist(), avg_accuracies.tolist()))
+    
+    best_index = int(np.argmax(avg_accuracies))
+    best_threshold = threshold_range[best_index]
+    best_accuracy = avg_accuracies[best_index]
     
     print(f"Best threshold from grid search: {best_threshold:.6f}")
     print(f"Best cross-validation accuracy: {best_accuracy:.4f}")
@@ -177,10 +120,8 @@ def evaluate_threshold(threshold, positive_samples, negative_samples, embeddings
     all_samples = positive_samples + negative_samples
     true_labels = [1] * len(positive_samples) + [0] * len(negative_samples)
     
-    predictions = []
-    for sample in all_samples:
-        prediction = predict(sample, embeddings, positive_embeddings, negative_embeddings, threshold)
-        predictions.append(int(prediction))
+    similarities = average_positive_similarity(all_samples, embeddings, positive_embeddings)
+    predictions = (similarities > threshold).astype(int).tolist()
     
     accuracy = accuracy_score(true_labels, predictions)
     report = classification_report(true_labels, predictions, target_names=['Negative', 'Positive'])
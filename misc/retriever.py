@@ -1,38 +1,65 @@
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.documents import Document
 from langchain_core.callbacks import CallbackManagerForRetrieverRun
-from typing import List
+from typing import Any, List, Optional
+
+import numpy as np
+
+import similarity
+from index_spec import IndexSpec
+from topic_index import search_subset
+
+
 class TopicQueryRetriever(BaseRetriever):
-    def __init__(self, vector_store, target_topic=None, k=5):
-        super().__init__()
-        self.vector_store = vector_store
-        self.target_topic = target_topic
-        self.k = k
-    
+    """Retrieves chunks of one topic.
+
+    With the project's TopicIndex only that topic's vectors are searched; without it the
+    topic is applied as a metadata filter after the search. A Reranker (see reranker.py)
+    re-scores the k*2 candidates with their relevant_query and topic vectors.
+    """
+    vector_store: Any
+    target_topic: Optional[str] = None
+    k: int = 5
+    topic_index: Any = None
+    index_spec: Any = None
+    reranker: Any = None
+
+    def __init__(self, vector_store, target_topic=None, k=5, topic_index=None, index_spec=None, reranker=None):
+        super().__init__(vector_store=vector_store, target_topic=target_topic, k=k, topic_index=topic_index,
+                         index_spec=index_spec or IndexSpec(), reranker=reranker)
+
+    def _topic_candidates(self, query_vector, k: int):
+        """(document, distance) pairs from the topic's own chunk ids"""
+        chunk_ids = self.topic_index.chunk_ids(self.target_topic)
+        hits = search_subset(self.vector_store.index, self.index_spec, query_vector, chunk_ids, k)
+        id_map = self.vector_store.index_to_docstore_id
+        return [(self.vector_store.docstore.search(id_map[chunk_id]), distance)
+                for chunk_id, distance in hits if chunk_id in id_map]
+
     def _get_relevant_documents(
-        self, 
-        query: str, 
-        *, 
+        self,
+        query: str,
+        *,
         run_manager: CallbackManagerForRetrieverRun
     ) -> List[Document]:
-        # Filter by topic if specified
-        filter_dict = {"topic": self.target_topic} if self.target_topic else {}
-        
-        # Get candidates with metadata
-        candidates = self.vector_store.similarity_search_with_score(
-            query, 
-            k=self.k*2,
-            filter=filter_dict
-        )
-        
-        # Custom re-ranking logic based on relevant_query metadata
-        scored_docs = []
-        for doc, similarity_score in candidates:
-            # Compare user query with stored relevant_query in metadata
-            relevant_query = doc.metadata.get("relevant_query", "")
-            # Add your custom scoring logic here
-            
-            scored_docs.append((doc, similarity_score))
-        
-        # Sort by your custom scoring and return top k
-        return [doc for doc, score in scored_docs[:self.k]]
+        query_vector = self.vector_store.embedding_function.embed_query(query)
+        if self.target_topic and self.topic_index is not None:
+            candidates = self._topic_candidates(query_vector, self.k * 2)
+        else:
+            # Filter by topic if specified
+            filter_dict = {"topic": self.target_topic} if self.target_topic else {}
+
+            # Get candidates with metadata
+            candidates = self.vector_store.similarity_search_with_score_by_vector(
+                query_vector,
+                k=self.k*2,
+                filter=filter_dict
+            )
+        if self.reranker is None or not candidates:
+            return [doc for doc, _ in candidates[:self.k]]
+
+        # Re-rank on chunk, relevant_query and topic similarity in one pass
+        chunk_ids = np.array([doc.metadata["chunk_id"] for doc, _ in candidates], dtype=np.int64)
+        chunk_scores = similarity.cosine_scores(query_vector, self.vector_store.index.reconstruct_batch(chunk_ids))
+        scores = self.reranker.scores(query_vector, chunk_ids, chunk_scores)
+        return [candidates[i][0] for i in np.argsort(-scores, kind="stable")[:self.k]]
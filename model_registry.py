@@ -0,0 +1,107 @@
+"""Process-wide registry of loaded models.
+
+Every project used to load its own embedding model and its own copy of the GGUF
+weights. The registry hands out one shared, reference-counted instance per model
+path and load parameters, so an open project costs only its index memory. Concurrent
+requests for a model that is still loading wait for that load instead of starting
+another one.
+"""
+import threading
+from time import perf_counter as timer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import EMBEDDING_MODEL_PATH, LLM_MODEL_PATH
+
+
+class SharedModel:
+    """A loaded model plus its reference count.
+
+    lock serializes callers of models that must not be used concurrently, such as a
+    llama.cpp context; it is a plain Lock so a streaming generator may release it from
+    whichever thread closes it.
+    """
+
+    def __init__(self, key: Tuple):
+        self.key = key
+        self.kind, self.path, params = key
+        self.params = dict(params)
+        self.model = None
+        self.refs = 0
+        self.load_time = None
+        self.error: Optional[BaseException] = None
+        self.loaded = threading.Event()
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """Loads each (kind, path, params) model once and shares it until the last user releases it."""
+
+    def __init__(self):
+        self._entries: Dict[Tuple, SharedModel] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, kind: str, path: str, loader: Callable[..., Any], **params) -> SharedModel:
+        """Return the shared model for kind/path/params, loading it with loader(path, **params) if needed."""
+        key = (kind, path, tuple(sorted(params.items())))
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = SharedModel(key)
+            entry.refs += 1
+        if not owner:
+            entry.loaded.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry
+        try:
+            start_time = timer()
+            entry.model = loader(path, **params)
+            entry.load_time = timer() - start_time
+            print(f"Loaded {kind} model {path} in {entry.load_time:.1f}s")
+        except BaseException as e:
+            entry.error = e
+            with self._lock:
+                self._entries.pop(key, None)
+            raise
+        finally:
+            entry.loaded.set()
+        return entry
+
+    def release(self, entry: SharedModel):
+        """Drop one reference; the model is freed once nobody holds it."""
+        with self._lock:
+            entry.refs -= 1
+            if entry.refs <= 0 and self._entries.get(entry.key) is entry:
+                del self._entries[entry.key]
+                entry.model = None
+                print(f"Unloaded {entry.kind} model {entry.path}")
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [
+                {"kind": e.kind, "path": e.path, "params": e.params, "refs": e.refs,
+                 "loaded": e.loaded.is_set() and e.error is None, "load_time": e.load_time}
+                for e in self._entries.values()
+            ]
+
+
+registry = ModelRegistry()
+
+
+def _load_embeddings(path: str):
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=path)
+
+
+def _load_llm(path: str, **params):
+    from llama_cpp import Llama
+    return Llama(model_path=path, verbose=False, **params)
+
+
+def acquire_embeddings(path: str = EMBEDDING_MODEL_PATH) -> SharedModel:
+    return registry.acquire("embeddings", path, _load_embeddings)
+
+
+def acquire_llm(path: str = LLM_MODEL_PATH, n_ctx: int = 2048, n_threads: int = 4) -> SharedModel:
+    return registry.acquire("llm", path, _load_llm, n_ctx=n_ctx, n_threads=n_threads)
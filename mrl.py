@@ -0,0 +1,155 @@
+"""Matryoshka (MRL) embedding truncation.
+
+MRL models are trained so that every prefix of an embedding is itself a usable
+embedding. Projects whose IndexSpec sets ``dim`` index and search only that prefix,
+re-normalized; with ``rescore`` set they also keep the full vectors on disk and
+re-score the candidates of the short-prefix search at full dimension.
+"""
+import os
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from project_store import load_array, save_array
+from similarity import normalize_rows
+
+
+class TruncatedEmbeddings(Embeddings):
+    """Embeddings wrapper returning the first dim components of every vector, re-normalized."""
+
+    def __init__(self, base: Embeddings, dim: int):
+        self.base = base
+        self.dim = dim
+
+    def truncate(self, vectors) -> np.ndarray:
+        """Cut full-dimension vectors (1-D or 2-D) down to the prefix and re-normalize them."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[-1] < self.dim:
+            raise ValueError(f"Cannot truncate {vectors.shape[-1]}-dimensional embeddings to {self.dim}")
+        truncated = normalize_rows(vectors[..., :self.dim])
+        return truncated[0] if vectors.ndim == 1 else truncated
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.truncate(self.base.embed_documents(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.truncate(self.base.embed_query(text)).tolist()
+
+
+class FullVectors:
+    """Full-dimension chunk vectors kept next to a truncated index, one row per chunk id.
+
+    Stored as ``vectors.full.f32``: an int64 dimension header followed by raw float32
+    rows. Rows are appended straight to the file during ingest and the file is
+    memory-mapped for reading, so neither side holds the matrix in RAM. Row i belongs to
+    chunk id i until compact() drops the rows of removed chunks; from then on
+    ``vectors.full.rows.npy`` maps every chunk id to its row, -1 for chunks without one.
+    """
+
+    FILE_NAME = "vectors.full.f32"
+    HEADER = np.dtype(np.int64).itemsize
+
+    def __init__(self, folder: str):
+        self.path = os.path.join(folder, self.FILE_NAME)
+        self.rows_path = os.path.join(folder, self.FILE_NAME.rsplit(".", 1)[0] + ".rows.npy")
+        self._matrix = None
+        self._rows = load_array(self.rows_path, mmap=False, dtype=np.int64) if os.path.exists(self.rows_path) else None
+
+    @classmethod
+    def create(cls, folder: str) -> "FullVectors":
+        os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, cls.FILE_NAME), 'wb').close()
+        store = cls(folder)
+        if store._rows is not None:
+            os.remove(store.rows_path)
+            store._rows = None
+        return store
+
+    @classmethod
+    def exists(cls, folder: str) -> bool:
+        return os.path.exists(os.path.join(folder, cls.FILE_NAME))
+
+    def _dim(self) -> int:
+        with open(self.path, 'rb') as file:
+            header = file.read(self.HEADER)
+        return int(np.frombuffer(header, dtype=np.int64)[0]) if header else 0
+
+    def _row_count(self) -> int:
+        dim = self._dim()
+        return (os.path.getsize(self.path) - self.HEADER) // (4 * dim) if dim else 0
+
+    def __len__(self) -> int:
+        """Number of chunk ids covered: rows before compaction, the row map after."""
+        return self._row_count() if self._rows is None else len(self._rows)
+
+    def rows(self, chunk_ids) -> np.ndarray:
+        """Row of every chunk id, -1 for ids without one."""
+        ids = np.asarray(chunk_ids, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self))
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        rows[known] = ids[known] if self._rows is None else self._rows[ids[known]]
+        return rows
+
+    def append(self, first_id: int, vectors: np.ndarray):
+        """Write the vectors of chunk ids first_id, first_id + 1, ...
+
+        Rows of first_id and later ids, left by an interrupted ingest, are overwritten, and
+        ids skipped before first_id get zero rows (or none once the row map exists).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        dim = self._dim() or vectors.shape[1]
+        with open(self.path, 'r+b') as file:
+            if not self._dim():
+                file.write(np.array([dim], dtype=np.int64).tobytes())
+            if self._rows is None:
+                rows = self._row_count()
+                if rows > first_id:
+                    file.truncate(self.HEADER + first_id * dim * 4)
+                file.seek(0, os.SEEK_END)
+                if rows < first_id:
+                    file.write(np.zeros((first_id - rows, dim), dtype=np.float32).tobytes())
+            else:
+                kept = self._rows[:first_id]
+                end = int(kept.max()) + 1 if len(kept) and kept.max() >= 0 else 0
+                file.truncate(self.HEADER + end * dim * 4)
+                file.seek(0, os.SEEK_END)
+                self._rows = np.concatenate([kept, np.full(first_id - len(kept), -1, dtype=np.int64),
+                                             np.arange(end, end + len(vectors), dtype=np.int64)])
+            file.write(vectors.tobytes())
+        self._matrix = None
+
+    def get(self, chunk_ids) -> np.ndarray:
+        """Full vectors of the given chunk ids, read from the memory-mapped file."""
+        if self._matrix is None:
+            dim = self._dim()
+            self._matrix = np.memmap(self.path, dtype=np.float32, mode='r', offset=self.HEADER).reshape(-1, dim)
+        return np.asarray(self._matrix[self.rows(chunk_ids)])
+
+    def save(self):
+        """Save the row map, if there is one; rows themselves are written as they are appended."""
+        if self._rows is not None:
+            save_array(self.rows_path, self._rows)
+
+    def compact(self, live_ids, max_dead_fraction: float = 0.25) -> bool:
+        """Rewrite the file with only the rows of live_ids once enough rows are dead."""
+        total = self._row_count()
+        live_ids = np.asarray(live_ids, dtype=np.int64)
+        live_ids = live_ids[self.rows(live_ids) >= 0]
+        dead = total - len(live_ids)
+        if not total or dead <= max_dead_fraction * total:
+            return False
+        print(f"Compacting {self.FILE_NAME}: dropping {dead} dead rows")
+        live_ids = np.sort(live_ids)
+        dim = self._dim()
+        vectors = self.get(live_ids)
+        with open(self.path + ".tmp", 'wb') as file:
+            file.write(np.array([dim], dtype=np.int64).tobytes())
+            file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        rows = np.full(len(self), -1, dtype=np.int64)
+        rows[live_ids] = np.arange(len(live_ids), dtype=np.int64)
+        self._matrix = None
+        os.replace(self.path + ".tmp", self.path)
+        self._rows = rows
+        self.save()
+        return True
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_stat(path: str) -> List[int]:
+    """[size, mtime_ns] of a file, used to skip hashing files that have not been touched."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def to_ranges(ids: List[int]) -> List[List[int]]:
+    """Compress integer ids into sorted [start, stop) ranges."""
+    ranges = []
+    for i in sorted(ids):
+        if ranges and ranges[-1][1] == i:
+            ranges[-1][1] = i + 1
+        else:
+            ranges.append([i, i + 1])
+    return ranges
+
+
+class ProjectManifest:
+    """Per-project record of every source file's content hash and the chunk ids it produced.
+
+    Stored as ``manifest.json`` in the project folder and used to ingest only new or
+    changed files and to delete the chunks of files that were removed. Chunk ids are
+    stored as [start, stop) ranges and files whose size and mtime are unchanged are not
+    re-hashed, so checking a large project costs one stat per file. ``complete`` is False
+    while an ingest is still streaming into the project.
+    """
+
+    FILE_NAME = "manifest.json"
+    VERSION = 2
+
+    def __init__(self, folder: str, files: Dict[str, dict] = None, complete: bool = True):
+        self.folder = folder
+        self.files = files or {}
+        self.complete = complete
+        self.changed = False
+
+    @classmethod
+    def load(cls, folder: str) -> "ProjectManifest":
+        """Load the manifest; manifests of older project formats load as empty."""
+        path = os.path.join(folder, cls.FILE_NAME)
+        if not os.path.exists(path):
+            return cls(folder)
+        with open(path, 'r') as file:
+            data = json.load(file)
+        if data.get("version") != cls.VERSION:
+            return cls(folder)
+        return cls(folder, data.get("files", {}), data.get("complete", True))
+
+    @classmethod
+    def exists(cls, folder: str) -> bool:
+        return os.path.exists(os.path.join(folder, cls.FILE_NAME))
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, self.FILE_NAME)
+        with open(path + ".tmp", 'w') as file:
+            json.dump({"version": self.VERSION, "complete": self.complete, "files": self.files}, file)
+        os.replace(path + ".tmp", path)
+
+    def diff(self, paths: List[str]) -> Tuple[Dict[str, str], List[str]]:
+        """Compare the current file set with the manifest.
+
+        Returns ({path: hash} of new or changed files, [paths] of changed or removed files
+        whose old chunks must be deleted).
+        """
+        current = {os.path.abspath(p): p for p in paths}
+        to_add = {}
+        to_remove = []
+        for key, path in current.items():
+            entry = self.files.get(key)
+            if entry is not None and entry.get("stat") == file_stat(path):
+                continue
+            digest = file_hash(path)
+            if entry is None or entry["hash"] != digest:
+                to_add[path] = digest
+                if entry is not None:
+                    to_remove.append(key)
+            else:
+                entry["stat"] = file_stat(path)
+                self.changed = True
+        to_remove.extend(key for key in self.files if key not in current)
+        return to_add, to_remove
+
+    def fingerprint(self) -> str:
+        """Hash of the indexed file contents and their chunk ids; it changes whenever the index does."""
+        indexed = sorted((key, entry["hash"], entry["chunks"]) for key, entry in self.files.items())
+        return hashlib.sha256(json.dumps(indexed).encode("utf-8")).hexdigest()
+
+    def chunk_ids(self, keys: List[str]) -> List[int]:
+        return [i for key in keys for start, stop in self.files.get(key, {}).get("chunks", []) for i in range(start, stop)]
+
+    def remove(self, keys: List[str]):
+        for key in keys:
+            self.files.pop(key, None)
+
+    def record(self, path: str, digest: str, chunk_ids: List[int], error: Optional[str] = None):
+        """Record an ingested file; unreadable files are kept with their error so they are only retried once changed."""
+        entry = {"hash": digest, "stat": file_stat(path), "chunks": to_ranges(chunk_ids)}
+        if error is not None:
+            entry["error"] = error
+        self.files[os.path.abspath(path)] = entry
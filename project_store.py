@@ -0,0 +1,233 @@
+"""On-disk project format: a memory-mappable vector index and an offset-addressed chunk store.
+
+    projects/<topic>/
+        vectors.faiss        FAISS index; its labels are the chunk ids
+        chunks.jsonl         one JSON record (text + metadata) per chunk, append-only between compactions
+        chunks.offsets.npy   byte offset of every chunk's record by chunk id, negative once deleted
+        sentences.*.npy      sentence spans and embeddings (see sentence_store.py)
+        bm25.*.npy           keyword index of the chunks (see lexical_index.py)
+        topics.*             topic label of every chunk id (see topic_index.py)
+        manifest.json        source files and the chunk ids they produced (see project_manifest.py)
+
+Nothing is pickled. Opened read-only, the index and offsets are memory-mapped and chunk
+text is read from disk only for the chunks a query actually retrieves, so several processes
+can share one project through the OS page cache.
+"""
+import json
+import os
+import threading
+from collections.abc import Mapping
+from typing import Dict, List, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+INDEX_FILE = "vectors.faiss"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "chunks.offsets.npy"
+# Offsets of deleted chunks: record still in chunks.jsonl, or dropped by ChunkStore.compact()
+DELETED = -1
+RECLAIMED = -2
+
+
+def save_array(path: str, array: np.ndarray):
+    """np.save through a temporary file so readers never see a half-written array."""
+    with open(path + ".tmp", 'wb') as file:
+        np.save(file, array)
+    os.replace(path + ".tmp", path)
+
+
+def load_array(path: str, mmap: bool, dtype) -> np.ndarray:
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=dtype)
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+
+class ChunkStore(Docstore, AddableMixin):
+    """Docstore keeping chunk text and metadata in an append-only JSON-lines file.
+
+    Docstore ids are the chunk ids as strings. Records are located through an offsets
+    array indexed by chunk id and read with a single seek, so opening a project costs
+    nothing per chunk. Deleted records stay in the file until compact() rewrites it.
+    """
+
+    def __init__(self, folder: str, offsets: np.ndarray, writable: bool):
+        self.folder = folder
+        self.path = os.path.join(folder, CHUNKS_FILE)
+        self.offsets = offsets
+        self.writable = writable
+        self._new_offsets = []
+        self._live = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, folder: str, writable: bool = False) -> "ChunkStore":
+        offsets = load_array(os.path.join(folder, OFFSETS_FILE), mmap=not writable, dtype=np.int64)
+        if writable:
+            offsets = np.array(offsets, dtype=np.int64)
+        return cls(folder, offsets, writable)
+
+    @property
+    def next_id(self) -> int:
+        """Id the next added chunk will get; ids are never reused."""
+        return len(self.offsets) + len(self._new_offsets)
+
+    def _offset(self, chunk_id: int) -> int:
+        if chunk_id < 0 or chunk_id >= self.next_id:
+            return -1
+        if chunk_id < len(self.offsets):
+            return int(self.offsets[chunk_id])
+        return self._new_offsets[chunk_id - len(self.offsets)]
+
+    def is_live(self, chunk_id: int) -> bool:
+        return self._offset(chunk_id) >= 0
+
+    def live_ids(self) -> np.ndarray:
+        self._consolidate()
+        return np.flatnonzero(np.asarray(self.offsets) >= 0)
+
+    def __len__(self) -> int:
+        if self._live is None:
+            self._live = int(np.count_nonzero(np.asarray(self.offsets) >= 0)) + sum(o >= 0 for o in self._new_offsets)
+        return self._live
+
+    def search(self, search: str) -> Union[str, Document]:
+        offset = self._offset(int(search))
+        if offset < 0:
+            return f"ID {search} not found."
+        with self._lock:
+            if self._reader is None:
+                self._reader = open(self.path, 'rb')
+            self._reader.seek(offset)
+            record = json.loads(self._reader.readline())
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        """Append documents; their ids must be the next consecutive chunk ids."""
+        if not self.writable:
+            raise ValueError("Chunk store was opened read-only")
+        with self._lock, open(self.path, 'ab') as file:
+            position = file.tell()
+            for chunk_id, doc in texts.items():
+                if int(chunk_id) != self.next_id:
+                    raise ValueError(f"Expected chunk id {self.next_id}, got {chunk_id}")
+                line = (json.dumps({"text": doc.page_content, "metadata": doc.metadata}) + "\n").encode("utf-8")
+                file.write(line)
+                self._new_offsets.append(position)
+                position += len(line)
+        if self._live is not None:
+            self._live += len(texts)
+
+    def delete(self, ids: List) -> None:
+        if not self.writable:
+            raise ValueError("Chunk store was opened read-only")
+        self._consolidate()
+        labels = np.array([int(i) for i in ids], dtype=np.int64)
+        labels = labels[(labels >= 0) & (labels < len(self.offsets))]
+        labels = labels[self.offsets[labels] >= 0]
+        if self._live is not None:
+            self._live -= len(labels)
+        self.offsets[labels] = DELETED
+
+    def compact(self, max_dead_fraction: float = 0.25) -> bool:
+        """Rewrite chunks.jsonl without deleted records once enough have accumulated.
+
+        Chunk ids stay the same; only the offsets of the live records change.
+        """
+        if not self.writable:
+            raise ValueError("Chunk store was opened read-only")
+        self._consolidate()
+        offsets = np.asarray(self.offsets)
+        dead = int(np.count_nonzero(offsets == DELETED))
+        live = np.flatnonzero(offsets >= 0)
+        if not dead or dead <= max_dead_fraction * (dead + len(live)):
+            return False
+        print(f"Compacting chunk store: dropping {dead} deleted records")
+        new_offsets = np.where(offsets >= 0, 0, RECLAIMED).astype(np.int64)
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            with open(self.path, 'rb') as reader, open(self.path + ".tmp", 'wb') as writer:
+                # In file order, so the old file is read front to back
+                for chunk_id in live[np.argsort(offsets[live], kind="stable")]:
+                    reader.seek(int(offsets[chunk_id]))
+                    new_offsets[chunk_id] = writer.tell()
+                    writer.write(reader.readline())
+            os.replace(self.path + ".tmp", self.path)
+            self.offsets = new_offsets
+        self.save()
+        return True
+
+    def _consolidate(self):
+        if self._new_offsets:
+            self.offsets = np.concatenate([np.asarray(self.offsets), np.array(self._new_offsets, dtype=np.int64)])
+            self._new_offsets = []
+
+    def save(self):
+        self._consolidate()
+        save_array(os.path.join(self.folder, OFFSETS_FILE), np.asarray(self.offsets, dtype=np.int64))
+
+
+class ChunkIdMap(Mapping):
+    """Read-only index_to_docstore_id view: FAISS label -> docstore id, for live chunks only."""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def __getitem__(self, label) -> str:
+        if not self.store.is_live(int(label)):
+            raise KeyError(label)
+        return str(int(label))
+
+    def __iter__(self):
+        return iter(self.store.live_ids().tolist())
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+
+def is_project(folder: str) -> bool:
+    return os.path.exists(os.path.join(folder, INDEX_FILE)) and os.path.exists(os.path.join(folder, OFFSETS_FILE))
+
+
+def _vector_store(embeddings, index, store: ChunkStore) -> FAISS:
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=store,
+        index_to_docstore_id=ChunkIdMap(store)
+    )
+
+
+def create_vector_store(folder: str, embeddings, index: faiss.Index) -> FAISS:
+    """Create an empty writable project store around an index built from an IndexSpec.
+
+    The index addresses vectors by chunk id, so removing chunks never renumbers the
+    remaining ones.
+    """
+    os.makedirs(folder, exist_ok=True)
+    open(os.path.join(folder, CHUNKS_FILE), 'wb').close()
+    return _vector_store(embeddings, index, ChunkStore(folder, np.zeros(0, dtype=np.int64), writable=True))
+
+
+def open_vector_store(folder: str, embeddings, writable: bool = False) -> FAISS:
+    """Open a saved project; read-only stores memory-map the index instead of reading it."""
+    index_path = os.path.join(folder, INDEX_FILE)
+    if writable:
+        index = faiss.read_index(index_path)
+    else:
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        index = faiss.read_index(index_path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+    return _vector_store(embeddings, index, ChunkStore.open(folder, writable=writable))
+
+
+def save_vector_store(folder: str, vector_store: FAISS):
+    index_path = os.path.join(folder, INDEX_FILE)
+    faiss.write_index(vector_store.index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    vector_store.docstore.save()
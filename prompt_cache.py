@@ -0,0 +1,109 @@
+"""Evaluated KV states for the fixed start of prompts.
+
+Every answer starts with the same instructions (the RAG rules or the chat system
+message). llama.cpp only evaluates the part of a prompt after the longest prefix
+already in its KV cache, so restoring a saved state of the instructions before each
+completion leaves only the retrieved context and the question to evaluate. States are
+kept in memory and saved under PROMPT_CACHE_DIR per model, so a restarted server
+skips the instructions from the first request on.
+"""
+import hashlib
+import json
+import os
+import threading
+import weakref
+from typing import Dict
+
+import numpy as np
+
+from config import PROMPT_CACHE_DIR
+
+
+class PromptCache:
+    """Saved llama.cpp states of static prompt prefixes for one loaded model.
+
+    restore() switches the model's state, so callers must hold the model's lock.
+    """
+
+    def __init__(self, llm, model_path: str, folder: str = PROMPT_CACHE_DIR):
+        self.llm = llm
+        self.folder = os.path.join(folder, os.path.splitext(os.path.basename(model_path))[0])
+        self._model_key = self._model_identity(model_path)
+        self._states: Dict[str, object] = {}
+
+    def _model_identity(self, model_path: str) -> str:
+        """States only fit the exact weights, context size and llama_cpp build that made them."""
+        import llama_cpp
+        try:
+            stat = os.stat(model_path)
+            weights = [os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            weights = [os.path.abspath(model_path)]
+        return json.dumps([weights, self.llm.n_ctx(), llama_cpp.__version__])
+
+    def _key(self, prefix: str) -> str:
+        return hashlib.sha1((self._model_key + prefix).encode("utf-8")).hexdigest()
+
+    def restore(self, prefix: str):
+        """Make the model's KV cache start with prefix, evaluating and saving it the first time."""
+        tokens = self.llm.tokenize(prefix.encode("utf-8"), add_bos=True, special=True)
+        cached = self.llm.input_ids[:self.llm.n_tokens]
+        if len(cached) >= len(tokens) and cached[:len(tokens)].tolist() == tokens:
+            return
+        key = self._key(prefix)
+        state = self._states.get(key) or self._load(key)
+        if state is not None:
+            self.llm.load_state(state)
+            return
+        self.llm.reset()
+        self.llm.eval(tokens)
+        state = self._states[key] = self._compact(self.llm.save_state())
+        self._save(key, state)
+
+    def _compact(self, state):
+        """Drop the per-token logits: without logits_all llama.cpp samples from its own
+        buffers, and one row still broadcasts over the rows load_state fills in.
+        """
+        if not self.llm.context_params.logits_all:
+            state.scores = np.zeros((1, state.scores.shape[1]), dtype=np.float32)
+        return state
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.npz")
+
+    def _save(self, key: str, state):
+        """Write the state as plain arrays (no pickle), replacing the file atomically."""
+        os.makedirs(self.folder, exist_ok=True)
+        meta = {"n_tokens": int(state.n_tokens), "llama_state_size": int(state.llama_state_size), "seed": int(state.seed)}
+        with open(self._path(key) + ".tmp", 'wb') as file:
+            np.savez(file, meta=np.array(json.dumps(meta)), input_ids=state.input_ids, scores=state.scores,
+                     llama_state=np.frombuffer(state.llama_state, dtype=np.uint8))
+        os.replace(self._path(key) + ".tmp", self._path(key))
+
+    def _load(self, key: str):
+        from llama_cpp import LlamaState
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                state = LlamaState(input_ids=data["input_ids"], scores=data["scores"],
+                                   llama_state=data["llama_state"].tobytes(), **json.loads(str(data["meta"])))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable prompt cache {path}: {e}")
+            return None
+        self._states[key] = state
+        return state
+
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def prompt_cache_for(shared_model) -> PromptCache:
+    """The prompt cache of a shared LLM (see model_registry.SharedModel), created on first use."""
+    with _caches_lock:
+        cache = _caches.get(shared_model)
+        if cache is None:
+            cache = _caches[shared_model] = PromptCache(shared_model.model, shared_model.path)
+        return cache
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+class QueryEmbeddingCache:
+    """Small thread-safe LRU cache of recent query vectors keyed by the query text."""
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(text)
+            if vector is not None:
+                self._entries.move_to_end(text)
+            return vector
+
+    def put(self, text: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[text] = vector
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class QueryContext:
+    """Per-request state shared by every retrieval stage of a single query.
+
+    embedding is in the project's (possibly truncated) index space; full_embedding is
+    the model's full-dimension vector, used to re-score candidates.
+    """
+
+    def __init__(self, question: str, embedding: np.ndarray, cached: bool = False, full_embedding: Optional[np.ndarray] = None):
+        self.question = question
+        self.embedding = embedding
+        self.cached = cached
+        self.full_embedding = embedding if full_embedding is None else full_embedding
+
+    @classmethod
+    def create(cls, question: str, embeddings, cache: Optional[QueryEmbeddingCache] = None) -> "QueryContext":
+        """Embed the question once, reusing a cached vector for repeated questions.
+
+        With truncating (MRL) embeddings the full vector is computed and cached, and the
+        index-space vector is cut from it. Surrounding whitespace is stripped first, so the
+        cached vector is always the embedding of its key.
+        """
+        question = question.strip()
+        truncate = getattr(embeddings, "truncate", None)
+        vector = cache.get(question) if cache is not None else None
+        cached = vector is not None
+        if not cached:
+            model = embeddings.base if truncate else embeddings
+            vector = np.asarray(model.embed_query(question), dtype=np.float32)
+            vector.setflags(write=False)
+            if cache is not None:
+                cache.put(question, vector)
+        if truncate is None:
+            return cls(question, vector, cached=cached)
+        return cls(question, truncate(vector), cached=cached, full_embedding=vector)
+
+    @classmethod
+    def create_batch(cls, questions: List[str], embeddings, cache: Optional[QueryEmbeddingCache] = None) -> List["QueryContext"]:
+        """create() for many questions, embedding every question missing from the cache in one call.
+
+        The batch goes through embed_documents, which encodes exactly like embed_query for
+        models without query-specific instructions.
+        """
+        truncate = getattr(embeddings, "truncate", None)
+        questions = [question.strip() for question in questions]
+        vectors = {question: cache.get(question) for question in questions} if cache is not None else {}
+        # Distinct questions that still need embedding, in order
+        missing = list(dict.fromkeys(question for question in questions if vectors.get(question) is None))
+        if missing:
+            model = embeddings.base if truncate else embeddings
+            matrix = np.asarray(model.embed_documents(missing), dtype=np.float32)
+            for question, row in zip(missing, matrix):
+                vector = row.copy()
+                vector.setflags(write=False)
+                vectors[question] = vector
+                if cache is not None:
+                    cache.put(question, vector)
+        missing = set(missing)
+        contexts = []
+        for question in questions:
+            vector, cached = vectors[question], question not in missing
+            if truncate is None:
+                contexts.append(cls(question, vector, cached=cached))
+            else:
+                contexts.append(cls(question, truncate(vector), cached=cached, full_embedding=vector))
+        return contexts
@@ -0,0 +1,60 @@
+"""Routes general questions past retrieval, at the cost of one dot product.
+
+train_router.py fits a linear classifier on embedded, labelled questions: questions
+the documents answer versus general ones (small talk, arithmetic, trivia). The result is
+saved to ROUTER_PATH as plain arrays (no pickle):
+
+    weights     one weight per embedding dimension
+    bias        scalar offset
+    threshold   margin above which a question counts as general, calibrated on held-out data
+    meta        JSON: model kind, embedding model, validation metrics
+
+At query time the question's embedding is normalized and w.x + b is compared with the
+threshold; general questions go straight to the model without retrieval.
+"""
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from similarity import normalize
+
+
+class QueryRouter:
+    """Linear general-vs-documents classifier over normalized query embeddings."""
+
+    def __init__(self, weights: np.ndarray, bias: float, threshold: float, meta: Optional[dict] = None):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.threshold = float(threshold)
+        self.meta = meta or {}
+
+    @classmethod
+    def load(cls, path: str) -> Optional["QueryRouter"]:
+        """Load a trained router, or return None if there is none at path."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return cls(data["weights"], float(data["bias"]), float(data["threshold"]), json.loads(str(data["meta"])))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable query router {path}: {e}")
+            return None
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + ".tmp", 'wb') as file:
+            np.savez(file, weights=self.weights, bias=np.float32(self.bias), threshold=np.float32(self.threshold),
+                     meta=np.array(json.dumps(self.meta)))
+        os.replace(path + ".tmp", path)
+
+    def margin(self, embedding) -> float:
+        """Signed distance of the question from the decision boundary; larger is more general."""
+        return float(normalize(embedding) @ self.weights) + self.bias
+
+    def is_general(self, embedding, threshold: Optional[float] = None) -> bool:
+        """True when the question does not need the documents. Embeddings of another size never are."""
+        if np.shape(embedding)[-1] != len(self.weights):
+            return False
+        return self.margin(embedding) > (self.threshold if threshold is None else threshold)
@@ -1,83 +1,156 @@
 import sys
 import json
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+import hashlib
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
 from langchain.llms.base import LLM
 from time import perf_counter as timer
-from typing import Generator, List, Optional, Any
-from misc.gemma3 import GoogleGeminiClient
+from typing import Generator, List, Optional, Any, Union
+from query_context import QueryContext, QueryEmbeddingCache
+from sentence_store import SentenceStore, split_sentences
+from ingest import update_project
+from index_spec import IndexSpec
+from mrl import FullVectors
+from model_registry import acquire_embeddings, acquire_llm, registry
+from prompt_cache import prompt_cache_for
+from answer_cache import AnswerCache, replay
+from context_assembler import ContextAssembler, merge_passages
+from topic_index import TopicIndex
+from reranker import Reranker, RerankConfig
+from query_router import QueryRouter
+from lexical_index import HybridConfig, LexicalIndex, looks_like_identifier, matching_sentences, reciprocal_rank_fusion
+from project_manifest import ProjectManifest
+from enrichment import ENRICHMENT_CHECKPOINT, GeminiBackend, MetadataEnricher
+from config import EMBEDDING_MODEL_PATH, LLM_MODEL_PATH, PROJECTS_DIR, ROUTER_PATH
+import similarity
 import os
 import nltk, numpy as np
-from llama_cpp import Llama
+
+# Fixed prompt openings; they come before anything request-specific so their
+# evaluated KV state can be reused (see prompt_cache.py)
+RAG_INSTRUCTIONS = """
+Based ONLY on the provided context, answer the following question. If the context does not provide enough information, acknowledge the limitation and reply with all you know about the query."
+
+Rules:
+1. Quote specific sections when possible
+2. If uncertain, acknowledge the limitation and answer based on your own knowledge
+3. Do not add external knowledge without telling about it
+4. If the context is incomplete, state what's missing and give the answer stating what should be the answer according to your knowledge
+5. Do not let any question remain unanswered
+"""
+CHAT_SYSTEM_MESSAGE = "You are a helpful assistant and you will only reply in concise and limited words, reply in depth only if asked by the user"
+
 class LangChainRAG:
-    def __init__(self, files: List[str], chunk_size: int = 1000, chunk_overlap: int = 100, topic: str = None, add_metadata: bool = True, gemini_api_key: Optional[str] = None, llm: LLM = None,details:str=None):
+    def __init__(self, files: List[str], chunk_size: int = 1000, chunk_overlap: int = 100, topic: str = None, add_metadata: bool = True, gemini_api_key: Optional[str] = None, llm: LLM = None,details:str=None, embed_batch_size: int = 256, enrich_concurrency: int = 8, enrich_rps: Optional[float] = None, index_spec=None, answer_cache: Union[bool, dict] = False, answer_tokens: int = 512, hybrid: Union[None, bool, dict] = None, rerank: Union[None, bool, dict] = None, router: Union[None, bool, str] = None):
         """ Initialize the RAG system with PDF files and parameters."""
         self.files = [f for f in files if f.lower().endswith('.pdf')]
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.documents = []
         self.vector_store = None
+        self.sentence_store = None
         self.retriever = None
         self.qa_chain = None
         self.topic = topic
         self.add_metadata = add_metadata
         self.gemini_api_key = gemini_api_key
         self.details = details
-        # Initialize embeddings
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="C:\\models\\static-mrl"
-        )
+        self.embed_batch_size = embed_batch_size
+        self.enrich_concurrency = enrich_concurrency
+        # Metadata requests per second across all enrichment threads; None for no limit
+        self.enrich_rps = enrich_rps
+        self.index_spec = index_spec
+        # Models are shared with every other project open in this process
+        self.embedding_model = acquire_embeddings(EMBEDDING_MODEL_PATH)
+        self.embeddings = self.embedding_model.model
+        # Embeddings in the project's index space (MRL-truncated for projects with IndexSpec.dim)
+        self.query_embeddings = self.embeddings
+        self.search_spec = IndexSpec()
+        self.full_vectors = None
+        self.query_cache = QueryEmbeddingCache(max_size=128)
+        # True or AnswerCache options (threshold, max_size, ttl) to cache answers per project
+        self.answer_cache_options = answer_cache
+        self.answer_cache = None
+        # Fusion of vector and BM25 keyword search; False for vector search only
+        self.hybrid = HybridConfig.parse(hybrid)
+        self.lexical_index = None
+        self.topic_index = None
+        # Re-ranking of a wider candidate set with the chunks' relevant_query and topic vectors
+        self.rerank = RerankConfig.parse(rerank)
+        self.reranker = None
         
-        model_path = "C:\\Users\\User\\Desktop\\LLM\\Rag\\models\\gemma3n-e2b.gguf"
+        model_path = LLM_MODEL_PATH
         self.prompt_tokens = 2048
-        self.llm = Llama(
-            model_path=model_path,
+        # Part of the context window kept free for the answer when filling in retrieved text
+        self.answer_tokens = answer_tokens
+        self.llm_model = acquire_llm(
+            model_path,
             n_ctx=self.prompt_tokens,  # Context window size
-            n_threads=4,  # Number of threads to use
-            verbose=False
-    )
-        #self.positive = self.json_file_to_list('data/oos_test.json') + self.json_file_to_list('data/oos_train.json')
-        #self.positive = [item[0] for item in self.positive]
-        #self.positive_embeddings = np.array(self.embeddings.embed_documents(self.positive))
+            n_threads=4  # Number of threads to use
+        )
+        self.llm = self.llm_model.model
+        # Trained general-question router (see train_router.py); False to always retrieve
+        self.router = None if router is False else QueryRouter.load(router if isinstance(router, str) else ROUTER_PATH)
+        if self.router is not None and self.router.meta.get("embedding_model", EMBEDDING_MODEL_PATH) != EMBEDDING_MODEL_PATH:
+            print(f"Query router was trained on {self.router.meta['embedding_model']}; not using it")
+            self.router = None
         # Initialize custom LLM
         
         if not self.files:
             print("No PDF files provided.")
         else:
-            self._load_and_process_documents(existing=os.path.exists("./" + self.topic))
-    def contextual_query(self, query: str, context: str) -> Generator[str, None, None]:
-        rag_query = f"""
-Based ONLY on the provided context, answer the following question. If the context does not provide enough information, acknowledge the limitation and reply with all you know about the query."
-
+            try:
+                self._load_and_process_documents()
+            except Exception:
+                self.close()
+                raise
+    def rag_prompt(self, query: str, context: str) -> str:
+        return RAG_INSTRUCTIONS + f"""
 Context Type: {context}
 
-Rules:
-1. Quote specific sections when possible
-2. If uncertain, acknowledge the limitation and answer based on your own knowledge
-3. Do not add external knowledge without telling about it
-4. If the context is incomplete, state what's missing and give the answer stating what should be the answer according to your knowledge
-5. Do not let any question remain unanswered
 Question: {query}
 
 Answer based strictly on the context:"""
-        max_new = 8192 - self.prompt_tokens
-        max_new = min(max_new, 4096)   
-        # Stream directly from LLM
-        for chunk in self.llm(
-            rag_query,
-            max_tokens=max_new,
-            temperature=0.7,
-            top_p=0.9,
-            top_k=40,
-            stream=True,
-            stop=["</s>", "<end_of_turn>"]
-        ):
-            if 'choices' in chunk and len(chunk['choices']) > 0:
-                token = chunk['choices'][0]['text']
-                if token:
-                    yield token
+
+    def count_tokens(self, text: str) -> int:
+        """Length of text in the LLM's own tokens."""
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+    def context_budget(self, query: str) -> int:
+        """Tokens left for retrieved context once the template, question and answer room are counted."""
+        return max(0, self.prompt_tokens - self.answer_tokens - self.count_tokens(self.rag_prompt(query, "")) - 1)
+
+    def contextual_query(self, query: str, context: str) -> Generator[str, None, None]:
+        rag_query = self.rag_prompt(query, context)
+        # The answer gets whatever the prompt leaves of the context window
+        max_new = max(1, self.prompt_tokens - self.count_tokens(rag_query) - 1)
+        yield from self._generate(rag_query, RAG_INSTRUCTIONS, max_new)
+
+    def _generate(self, prompt: str, static_prefix: str, max_tokens: int) -> Generator[str, None, None]:
+        """Stream a completion of prompt, which starts with static_prefix, from the shared LLM."""
+        # The shared model generates for one request at a time
+        with self.llm_model.lock:
+            # Only the part of the prompt after the cached prefix is evaluated
+            prompt_cache_for(self.llm_model).restore(static_prefix)
+            for chunk in self.llm(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=0.7,
+                top_p=0.9,
+                top_k=40,
+                stream=True,
+                stop=["</s>", "<end_of_turn>"]
+            ):
+                if 'choices' in chunk and len(chunk['choices']) > 0:
+                    token = chunk['choices'][0]['text']
+                    if token:
+                        yield str(token)
+
+    def close(self):
+        """Release this project's references to the shared models."""
+        for shared in (self.llm_model, self.embedding_model):
+            if shared is not None:
+                registry.release(shared)
+        self.llm_model = self.embedding_model = None
+        self.llm = None
 
     def json_file_to_list(file_path):
         with open(file_path, 'r') as file:
@@ -99,129 +172,67 @@ Answer based strictly on the context:"""
     <start_of_turn>model
     """ 
     def query_model(self,prompt: str):
-        max_gen = 8192 - self.prompt_tokens 
         """Stream the answer back token-by-token with proper chat formatting."""
         # Format the prompt using chat template
-        formatted_prompt = self.format_chat_prompt(prompt,"You are a helpful assistant and you will only reply in concise and limited words, reply in depth only if asked by the user")
-        for chunk in self.llm(
-            formatted_prompt,
-            max_tokens=max_gen,
-            temperature=0.7,
-            top_p=0.9,
-            top_k=40,
-            stream=True,
-            stop=["</s>", "<end_of_turn>"]
-        ):
-            tok = chunk["choices"][0]["text"]
-            if tok is not None and tok != "":
-                yield str(tok)
+        formatted_prompt = self.format_chat_prompt(prompt, CHAT_SYSTEM_MESSAGE)
+        max_gen = max(1, self.prompt_tokens - self.count_tokens(formatted_prompt) - 1)
+        # Everything up to the user message is the same for every question
+        static_prefix = self.format_chat_prompt("", CHAT_SYSTEM_MESSAGE).split("<end_of_turn>")[0]
+        yield from self._generate(formatted_prompt, static_prefix, max_gen)
     def cosine_similarity(self,vec1: np.ndarray, vec2: np.ndarray) -> float:
         """Calculate cosine similarity between two vectors"""
-        dot_product = np.dot(vec1, vec2)
-        norm_vec1 = np.linalg.norm(vec1)
-        norm_vec2 = np.linalg.norm(vec2)
-        
-        if norm_vec1 == 0 or norm_vec2 == 0:
-            return 0.0
-        
-        return dot_product / (norm_vec1 * norm_vec2)
-    def predict(self,query: str, threshold: float=0.026198) -> bool:
-        query_embedding = self.embeddings.embed_query(query)
-        
-        positive_similarities = []
-        for pos_emb in self.positive_embeddings:
-            sim = self.cosine_similarity(query_embedding, pos_emb)
-            positive_similarities.append(sim)
-        
-        avg_positive_similarity = np.mean(positive_similarities)
-        
-        similarity = avg_positive_similarity
-        return similarity > threshold
-    def _split_with_metadata(self):
-        """Split documents with metadata preservation"""
-        print("Splitting documents with metadata preservation...")
-        
-        if not self.documents:
-            raise ValueError("No documents to process. Check if PDF files were loaded correctly.")
+        return float(similarity.cosine_scores(vec1, vec2))
+    def predict(self, query: str, threshold: Optional[float] = None) -> bool:
+        """True when the trained router deems the query general, i.e. it does not need the documents"""
+        if self.router is None:
+            return False
+        query_context = QueryContext.create(query, self.query_embeddings, self.query_cache)
+        return self.router.is_general(query_context.full_embedding, threshold)
+    def _metadata_enricher(self) -> MetadataEnricher:
+        """Labels chunks with a Gemini-generated topic and relevant query.
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""]
-            )
-            
-        chunks = []
-        for doc in self.documents:
-            # Split the document
-            doc_chunks = text_splitter.split_documents([doc])
-            
-            if self.add_metadata:
-                gemini = GoogleGeminiClient(self.gemini_api_key)
-                topic_prompt = f"""
-                        For the following Document, give it a suitably descriptive topic label.\
-                        The topic label will be used for categorization and retrieval purposes.\
-                        Document content: 
-                        """
-                find_relevant_query_prompt = f"""
-                        For the following Document, find the most relevant query that could be used to retrieve it.
-                        Document content:
-                    """
-                for i,doc in enumerate(doc_chunks):
-                    print(f"Processing chunk {i+1}/{len(doc_chunks)}")
-                    doc.metadata['topic'] = gemini.generate(topic_prompt + doc.page_content).strip()
-                    doc.metadata['relevant_query'] = gemini.generate(find_relevant_query_prompt + doc.page_content).strip()
-            chunks.extend(doc_chunks)
-        
-            print(f"Created {len(chunks)} chunks with metadata")
-            
-            # Create vector store with metadata
-            self.vector_store = FAISS.from_documents(
-                documents=chunks,
-                embedding=self.embeddings
-            )
-            
-            # Create retriever
-            self.retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 8 }
-            )
+        One enricher, with one client and rate limiter, serves every batch of an ingest run.
+        """
+        return MetadataEnricher(
+            GeminiBackend(self.gemini_api_key),
+            max_concurrency=self.enrich_concurrency,
+            requests_per_second=self.enrich_rps,
+            checkpoint_path=os.path.join(PROJECTS_DIR, self.topic, ENRICHMENT_CHECKPOINT)
+        )
     
-    def _load_and_process_documents(self, existing: bool = False):
-        """Load and process PDF documents using LangChain"""
+    def _load_and_process_documents(self):
+        """Load the project index, ingesting only new or changed PDF files"""
         print("Loading PDF documents...")
-        if existing:
-            print(f"Loading existing documents from ./projects/{self.topic}")
-            self.vector_store = FAISS.load_local(
-                "./projects/"+self.topic, 
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
-        else:
-            print(f"Processing new documents from: {self.files}")
-            # FIX: Actually populate self.documents
-            for pdf_path in self.files:
-                try:
-                    loader = PyPDFLoader(pdf_path)
-                    docs = loader.load()
-                    self.documents.extend(docs)  # Add this line!
-                    print(f"Loaded {len(docs)} pages from {pdf_path}")
-                except Exception as e:
-                    print(f"Error loading {pdf_path}: {e}")
-            
-            if not self.documents:
-                print("No documents were loaded successfully.")
-                return
-                
-            self._split_with_metadata()
-            
-            # Ensure projects directory exists
-            projects_dir = "./projects"
-            os.makedirs(projects_dir, exist_ok=True)
-            
-            # Save to projects folder
-            self.vector_store.save_local(f"./projects/{self.topic}")
-            print("Vector store created and saved locally.")
+        project_folder = os.path.join(PROJECTS_DIR, self.topic)
+        print(f"Processing documents from: {self.files}")
+        self.vector_store, self.sentence_store = update_project(
+            self.files,
+            self.topic,
+            self.embeddings,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            batch_size=self.embed_batch_size,
+            enrich=self._metadata_enricher().enrich if self.add_metadata else None,
+            index_spec=self.index_spec
+        )
+        
+        if self.vector_store is None:
+            print("No documents were loaded successfully.")
+            return
+        print(f"Vector store ready in {project_folder}")
+        self.query_embeddings = self.vector_store.embedding_function
+        self.search_spec = IndexSpec.load(project_folder)
+        if self.index_spec is not None:
+            self.search_spec = self.search_spec.with_search_params(IndexSpec.parse(self.index_spec))
+        if self.search_spec.rescore and FullVectors.exists(project_folder):
+            self.full_vectors = FullVectors(project_folder)
+        if self.hybrid.enabled:
+            self.lexical_index = LexicalIndex.load(project_folder, mmap=True)
+        self.topic_index = TopicIndex.load(project_folder, mmap=True)
+        self.reranker = Reranker.open(project_folder, self.rerank, self.topic_index)
+        if self.answer_cache_options:
+            options = {} if self.answer_cache_options is True else dict(self.answer_cache_options)
+            self.answer_cache = AnswerCache(project_folder, self._answer_fingerprint(project_folder), **options)
         
         # Create retriever
         self.retriever = self.vector_store.as_retriever(
@@ -235,6 +246,25 @@ Answer based strictly on the context:"""
         print("RAG setup complete!")
 
 
+    def topic_retriever(self, topic: str, k: int = 5):
+        """A retriever searching only the chunks labelled with topic (see enrichment.py)"""
+        from misc.retriever import TopicQueryRetriever
+        return TopicQueryRetriever(self.vector_store, target_topic=topic, k=k, topic_index=self.topic_index,
+                                   index_spec=self.search_spec, reranker=self.reranker)
+
+    def _answer_fingerprint(self, project_folder: str) -> str:
+        """Cached answers are only valid for this index content, search setup and LLM."""
+        parts = [ProjectManifest.load(project_folder).fingerprint(), self.search_spec.to_dict(), vars(self.hybrid), vars(self.rerank),
+                 self.router.meta if self.router is not None else None, LLM_MODEL_PATH]
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def cached_answer(self, question: str) -> Optional[str]:
+        """The cached answer of a similar earlier question, when this project caches answers."""
+        if self.answer_cache is None or self._identifier_hits(question):
+            return None
+        query_context = QueryContext.create(question, self.query_embeddings, self.query_cache)
+        return self.answer_cache.lookup(query_context.full_embedding)
+
     def extract_keywords_directly(self,query, num_keywords=5):
         """Extract keywords directly from user query"""
         
@@ -268,42 +298,175 @@ Answer based strictly on the context:"""
         enhanced_query = f"{query} (Keywords: {keyword_str})"
         return enhanced_query
 
-    def extractive_summary(self, query: str, text: str, num_sentences: int = 3) -> str:
+    def extractive_summary(self, query: str, text: str, num_sentences: int = 3, query_embedding: Optional[np.ndarray] = None, chunk_id: Optional[int] = None) -> str:
         """Generate an extractive summary of the text using existing embedding model"""
+        return ' '.join(self.summary_sentences(query, text, num_sentences, query_embedding, chunk_id))
+
+    def summary_sentences(self, query: str, text: str, num_sentences: int = 3, query_embedding: Optional[np.ndarray] = None, chunk_id: Optional[int] = None) -> List[str]:
+        """The num_sentences sentences of text most similar to the query, in text order"""
         if not text:
-            return ""   
+            return []
+        
+        # Use the sentence embeddings precomputed at ingest when available
+        cached = self.sentence_store.get(chunk_id) if self.sentence_store else None
+        if cached is not None and query_embedding is not None:
+            spans, sentence_embeddings = cached
+            if not spans:
+                return [text]
+            similarities = similarity.cosine_scores(similarity.normalize(query_embedding), sentence_embeddings, normalized=True)
+            top_indices = similarity.top_k(similarities, num_sentences)
+            return [text[spans[i][0]:spans[i][1]] for i in sorted(top_indices)]
         
         # Simple sentence splitting (alternative to nltk)
         sentences = [s.strip() for s in text.split('.') if s.strip()]
         if not sentences:
-            return text
+            return [text]
         
         # Encode sentences using the existing HuggingFace embeddings
-        sentence_embeddings = self.embeddings.embed_documents(sentences)
-        query_embedding = self.embeddings.embed_query(query)
-        
-        # Convert to numpy arrays for similarity computation
-        sentence_embeddings = np.array(sentence_embeddings)
-        query_embedding = np.array(query_embedding)
+        sentence_embeddings = self.query_embeddings.embed_documents(sentences)
+        if query_embedding is None:
+            query_embedding = self.query_embeddings.embed_query(query)
         
-        # Compute cosine similarity between query and each sentence
-        similarities = []
-        for sent_emb in sentence_embeddings:
-            # Compute cosine similarity
-            dot_product = np.dot(query_embedding, sent_emb)
-            norm_query = np.linalg.norm(query_embedding)
-            norm_sent = np.linalg.norm(sent_emb)
-            similarity = dot_product / (norm_query * norm_sent) if (norm_query * norm_sent) > 0 else 0
-            similarities.append(similarity)
+        # Score every sentence against the query in one matrix product
+        similarities = similarity.cosine_scores(query_embedding, sentence_embeddings)
         
         # Get top N sentences based on similarity
-        top_indices = np.argsort(similarities)[-num_sentences:]
-        summary_sentences = [sentences[i] for i in sorted(top_indices)]
+        top_indices = similarity.top_k(similarities, num_sentences)
+        return [sentences[i] for i in sorted(top_indices)]
+
+    def _search_candidates(self, query_vectors: np.ndarray, fetch_k: int, rescore: bool) -> List[List[int]]:
+        """One FAISS search for a matrix of query vectors; the live candidate chunk ids of every row"""
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        _, indices = self.vector_store.index.search(query_vectors, fetch_k * self.search_spec.rescore if rescore else fetch_k)
+        # Chunks removed from an HNSW index stay in the graph until it is rebuilt
+        return [[int(i) for i in row if i != -1 and i in self.vector_store.index_to_docstore_id] for row in indices]
+
+    def _retrieve_with_vectors(self, question_embedding: List[float], k: int = 5, fetch_k: int = 20, lambda_mult: float = 0.5,
+                               full_embedding: Optional[np.ndarray] = None, candidate_ids: Optional[List[int]] = None):
+        """MMR search over the FAISS index returning (document, stored vector, cosine score) triples.
+
+        The candidate vectors are read back from the index instead of re-embedding the chunk text.
+        For MRL projects with rescoring, rescore * fetch_k candidates are taken from the
+        truncated index and the best fetch_k by full-dimension cosine go on to MMR.
+        candidate_ids are the results of a search already done, e.g. by retrieve_batch.
+        """
+        rescore = self.full_vectors is not None and full_embedding is not None
+        query_vector = np.array([question_embedding], dtype=np.float32)
+        if candidate_ids is None:
+            candidate_ids = self._search_candidates(query_vector, fetch_k, rescore)[0]
+        if not candidate_ids:
+            return []
+        if rescore:
+            query_vector = np.array([full_embedding], dtype=np.float32)
+            candidate_vectors = self.full_vectors.get(candidate_ids)
+            keep = similarity.top_k(similarity.cosine_scores(query_vector[0], candidate_vectors), fetch_k)
+            candidate_ids = [candidate_ids[i] for i in keep]
+            candidate_vectors = candidate_vectors[keep]
+        else:
+            candidate_vectors = np.array([self.vector_store.index.reconstruct(i) for i in candidate_ids])
+        selected = maximal_marginal_relevance(query_vector[0], candidate_vectors, k=k, lambda_mult=lambda_mult)
+
+        scores = similarity.cosine_scores(query_vector[0], candidate_vectors[selected])
+        results = []
+        for position, score in zip(selected, scores):
+            docstore_id = self.vector_store.index_to_docstore_id[candidate_ids[position]]
+            doc = self.vector_store.docstore.search(docstore_id)
+            results.append((doc, candidate_vectors[position], float(score)))
+        return results
+
+    def _fetch_k(self) -> int:
+        """Candidates taken from the vector index per question"""
+        return max(20, self.hybrid.dense_k) if self.lexical_index is not None else 20
+
+    def _retrieve(self, question: str, query_context: QueryContext, k: int = 5, candidate_ids: Optional[List[int]] = None):
+        """Vector search fused with BM25 keyword search by reciprocal rank, as (document, vector, cosine score) triples.
+
+        Chunks found only by keyword get their stored vector and cosine score like the vector hits.
+        """
+        if self.lexical_index is None:
+            return self._retrieve_with_vectors(query_context.embedding, k=k, fetch_k=self._fetch_k(),
+                                               full_embedding=query_context.full_embedding, candidate_ids=candidate_ids)
+        hybrid = self.hybrid
+        dense = self._retrieve_with_vectors(query_context.embedding, k=hybrid.dense_k, fetch_k=self._fetch_k(),
+                                            full_embedding=query_context.full_embedding, candidate_ids=candidate_ids)
+        by_id = {doc.metadata.get('chunk_id'): (doc, vector, score) for doc, vector, score in dense}
+        lexical_ids = [chunk_id for chunk_id, _ in self.lexical_index.search(question, hybrid.lexical_k)
+                       if chunk_id in self.vector_store.index_to_docstore_id]
+        fused = reciprocal_rank_fusion([list(by_id), lexical_ids], [hybrid.dense_weight, hybrid.lexical_weight], hybrid.rrf_k)
+        results = []
+        for chunk_id in fused[:k]:
+            if chunk_id not in by_id:
+                doc = self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[chunk_id])
+                if self.full_vectors is not None:
+                    query_vector, vector = query_context.full_embedding, self.full_vectors.get([chunk_id])[0]
+                else:
+                    query_vector, vector = query_context.embedding, self.vector_store.index.reconstruct(chunk_id)
+                score = float(similarity.cosine_scores(np.asarray(query_vector, dtype=np.float32), vector[None, :])[0])
+                by_id[chunk_id] = (doc, vector, score)
+            results.append(by_id[chunk_id])
+        return results
+
+    def _identifier_hits(self, question: str):
+        """Keyword hits of a question that is just a code such as a part number or error code.
+
+        Empty unless the best hit scores at least identifier_min_score; weakly matched codes
+        take the hybrid path instead. Hits that only share part of a code (the ``42`` of
+        ``E-42``) are dropped unless they score close to the best one.
+        """
+        if self.lexical_index is None or not self.hybrid.identifier_shortcut or not looks_like_identifier(question):
+            return []
+        hits = [(chunk_id, score) for chunk_id, score in self.lexical_index.search(question, 5)
+                if chunk_id in self.vector_store.index_to_docstore_id]
+        return self.lexical_index.code_hits(question, hits, self.hybrid.identifier_min_score,
+                                            self.hybrid.identifier_score_ratio)
+
+    def keyword_context(self, question: str, hits) -> str:
+        """Context of the sentences that mention the question's terms, without any embedding"""
+        retrieved = [(self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[chunk_id]), None, score)
+                     for chunk_id, score in hits]
+        passages = merge_passages(retrieved, self.chunk_overlap)
+        for passage in passages:
+            passage.sentences = matching_sentences(question, passage.text, limit=3 * len(passage.docs))
+        return ContextAssembler(self.count_tokens, self.context_budget(question)).assemble(passages)
+
+    def passage_sentences(self, query: str, passage, query_embedding: np.ndarray, num_sentences: int = 3) -> List[str]:
+        """The sentences of a passage most similar to the query, num_sentences per chunk, in text order.
+
+        A stitched passage is summarized as one span. Its sentences reuse the precomputed
+        vectors of identical chunk sentences; only the rest, mostly sentences that were cut
+        at a chunk edge, are embedded here.
+        """
+        if len(passage.docs) == 1:
+            doc = passage.docs[0]
+            return self.summary_sentences(query, doc.page_content, num_sentences, query_embedding=query_embedding, chunk_id=doc.metadata.get('chunk_id'))
+        text = passage.text
+        sentences = [text[start:end] for start, end in split_sentences(text)]
+        if not sentences:
+            return [text] if text else []
         
-        return ' '.join(summary_sentences)
+        known = {}
+        for doc in passage.docs:
+            cached = self.sentence_store.get(doc.metadata.get('chunk_id')) if self.sentence_store else None
+            if cached is not None:
+                for (start, end), vector in zip(*cached):
+                    known.setdefault(doc.page_content[start:end], vector)
+        missing = [sentence for sentence in dict.fromkeys(sentences) if sentence not in known]
+        if missing:
+            known.update(zip(missing, similarity.normalize_rows(self.query_embeddings.embed_documents(missing))))
+        
+        similarities = similarity.cosine_scores(similarity.normalize(query_embedding), np.stack([known[sentence] for sentence in sentences]), normalized=True)
+        top_indices = similarity.top_k(similarities, num_sentences * len(passage.docs))
+        return [sentences[i] for i in sorted(top_indices)]
+
+    def build_context(self, question: str, retrieved, query_embedding: np.ndarray) -> str:
+        """Stitch neighbouring retrieved chunks of a page, summarize them and fit the result into the context window"""
+        passages = merge_passages(retrieved, self.chunk_overlap)
+        for passage in passages:
+            passage.sentences = self.passage_sentences(question, passage, query_embedding)
+        return ContextAssembler(self.count_tokens, self.context_budget(question)).assemble(passages)
 
-    def query(self, question: str):
-        """Query the RAG system"""
+    def query(self, question: str, check_cache: bool = True):
+        """Query the RAG system; pass check_cache=False when cached_answer was already consulted"""
         #print(f"Received query: {question}")
         #question = self.add_keywords_to_query(question, self.extract_keywords_directly(question))
         #print(f"Enhanced query: {question}")
@@ -313,34 +476,109 @@ Answer based strictly on the context:"""
         print(f"Searching for relevant context...")
         start_time = timer()
         
-        # Retrieve relevant documents
-        relevant_docs = self.retriever.get_relevant_documents(question)
+        # Exact codes are answered from their keyword matches; embedding them finds lookalikes
+        hits = self._identifier_hits(question)
+        if hits:
+            print(f"Found {len(hits)} chunks mentioning {question!r} in {timer() - start_time:.5f} seconds")
+            yield from self.contextual_query(question, self.keyword_context(question, hits))
+            return
         
-        end_time = timer()
-        print(f"Time taken: {end_time-start_time:.5f} seconds.")
-        print(f"Found {len(relevant_docs)} relevant chunks")
+        # Embed the question once; every stage below reuses this vector
+        query_context = QueryContext.create(question, self.query_embeddings, self.query_cache)
+        yield from self.answer(question, query_context, check_cache=check_cache)
+
+    def answer(self, question: str, query_context: QueryContext, retrieved=None, check_cache: bool = True):
+        """Stream the answer to an embedded question from the answer cache, straight from the model
+        for general questions, or from its retrieved chunks (retrieved here unless given, see retrieve_batch)"""
+        start_time = timer()
+        if self.answer_cache is not None and check_cache:
+            answer = self.answer_cache.lookup(query_context.full_embedding)
+            if answer is not None:
+                print("Answered from cache")
+                yield from replay(answer)
+                return
         
-        question_embedding = self.embeddings.embed_query(question)
-        # Build context from retrieved documents
-        context = ""
-        cosine = 0
-        for doc in relevant_docs:
-            doc_embedding = self.embeddings.embed_query(doc.page_content)
-            cosine += self.cosine_similarity(question_embedding, doc_embedding)
-            context += self.extractive_summary(question, doc.page_content) + " "
+        if self.router is not None and self.router.is_general(query_context.full_embedding):
+            print(f"General question; skipped retrieval after {timer() - start_time:.5f} seconds")
+            tokens = self.query_model(question)
+        else:
+            if retrieved is None:
+                # Retrieve relevant documents together with their stored vectors and scores
+                retrieved = self._select(question, query_context)
+                end_time = timer()
+                print(f"Time taken: {end_time-start_time:.5f} seconds.")
+            print(f"Found {len(retrieved)} relevant chunks")
+            tokens = self._answer_from_context(question, query_context, retrieved)
+        answer = []
+        for chunk in tokens:
+            answer.append(chunk)
+            yield chunk
+        # Only complete answers are cached; a cancelled generation never gets here
+        if self.answer_cache is not None:
+            self.answer_cache.put(question, query_context.full_embedding, "".join(answer))
+
+    def _select(self, question: str, query_context: QueryContext, candidate_ids: Optional[List[int]] = None):
+        """The chunks for the prompt: retrieved, then re-ranked when the project has a reranker"""
+        if self.reranker is None:
+            return self._retrieve(question, query_context, candidate_ids=candidate_ids)
+        retrieved = self._retrieve(question, query_context, k=self.rerank.candidates, candidate_ids=candidate_ids)
+        return self.reranker.rerank(query_context.embedding, retrieved)
+
+    def _answer_from_context(self, question: str, query_context: QueryContext, retrieved):
+        """The answer's token stream for retrieved chunks; weak matches are answered from general knowledge"""
+        average_score = sum(score for _, _, score in retrieved) / len(retrieved) if retrieved else 0.0
         
         # Generate response using your custom contextual_query function
         print("Generating response...")
-        print(cosine/len(relevant_docs))
-        if cosine/len(relevant_docs) < 0.15:
+        print(average_score)
+        if average_score < 0.15:
             # Use general knowledge - yield tokens one by one
-            for chunk in self.query_model(question):
-                yield chunk
-        else:
-            # Use contextual query with document context - yield tokens one by one
-            for chunk in self.contextual_query(question, context):
-                yield chunk
+            return self.query_model(question)
+        # Use contextual query with document context - yield tokens one by one
+        context = self.build_context(question, retrieved, query_context.embedding)
+        return self.contextual_query(question, context)
+
+    def retrieve_batch(self, questions: List[str]):
+        """Embed all questions in one call and search the index once for all of them.
+
+        Returns a (query context, retrieved chunks) pair per question, in order.
+        """
+        contexts = QueryContext.create_batch(questions, self.query_embeddings, self.query_cache)
+        if not contexts:
+            return []
+        candidates = self._search_candidates(np.stack([context.embedding for context in contexts]), self._fetch_k(),
+                                             rescore=self.full_vectors is not None)
+        return [(context, self._select(question, context, candidate_ids=candidate_ids))
+                for question, context, candidate_ids in zip(questions, contexts, candidates)]
+
+    @staticmethod
+    def sources(retrieved) -> List[dict]:
+        """Where the retrieved chunks come from, for reporting alongside an answer"""
+        return [{"source": doc.metadata.get("source"), "page": doc.metadata.get("page"),
+                 "chunk_id": doc.metadata.get("chunk_id"), "score": round(float(score), 4)}
+                for doc, _, score in retrieved]
+
+    def query_batch(self, questions: List[str], generate: bool = True):
+        """Answer many questions with one embedding call and one index search.
+
+        Yields a dict per question, in order, with its index, question and sources, plus
+        the answer when generate is set. Generation runs one question at a time.
+        """
+        if not self.retriever:
+            return
+        start_time = timer()
+        batch = self.retrieve_batch(questions)
+        print(f"Retrieved context for {len(questions)} questions in {timer() - start_time:.5f} seconds")
+        for index, (question, (query_context, retrieved)) in enumerate(zip(questions, batch)):
+            result = {"index": index, "question": question, "sources": self.sources(retrieved)}
+            if generate:
+                result["answer"] = "".join(self.answer(question, query_context, retrieved))
+            yield result
+
     def check_query(self, query: str) -> bool:
+        # The trained router answers this with one dot product instead of a generation
+        if self.router is not None:
+            return self.predict(query)
         response = self.query_model("""
         Check Whether a document about"""+self.details+"""
         Can answer the following query"""+query+"""
@@ -0,0 +1,94 @@
+"""Background loading of server components with per-component readiness.
+
+Each component is loaded by a function running in its own daemon thread, optionally
+after other components are ready. Request handlers wait on the components they need
+for a bounded time and can report load state and timings in health checks.
+"""
+import threading
+from collections import OrderedDict
+from time import perf_counter as timer
+from time import time
+from typing import Callable, Iterable, Optional
+
+
+class ComponentFailed(RuntimeError):
+    """A component that a caller waited on failed to load."""
+
+
+class Component:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "pending"
+        self.started_at = None
+        self.load_time = None
+        self.error = None
+        self.done = threading.Event()
+
+    def status(self) -> dict:
+        return {"state": self.state, "started_at": self.started_at, "load_time": self.load_time, "error": self.error}
+
+
+class Readiness:
+    """Registry of components loaded in background threads."""
+
+    def __init__(self):
+        self.components = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, name: str, load: Callable[[], None], after: Iterable[str] = ()) -> Component:
+        """Load a component in the background once the components in after are ready."""
+        with self._lock:
+            if name in self.components:
+                return self.components[name]
+            component = self.components[name] = Component(name)
+        after = list(after)
+
+        def run():
+            try:
+                self.wait(after)
+                component.state = "loading"
+                component.started_at = time()
+                start_time = timer()
+                load()
+                component.load_time = timer() - start_time
+                component.state = "ready"
+                print(f"{name} ready in {component.load_time:.1f}s")
+            except Exception as e:
+                component.state = "failed"
+                component.error = str(e)
+                print(f"{name} failed to load: {e}")
+            finally:
+                component.done.set()
+
+        threading.Thread(target=run, name=f"warmup-{name}", daemon=True).start()
+        return component
+
+    def wait(self, names: Iterable[str], timeout: Optional[float] = None) -> bool:
+        """Wait until the named components are ready.
+
+        Returns False on timeout and raises ComponentFailed if one of them failed.
+        Names that were never started are treated as ready.
+        """
+        deadline = None if timeout is None else timer() + timeout
+        for name in names:
+            component = self.components.get(name)
+            if component is None:
+                continue
+            remaining = None if deadline is None else max(0.0, deadline - timer())
+            if not component.done.wait(remaining):
+                return False
+            if component.state == "failed":
+                raise ComponentFailed(f"{name} failed to load: {component.error}")
+        return True
+
+    def overall(self) -> str:
+        """"ready" when everything loaded, "degraded" when all finished but some failed, else "starting"."""
+        states = [component.state for component in self.components.values()]
+        if all(state == "ready" for state in states):
+            return "ready"
+        if all(state in ("ready", "failed") for state in states):
+            return "degraded"
+        return "starting"
+
+    def status(self) -> dict:
+        return {name: component.status() for name, component in self.components.items()}
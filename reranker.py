@@ -0,0 +1,115 @@
+"""Re-ranking of retrieved chunks with the question and topic labels added at enrichment.
+
+Enriched chunks carry a ``relevant_query`` (a question the chunk answers) and a ``topic``
+(see enrichment.py). Both are embedded once at ingest: relevant queries go to
+``vectors.relevant_query.f32``, one row per chunk id like the MRL full vectors, and topic
+names to ``topics.vectors.npy`` (see topic_index.py). A wider set of candidates is then
+re-scored in one matrix pass by a weighted mix of
+
+    chunk similarity       the retrieval score of the chunk text
+    query similarity       user question vs. the chunk's relevant_query
+    topic similarity       user question vs. the chunk's topic name
+
+and only the best few go into the prompt. Chunks without a relevant_query or topic are
+scored on the signals they have.
+"""
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from mrl import FullVectors
+from similarity import normalize, normalize_rows
+from topic_index import TopicIndex
+
+
+class QueryVectors(FullVectors):
+    """Embeddings of the chunks' relevant_query metadata, one row per chunk id; zero rows for chunks without one."""
+
+    FILE_NAME = "vectors.relevant_query.f32"
+
+    def lookup(self, chunk_ids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectors of the given chunks and a mask of the chunks that have one."""
+        ids = np.asarray(chunk_ids, dtype=np.int64)
+        known = self.rows(ids) >= 0
+        vectors = np.zeros((len(ids), self._dim()), dtype=np.float32)
+        if known.any():
+            vectors[known] = self.get(ids[known])
+        return vectors, known & (np.abs(vectors).sum(axis=1) > 0)
+
+
+def embed_relevant_queries(chunks, embeddings) -> Optional[np.ndarray]:
+    """Embed the relevant_query of every chunk (zero rows for chunks without one), or None if no chunk has one."""
+    queries = [chunk.metadata.get("relevant_query") for chunk in chunks]
+    present = [i for i, query in enumerate(queries) if query]
+    if not present:
+        return None
+    vectors = np.asarray(embeddings.embed_documents([queries[i] for i in present]), dtype=np.float32)
+    matrix = np.zeros((len(chunks), vectors.shape[1]), dtype=np.float32)
+    matrix[present] = vectors
+    return matrix
+
+
+class RerankConfig:
+    """Weights of the re-ranking signals and how many candidates are re-ranked into how many chunks."""
+
+    def __init__(self, enabled: bool = True, chunk_weight: float = 0.6, query_weight: float = 0.3,
+                 topic_weight: float = 0.1, candidates: int = 10, top_k: int = 5):
+        self.enabled = enabled
+        self.chunk_weight = float(chunk_weight)
+        self.query_weight = float(query_weight)
+        self.topic_weight = float(topic_weight)
+        self.candidates = int(candidates)
+        self.top_k = int(top_k)
+
+    @classmethod
+    def parse(cls, config: Union[None, bool, dict, "RerankConfig"]) -> "RerankConfig":
+        if isinstance(config, RerankConfig):
+            return config
+        if isinstance(config, dict):
+            return cls(**config)
+        return cls(enabled=config is not False)
+
+
+class Reranker:
+    """Re-scores candidate chunks of one project."""
+
+    def __init__(self, config: RerankConfig, query_vectors: Optional[QueryVectors] = None,
+                 topic_index: Optional[TopicIndex] = None):
+        self.config = config
+        self.query_vectors = query_vectors
+        self.topic_index = topic_index
+
+    @classmethod
+    def open(cls, folder: str, config: RerankConfig, topic_index: Optional[TopicIndex] = None) -> Optional["Reranker"]:
+        """The project's reranker, or None when it is disabled or the project has nothing to re-rank with."""
+        query_vectors = QueryVectors(folder) if QueryVectors.exists(folder) else None
+        has_topics = topic_index is not None and len(topic_index.vectors) > 0
+        if not config.enabled or (query_vectors is None and not has_topics):
+            return None
+        return cls(config, query_vectors, topic_index if has_topics else None)
+
+    def scores(self, query_embedding, chunk_ids: Sequence[int], chunk_scores: Sequence[float]) -> np.ndarray:
+        """Weighted mix of the candidates' chunk, query and topic similarities to the question."""
+        config = self.config
+        query = normalize(query_embedding)
+        chunk_scores = np.asarray(chunk_scores, dtype=np.float32)
+        total = np.full(len(chunk_scores), config.chunk_weight, dtype=np.float32)
+        mixed = config.chunk_weight * chunk_scores
+        for store, weight in ((self.query_vectors, config.query_weight), (self.topic_index, config.topic_weight)):
+            if store is None or not weight:
+                continue
+            vectors, present = store.lookup(chunk_ids)
+            if vectors.shape[1] != len(query):
+                continue
+            mixed += weight * present * (normalize_rows(vectors) @ query)
+            total += weight * present
+        return mixed / np.where(total == 0, 1, total)
+
+    def rerank(self, query_embedding, retrieved):
+        """The config.top_k best (document, vector, score) triples by re-ranked score."""
+        if not retrieved:
+            return retrieved
+        chunk_ids = [doc.metadata.get("chunk_id", -1) for doc, _, _ in retrieved]
+        scores = self.scores(query_embedding, chunk_ids, [score for _, _, score in retrieved])
+        order = np.argsort(-scores, kind="stable")[:self.config.top_k]
+        return [(retrieved[i][0], retrieved[i][1], float(scores[i])) for i in order]
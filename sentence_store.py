@@ -0,0 +1,181 @@
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from project_store import save_array
+from similarity import normalize_rows
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """Return (start, end) character spans of the '.'-separated sentences in text."""
+    spans = []
+    start = 0
+    for end in range(len(text) + 1):
+        if end == len(text) or text[end] == '.':
+            piece = text[start:end]
+            stripped = piece.strip()
+            if stripped:
+                offset = start + (len(piece) - len(piece.lstrip()))
+                spans.append((offset, offset + len(stripped)))
+            start = end + 1
+    return spans
+
+
+class _Blocks:
+    """Array grown by appending blocks, concatenated lazily on first access."""
+
+    def __init__(self, array: np.ndarray):
+        self._blocks = [array]
+        self.length = len(array)
+
+    def append(self, block: np.ndarray):
+        if len(block):
+            self._blocks.append(block)
+            self.length += len(block)
+
+    @property
+    def array(self) -> np.ndarray:
+        if len(self._blocks) > 1:
+            self._blocks = [np.concatenate([b for b in self._blocks if len(b)] or self._blocks[:1])]
+        return self._blocks[0]
+
+    @array.setter
+    def array(self, array: np.ndarray):
+        self._blocks = [array]
+        self.length = len(array)
+
+
+class SentenceStore:
+    """Sentence boundaries and normalized sentence embeddings for every chunk of a project.
+
+    Stored next to the FAISS index as plain .npy arrays, so a project opened read-only
+    memory-maps them: the sentence matrix and the (start, end) span of every row, plus
+    the first row and sentence count of every chunk, indexed by chunk id.
+    """
+
+    MATRIX_FILE = "sentences.npy"
+    SPANS_FILE = "sentences.spans.npy"
+    ROWS_FILE = "sentences.rows.npy"
+    COUNTS_FILE = "sentences.counts.npy"
+
+    def __init__(self, vectors: np.ndarray, spans: np.ndarray, rows: np.ndarray, counts: np.ndarray):
+        self._vectors = _Blocks(vectors)
+        self._spans = _Blocks(spans)
+        self._rows = _Blocks(rows)
+        self._counts = _Blocks(counts)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors.array
+
+    @classmethod
+    def build(cls, chunks, embeddings, batch_size: int = 256) -> "SentenceStore":
+        """Split every chunk into sentences and embed all of them in large batches."""
+        store = cls(np.zeros((0, 0), dtype=np.float32), np.zeros((0, 2), dtype=np.int32),
+                    np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32))
+        store.add(chunks, embeddings, batch_size=batch_size)
+        return store
+
+    @staticmethod
+    def prepare(chunks, embeddings, batch_size: int = 256) -> Tuple[List[List[Tuple[int, int]]], np.ndarray]:
+        """Split chunks into sentences and embed them, without touching the store."""
+        spans_per_chunk = [split_sentences(chunk.page_content) for chunk in chunks]
+        sentences = [chunk.page_content[s:e] for chunk, spans in zip(chunks, spans_per_chunk) for s, e in spans]
+        if not sentences:
+            return spans_per_chunk, np.zeros((0, 0), dtype=np.float32)
+        vectors = np.vstack([
+            np.asarray(embeddings.embed_documents(sentences[start:start + batch_size]), dtype=np.float32)
+            for start in range(0, len(sentences), batch_size)
+        ])
+        return spans_per_chunk, normalize_rows(vectors)
+
+    def append(self, chunks, spans_per_chunk: List[List[Tuple[int, int]]], vectors: np.ndarray):
+        """Append prepared sentence spans and vectors for new chunks.
+
+        Chunk ids are consecutive integers, so per-chunk entries are appended up to the
+        largest new id, leaving zero-sentence gaps for ids that never reach this store.
+        """
+        if not chunks:
+            return
+        ids = np.array([chunk.metadata['chunk_id'] for chunk in chunks], dtype=np.int64)
+        counts = np.array([len(spans) for spans in spans_per_chunk], dtype=np.int32)
+        first = self._rows.length
+        if ids.min() < first:
+            raise ValueError(f"Chunk ids must be appended in order; got {ids.min()} after {first - 1}")
+        rows = np.full(ids.max() + 1 - first, -1, dtype=np.int64)
+        chunk_counts = np.zeros(len(rows), dtype=np.int32)
+        rows[ids - first] = self._vectors.length + np.cumsum(counts) - counts
+        chunk_counts[ids - first] = counts
+        self._rows.append(rows)
+        self._counts.append(chunk_counts)
+        if len(vectors):
+            self._vectors.append(vectors)
+            self._spans.append(np.array([span for spans in spans_per_chunk for span in spans], dtype=np.int32))
+
+    def add(self, chunks, embeddings, batch_size: int = 256):
+        """Append the sentences of new chunks to the store."""
+        if not chunks:
+            return
+        spans_per_chunk, vectors = self.prepare(chunks, embeddings, batch_size)
+        self.append(chunks, spans_per_chunk, vectors)
+        print(f"Embedded {len(vectors)} sentences from {len(chunks)} chunks")
+
+    def remove(self, chunk_ids):
+        """Forget deleted chunks; their rows stay in the matrix until compact() runs."""
+        ids = np.array(list(chunk_ids), dtype=np.int64)
+        counts = np.array(self._counts.array)
+        ids = ids[(ids >= 0) & (ids < len(counts))]
+        counts[ids] = 0
+        self._counts.array = counts
+
+    @property
+    def dead_rows(self) -> int:
+        return self._vectors.length - int(self._counts.array.sum())
+
+    def compact(self, max_dead_fraction: float = 0.25) -> bool:
+        """Rewrite the matrix without the rows of deleted chunks once enough have accumulated."""
+        total = self._vectors.length
+        if not total or self.dead_rows <= max_dead_fraction * total:
+            return False
+        counts = self._counts.array.astype(np.int64)
+        rows = np.array(self._rows.array)
+        live = np.flatnonzero(counts)
+        starts = rows[live]
+        live_counts = counts[live]
+        new_starts = np.cumsum(live_counts) - live_counts
+        keep = np.arange(live_counts.sum()) + np.repeat(starts - new_starts, live_counts)
+        print(f"Compacting sentence store: dropping {total - len(keep)} dead rows")
+        rows[:] = -1
+        rows[live] = new_starts
+        self._rows.array = rows
+        self._vectors.array = self.vectors[keep]
+        self._spans.array = self._spans.array[keep]
+        return True
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = False) -> Optional["SentenceStore"]:
+        """Load a persisted store, memory-mapped if requested, or return None if there is none."""
+        paths = [os.path.join(folder, name) for name in (cls.MATRIX_FILE, cls.SPANS_FILE, cls.ROWS_FILE, cls.COUNTS_FILE)]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        return cls(*(np.load(path, mmap_mode='r' if mmap else None) for path in paths))
+
+    def save(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        save_array(os.path.join(folder, self.MATRIX_FILE), self.vectors)
+        save_array(os.path.join(folder, self.SPANS_FILE), self._spans.array)
+        save_array(os.path.join(folder, self.ROWS_FILE), self._rows.array)
+        save_array(os.path.join(folder, self.COUNTS_FILE), self._counts.array)
+
+    def get(self, chunk_id: Optional[int]) -> Optional[Tuple[List[Tuple[int, int]], np.ndarray]]:
+        """Return the sentence spans and embedding rows of a chunk, if they were precomputed."""
+        if chunk_id is None:
+            return None
+        chunk_id = int(chunk_id)
+        counts = self._counts.array
+        if chunk_id < 0 or chunk_id >= len(counts) or not counts[chunk_id]:
+            return None
+        row = int(self._rows.array[chunk_id])
+        end = row + int(counts[chunk_id])
+        return [tuple(span) for span in self._spans.array[row:end].tolist()], self.vectors[row:end]
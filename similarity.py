@@ -0,0 +1,69 @@
+"""Vectorized cosine-similarity helpers shared by retrieval, summarization and the query classifiers.
+
+Reference matrices are normalized once and every score computation is a single
+matrix product, so scoring many queries against many references never loops in Python.
+"""
+from typing import Optional
+
+import numpy as np
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """Return a float32 copy of matrix with unit-length rows (zero rows stay zero)."""
+    matrix = np.array(matrix, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1, norms)
+    return matrix
+
+
+def normalize(vector) -> np.ndarray:
+    """Return a float32 unit-length copy of a single vector."""
+    return normalize_rows(vector)[0]
+
+
+def cosine_scores(queries, references, normalized: bool = False) -> np.ndarray:
+    """Cosine similarity of every query against every reference in one matmul.
+
+    A 1-D query returns a vector of shape (n_references,), a 2-D batch returns
+    (n_queries, n_references). Pass normalized=True when both inputs already have unit rows.
+    """
+    single = np.ndim(queries) == 1
+    if not normalized:
+        queries = normalize_rows(queries)
+        references = normalize_rows(references)
+    scores = np.atleast_2d(queries) @ np.asarray(references).T
+    return scores[0] if single else scores
+
+
+def reference_centroid(references, normalized: bool = False) -> np.ndarray:
+    """Mean of the normalized references; its dot product with a unit query is the mean cosine."""
+    if not normalized:
+        references = normalize_rows(references)
+    return np.asarray(references, dtype=np.float32).mean(axis=0)
+
+
+def mean_cosine(queries, references=None, centroid: Optional[np.ndarray] = None) -> np.ndarray:
+    """Average cosine similarity of each query to a reference set, in O(d) per query."""
+    if centroid is None:
+        centroid = reference_centroid(references)
+    single = np.ndim(queries) == 1
+    scores = normalize_rows(queries) @ centroid
+    return scores[0] if single else scores
+
+
+def top_k(scores, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, using argpartition.
+
+    Works on a 1-D score vector or row-wise on a 2-D score matrix.
+    """
+    scores = np.asarray(scores)
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=-1)
@@ -0,0 +1,32 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic stand-in for the embedding model: a random unit vector per text."""
+
+    def __init__(self, dim: int = 16):
+        self.dim = dim
+
+    def _embed(self, text: str):
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+@pytest.fixture
+def embeddings():
+    return HashEmbeddings()
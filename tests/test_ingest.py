@@ -0,0 +1,93 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+import ingest
+from project_manifest import ProjectManifest
+
+
+def fake_pdfs(folder, count):
+    paths = []
+    for n in range(count):
+        path = os.path.join(folder, f"doc{n}.pdf")
+        with open(path, 'w') as file:
+            file.write(f"document {n}")
+        paths.append(path)
+    return paths
+
+
+def fake_parser(chunks_per_file, parsed):
+    """parse_pdfs stand-in yielding chunks_per_file chunks per file, two parts per file."""
+    def parse_pdfs(paths, *args, **kwargs):
+        for path in paths:
+            parsed.append(path)
+            chunks = [Document(page_content=f"{path} chunk {i}", metadata={"source": path, "page": 0})
+                      for i in range(chunks_per_file)]
+            half = chunks_per_file // 2
+            yield path, chunks[:half], False, None
+            yield path, chunks[half:], True, None
+    return parse_pdfs
+
+
+def test_batch_chunks_hands_on_files_with_the_batch_holding_their_last_chunk():
+    parsed = [("a", list(range(5)), True, None), ("b", list(range(5)), True, None), ("c", [], True, "bad")]
+    batches = list(ingest.batch_chunks(parsed, 4))
+    assert [(len(chunks), files) for chunks, files in batches] == [
+        (4, []), (4, [("a", None)]), (2, [("b", None), ("c", "bad")])
+    ]
+
+
+def test_crash_after_flush_keeps_completed_files(tmp_path, monkeypatch, embeddings):
+    monkeypatch.setattr(ingest, "PROJECTS_DIR", str(tmp_path / "projects"))
+    paths = fake_pdfs(str(tmp_path), 3)
+    parsed = []
+    monkeypatch.setattr(ingest, "parse_pdfs", fake_parser(15, parsed))
+
+    batches = 0
+
+    def crash_at_batch_6(chunks):
+        nonlocal batches
+        batches += 1
+        if batches == 6:
+            raise RuntimeError("injected")
+
+    with pytest.raises(RuntimeError, match="injected"):
+        ingest.update_project(paths, "crash", embeddings, batch_size=4, flush_every=8, workers=1,
+                              enrich=crash_at_batch_6)
+    manifest = ProjectManifest.load(str(tmp_path / "projects" / "crash"))
+    assert not manifest.complete
+    assert list(manifest.files) == [os.path.abspath(paths[0])]
+    assert manifest.files[os.path.abspath(paths[0])]["chunks"] == [[0, 15]]
+
+    parsed.clear()
+    vector_store, _ = ingest.update_project(paths, "crash", embeddings, batch_size=4, flush_every=8, workers=1)
+    assert parsed == paths[1:]
+    assert len(vector_store.docstore) == 45
+    assert ProjectManifest.load(str(tmp_path / "projects" / "crash")).complete
+
+
+def test_trained_index_gets_every_staged_vector(tmp_path, monkeypatch, embeddings):
+    monkeypatch.setattr(ingest, "PROJECTS_DIR", str(tmp_path / "projects"))
+    paths = fake_pdfs(str(tmp_path), 3)
+    monkeypatch.setattr(ingest, "parse_pdfs", fake_parser(15, []))
+    saved_indexes = []
+    save_vector_store = ingest.save_vector_store
+
+    def record_save(folder, vector_store):
+        saved_indexes.append(faiss.downcast_index(vector_store.index))
+        save_vector_store(folder, vector_store)
+
+    monkeypatch.setattr(ingest, "save_vector_store", record_save)
+    vector_store, _ = ingest.update_project(paths, "ivf", embeddings, batch_size=4, flush_every=8, workers=1,
+                                            index_spec="ivf:nlist=2,train_size=20")
+    # Flushes only start once the index is trained
+    assert saved_indexes and all(isinstance(index, faiss.IndexIVFFlat) for index in saved_indexes)
+    index = vector_store.index
+    assert isinstance(faiss.downcast_index(index), faiss.IndexIVFFlat)
+    assert index.ntotal == 45
+    ids = vector_store.docstore.live_ids()
+    texts = [vector_store.docstore.search(str(i)).page_content for i in ids]
+    assert np.allclose(index.reconstruct_batch(ids), embeddings.embed_documents(texts), atol=1e-6)
@@ -0,0 +1,22 @@
+from lexical_index import LexicalIndex, tokenize
+
+
+def test_tokenize_skips_single_character_parts():
+    assert sorted(tokenize("E-42")) == ["42", "e-42", "e42"]
+    assert sorted(tokenize("XJ-9000")) == ["9000", "xj", "xj-9000", "xj9000"]
+
+
+def test_code_hits_drop_chunks_sharing_only_part_of_the_code():
+    texts = [
+        "Error E-42 means the pump inlet is blocked; clear the inlet and restart.",
+        "Error E42 is also shown on older panels.",
+        "Torque the 42 bolts of the housing in a cross pattern.",
+    ] + [f"Routine maintenance note {i} about filters and seals." for i in range(20)]
+    index = LexicalIndex.empty()
+    index.add(list(range(len(texts))), texts)
+    hits = index.search("E-42", 5)
+    assert {chunk_id for chunk_id, _ in hits} == {0, 1, 2}
+
+    kept = index.code_hits("E-42", hits, min_score=2.0, score_ratio=0.5)
+    assert sorted(chunk_id for chunk_id, _ in kept) == [0, 1]
+    assert index.code_hits("E-42", hits, min_score=100.0, score_ratio=0.5) == []
@@ -0,0 +1,185 @@
+"""Chunk ids per topic label, for searches restricted to one topic.
+
+Enriched chunks carry a ``topic`` label (see enrichment.py). A metadata filter on the
+FAISS store is applied after the search, so a narrow topic either comes back with too few
+hits or needs a huge fetch_k. Every project therefore records the topic of each chunk:
+
+    topics.json           topic names; a topic's code is its position in the list, and
+                          topics left without chunks are dropped whenever the index is saved
+    topics.labels.npy     topic code of every chunk id, -1 for no topic or a removed chunk
+    topics.vectors.npy    embedding of every topic name, by code (used by reranker.py)
+
+A topic search then only looks at that topic's chunk ids: small topics are scored exactly
+against their stored vectors, so narrower filters are cheaper, and larger ones are searched
+through the index with an IDSelector.
+"""
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from index_spec import IndexSpec
+from project_store import save_array
+
+# Topics up to this many chunks are scored exactly instead of searched through the index
+EXACT_SEARCH_LIMIT = 20000
+
+
+class TopicIndex:
+    """Topic code of every chunk id of a project."""
+
+    NAMES_FILE = "topics.json"
+    LABELS_FILE = "topics.labels.npy"
+    VECTORS_FILE = "topics.vectors.npy"
+
+    def __init__(self, names: List[str], labels: np.ndarray, vectors: Optional[np.ndarray] = None):
+        self.names = names
+        self.labels = labels
+        self.vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        self._codes = {name: code for code, name in enumerate(names)}
+        self._chunk_ids: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def empty(cls) -> "TopicIndex":
+        return cls([], np.zeros(0, dtype=np.int32))
+
+    @classmethod
+    def exists(cls, folder: str) -> bool:
+        return all(os.path.exists(os.path.join(folder, name)) for name in (cls.NAMES_FILE, cls.LABELS_FILE))
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = False) -> Optional["TopicIndex"]:
+        """Load a project's topics, memory-mapped if requested, or return None if there are none."""
+        if not cls.exists(folder):
+            return None
+        with open(os.path.join(folder, cls.NAMES_FILE), 'r', encoding='utf-8') as file:
+            names = json.load(file)
+        vectors_path = os.path.join(folder, cls.VECTORS_FILE)
+        vectors = np.load(vectors_path) if os.path.exists(vectors_path) else None
+        return cls(names, np.load(os.path.join(folder, cls.LABELS_FILE), mmap_mode='r' if mmap else None), vectors)
+
+    @classmethod
+    def build(cls, docstore, batch_size: int = 4096) -> "TopicIndex":
+        """Record the topics of every live chunk of a project's docstore (projects created before topic search)."""
+        index = cls.empty()
+        live = docstore.live_ids()
+        for start in range(0, len(live), batch_size):
+            ids = live[start:start + batch_size].tolist()
+            index.add(ids, [docstore.search(str(i)).metadata.get("topic") for i in ids])
+        return index
+
+    def add(self, chunk_ids: Sequence[int], topics: Sequence[Optional[str]]):
+        """Record the topics of new chunks; None for chunks without one."""
+        if not len(chunk_ids):
+            return
+        labels = np.full(max(max(chunk_ids) + 1, len(self.labels)), -1, dtype=np.int32)
+        labels[:len(self.labels)] = self.labels
+        for chunk_id, topic in zip(chunk_ids, topics):
+            if topic:
+                if topic not in self._codes:
+                    self._codes[topic] = len(self.names)
+                    self.names.append(topic)
+                labels[chunk_id] = self._codes[topic]
+        self.labels = labels
+        self._chunk_ids.clear()
+
+    def embed_names(self, embeddings):
+        """Embed the topic names added since the last call."""
+        new = self.names[len(self.vectors):]
+        if new:
+            vectors = np.asarray(embeddings.embed_documents(new), dtype=np.float32)
+            self.vectors = np.vstack([self.vectors, vectors]) if len(self.vectors) else vectors
+
+    def lookup(self, chunk_ids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Topic vectors of the given chunks and a mask of the chunks that have one."""
+        ids = np.asarray(chunk_ids, dtype=np.int64)
+        codes = np.full(len(ids), -1, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self.labels))
+        codes[known] = self.labels[ids[known]]
+        present = (codes >= 0) & (codes < len(self.vectors))
+        if not present.any():
+            return np.zeros((len(ids), 0), dtype=np.float32), present
+        vectors = np.zeros((len(ids), self.vectors.shape[1]), dtype=np.float32)
+        vectors[present] = self.vectors[codes[present]]
+        return vectors, present
+
+    def remove(self, chunk_ids: Sequence[int]):
+        ids = np.array(list(chunk_ids), dtype=np.int64)
+        ids = ids[(ids >= 0) & (ids < len(self.labels))]
+        if len(ids):
+            self.labels = np.array(self.labels)
+            self.labels[ids] = -1
+            self._chunk_ids.clear()
+
+    def prune(self) -> int:
+        """Drop the topics no live chunk is labelled with any more and renumber the rest.
+
+        Returns the number of topics dropped.
+        """
+        labels = np.asarray(self.labels)
+        used = np.zeros(len(self.names), dtype=bool)
+        used[labels[labels >= 0]] = True
+        if used.all():
+            return 0
+        kept = np.flatnonzero(used)
+        codes = np.full(len(self.names) + 1, -1, dtype=np.int32)
+        codes[kept] = np.arange(len(kept), dtype=np.int32)
+        # Index -1 (no topic) maps to the trailing -1
+        self.labels = codes[labels]
+        # Embedded names are a prefix of the names, so the kept ones still are
+        self.vectors = self.vectors[kept[kept < len(self.vectors)]] if len(self.vectors) else self.vectors
+        self.names = [self.names[code] for code in kept]
+        self._codes = {name: code for code, name in enumerate(self.names)}
+        self._chunk_ids.clear()
+        return len(used) - len(kept)
+
+    def save(self, folder: str):
+        """Save the topics, first dropping the ones without live chunks."""
+        self.prune()
+        os.makedirs(folder, exist_ok=True)
+        save_array(os.path.join(folder, self.LABELS_FILE), np.asarray(self.labels))
+        vectors_path = os.path.join(folder, self.VECTORS_FILE)
+        if len(self.vectors):
+            save_array(vectors_path, self.vectors)
+        elif os.path.exists(vectors_path):
+            os.remove(vectors_path)
+        path = os.path.join(folder, self.NAMES_FILE)
+        with open(path + ".tmp", 'w', encoding='utf-8') as file:
+            json.dump(self.names, file)
+        os.replace(path + ".tmp", path)
+
+    def topics(self) -> Dict[str, int]:
+        """Chunk count of every topic that still has chunks."""
+        counts = np.bincount(self.labels[self.labels >= 0], minlength=len(self.names))
+        return {name: int(count) for name, count in zip(self.names, counts) if count}
+
+    def chunk_ids(self, topic: str) -> np.ndarray:
+        """The live chunk ids labelled with topic, in id order."""
+        if topic not in self._chunk_ids:
+            code = self._codes.get(topic)
+            ids = np.flatnonzero(np.asarray(self.labels) == code) if code is not None else np.zeros(0, dtype=np.int64)
+            self._chunk_ids[topic] = ids.astype(np.int64)
+        return self._chunk_ids[topic]
+
+
+def search_subset(index: faiss.Index, spec: IndexSpec, query_vector, chunk_ids: np.ndarray, k: int,
+                  exact_limit: int = EXACT_SEARCH_LIMIT) -> List[Tuple[int, float]]:
+    """The k nearest of the given chunk ids as (chunk id, distance) pairs in the index's metric."""
+    query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+    chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+    if not len(chunk_ids) or k <= 0:
+        return []
+    if len(chunk_ids) <= exact_limit:
+        vectors = index.reconstruct_batch(chunk_ids)
+        if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            distances = vectors @ query[0]
+            order = np.argsort(-distances, kind="stable")[:k]
+        else:
+            distances = ((vectors - query[0]) ** 2).sum(axis=1)
+            order = np.argsort(distances, kind="stable")[:k]
+        return [(int(chunk_ids[i]), float(distances[i])) for i in order]
+    selector = faiss.IDSelectorBatch(chunk_ids)
+    distances, labels = index.search(query, k, params=spec.search_parameters(selector))
+    return [(int(label), float(distance)) for label, distance in zip(labels[0], distances[0]) if label != -1]
@@ -0,0 +1,165 @@
+"""Train the query router (see query_router.py) from labelled questions.
+
+Questions the documents answer are the positives of misc/classify.py; general questions
+are its negatives plus the CLINC out-of-scope sets in data/oos_*.json when present. Both
+can be replaced with --documents / --general files: JSON lists of strings or of
+[text, label] pairs, or text files with one question per line.
+
+    python train_router.py [--model logistic|centroid] [--precision 0.95] [--output router.npz]
+
+The threshold is calibrated on a held-out fifth of the data so that questions routed past
+retrieval are general with at least the requested precision.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config import EMBEDDING_MODEL_PATH, ROUTER_PATH
+from query_router import QueryRouter
+from similarity import normalize_rows
+
+
+def load_questions(path: str) -> List[str]:
+    """Questions from a JSON list (strings or [text, label] pairs) or a text file with one per line."""
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.lower().endswith('.json'):
+            items = json.load(file)
+            return [item[0] if isinstance(item, (list, tuple)) else item for item in items]
+        return [line.strip() for line in file if line.strip()]
+
+
+def default_questions() -> Tuple[List[str], List[str]]:
+    """The labelled examples shipped with the repo: (documents, general)."""
+    from misc.classify import negatives, positives
+    documents = [line.strip() for line in positives.splitlines() if line.strip()]
+    general = [line.strip() for line in negatives.splitlines() if line.strip()]
+    for path in sorted(glob.glob(os.path.join("data", "oos_*.json"))):
+        general += load_questions(path)
+    return documents, general
+
+
+def split(labels: np.ndarray, holdout: float = 0.2, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Stratified train/validation indices."""
+    rng = np.random.default_rng(seed)
+    train, validation = [], []
+    for label in (0, 1):
+        indices = rng.permutation(np.flatnonzero(labels == label))
+        cut = max(1, int(round(len(indices) * holdout)))
+        validation.append(indices[:cut])
+        train.append(indices[cut:])
+    return np.concatenate(train), np.concatenate(validation)
+
+
+def fit_logistic(features: np.ndarray, labels: np.ndarray, l2: float = 1.0, iterations: int = 25) -> Tuple[np.ndarray, float]:
+    """Class-balanced, L2-regularized logistic regression fitted by Newton's method."""
+    n, dim = features.shape
+    design = np.hstack([features, np.ones((n, 1), dtype=np.float64)])
+    balance = np.where(labels == 1, n / (2 * labels.sum()), n / (2 * (n - labels.sum())))
+    penalty = l2 * np.eye(dim + 1)
+    penalty[-1, -1] = 0
+    coefficients = np.zeros(dim + 1)
+    for _ in range(iterations):
+        probabilities = 1 / (1 + np.exp(-(design @ coefficients)))
+        gradient = design.T @ (balance * (probabilities - labels)) + penalty @ coefficients
+        hessian = (design * (balance * probabilities * (1 - probabilities))[:, None]).T @ design + penalty
+        step = np.linalg.solve(hessian, gradient)
+        coefficients -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return coefficients[:-1], float(coefficients[-1])
+
+
+def fit_centroid(features: np.ndarray, labels: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Difference of the class centroids, centred between them."""
+    general = features[labels == 1].mean(axis=0)
+    documents = features[labels == 0].mean(axis=0)
+    return general - documents, -float((general + documents) @ (general - documents)) / 2
+
+
+def calibrate(margins: np.ndarray, labels: np.ndarray, precision: float) -> float:
+    """Lowest threshold whose routed questions are general with the given precision, else the most accurate one."""
+    values = np.unique(margins)
+    # Ascending: route everything, then every midpoint, then nothing
+    thresholds = np.concatenate([[values[0] - 1], (values[:-1] + values[1:]) / 2, [values[-1]]])
+    routed = margins[None, :] > thresholds[:, None]
+    counts = routed.sum(axis=1)
+    hits = (routed & (labels == 1)).sum(axis=1)
+    reached = (counts > 0) & (hits >= precision * counts)
+    if reached.any():
+        return float(thresholds[np.flatnonzero(reached)[0]])
+    accuracy = (routed == (labels == 1)).mean(axis=1)
+    return float(thresholds[int(np.argmax(accuracy))])
+
+
+def metrics(margins: np.ndarray, labels: np.ndarray, threshold: float) -> dict:
+    routed = margins > threshold
+    general = labels == 1
+    return {
+        "accuracy": round(float((routed == general).mean()), 4),
+        "precision": round(float(general[routed].mean()), 4) if routed.any() else None,
+        "recall": round(float(routed[general].mean()), 4) if general.any() else None,
+    }
+
+
+def train(documents: List[str], general: List[str], embeddings, model: str = "logistic",
+          precision: float = 0.95, l2: float = 1.0) -> QueryRouter:
+    texts = documents + general
+    labels = np.array([0] * len(documents) + [1] * len(general), dtype=np.float64)
+    features = normalize_rows(embeddings.embed_documents(texts)).astype(np.float64)
+    train_idx, validation_idx = split(labels)
+    if model == "logistic":
+        weights, bias = fit_logistic(features[train_idx], labels[train_idx], l2)
+    else:
+        weights, bias = fit_centroid(features[train_idx], labels[train_idx])
+    margins = features[validation_idx] @ weights + bias
+    threshold = calibrate(margins, labels[validation_idx], precision)
+    meta = {
+        "model": model,
+        "embedding_model": EMBEDDING_MODEL_PATH,
+        "dim": int(features.shape[1]),
+        "examples": {"documents": len(documents), "general": len(general)},
+        "target_precision": precision,
+        "validation": metrics(margins, labels[validation_idx], threshold),
+        "trained_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    return QueryRouter(weights, bias, threshold, meta)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Train the router that sends general questions past retrieval.")
+    parser.add_argument("--documents", nargs="*", default=None, help="Files of questions the documents answer")
+    parser.add_argument("--general", nargs="*", default=None, help="Files of general questions")
+    parser.add_argument("--model", choices=["logistic", "centroid"], default="logistic")
+    parser.add_argument("--precision", type=float, default=0.95,
+                        help="Share of routed questions that must really be general")
+    parser.add_argument("--l2", type=float, default=1.0, help="Regularization of the logistic model")
+    parser.add_argument("--output", default=ROUTER_PATH)
+    args = parser.parse_args(argv)
+
+    documents, general = default_questions()
+    if args.documents:
+        documents = [question for path in args.documents for question in load_questions(path)]
+    if args.general:
+        general = [question for path in args.general for question in load_questions(path)]
+    if not documents or not general:
+        print("Both classes need examples.")
+        return 1
+    print(f"Training {args.model} router on {len(documents)} document and {len(general)} general questions")
+
+    from model_registry import acquire_embeddings
+    embeddings = acquire_embeddings(EMBEDDING_MODEL_PATH).model
+    router = train(documents, general, embeddings, args.model, args.precision, args.l2)
+    router.save(args.output)
+    print(f"Validation: {router.meta['validation']} at threshold {router.threshold:.4f}")
+    print(f"Router saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())